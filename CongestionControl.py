@@ -0,0 +1,124 @@
+# CongestionControl.py
+
+# Congestion controllers for NewSender.py
+# Each controller adjusts a congestion window (cwnd, in packets) from ACK and loss signals,
+# and NewSender.py never has more than cwnd packets in flight.
+#
+# A controller is a dict holding its state, created by create_congestion_controller.
+# Its behaviour is looked up by name in congestionControllers, which maps each name to a pair
+# of functions (on_ack, on_loss). Adding a new controller (e.g. a rate-based one) means writing
+# these two functions and adding them to congestionControllers.
+
+# ------------------------------------  Fixed Window  ------------------------------------
+
+# cwnd never changes; this is the old behaviour of a fixed Sender window
+def fixed_on_ack(controller, numOfAckedPackets, rtt, now):
+    return
+
+def fixed_on_loss(controller, numOfPacketsInFlight, isTimeout, now):
+    return
+
+# ------------------------------------  Reno (AIMD)  ------------------------------------
+
+# Slow start: cwnd grows by one packet for every acknowledged packet, until it reaches ssthresh
+# Congestion avoidance: cwnd grows by about one packet for every window of acknowledged packets
+def reno_on_ack(controller, numOfAckedPackets, rtt, now):
+    for i in range(numOfAckedPackets):
+        if controller['cwnd'] < controller['ssthresh']:
+            controller['cwnd'] += 1
+        else:
+            controller['cwnd'] += 1 / controller['cwnd']
+
+    controller['cwnd'] = min(controller['cwnd'], controller['maxWindow'])
+
+    return
+
+# Multiplicative decrease: halve the window on loss, and start over from one packet on timeout
+def reno_on_loss(controller, numOfPacketsInFlight, isTimeout, now):
+    controller['ssthresh'] = max(numOfPacketsInFlight / 2, 2)
+    controller['cwnd'] = 1 if isTimeout else controller['ssthresh']
+
+    return
+
+# ------------------------------------  CUBIC  ------------------------------------
+
+# Parameters of CUBIC (RFC 8312)
+cubicC = 0.4
+cubicBeta = 0.7
+
+# In congestion avoidance, cwnd follows W(t) = C * (t - K)^3 + Wmax, where t is the time since the last loss
+#   and Wmax is the window at that loss. cwnd grows quickly away from Wmax, and slowly close to it
+def cubic_on_ack(controller, numOfAckedPackets, rtt, now):
+    if controller['cwnd'] < controller['ssthresh']:
+        # Slow start, same as Reno
+        controller['cwnd'] = min(controller['cwnd'] + numOfAckedPackets, controller['maxWindow'])
+        return
+
+    if controller['epochStart'] is None:
+        # First ACK in congestion avoidance since the last loss
+        controller['epochStart'] = now
+        controller['wMax'] = max(controller['wMax'], controller['cwnd'])
+        controller['k'] = (controller['wMax'] * (1 - cubicBeta) / cubicC) ** (1 / 3)
+
+    # Aim for the window W(t) should reach one RTT from now
+    t = now - controller['epochStart'] + (rtt or 0)
+    target = cubicC * (t - controller['k']) ** 3 + controller['wMax']
+
+    for i in range(numOfAckedPackets):
+        if target > controller['cwnd']:
+            controller['cwnd'] += (target - controller['cwnd']) / controller['cwnd']
+        else:
+            controller['cwnd'] += 0.01 / controller['cwnd']
+
+    controller['cwnd'] = min(controller['cwnd'], controller['maxWindow'])
+
+    return
+
+# Multiplicative decrease by cubicBeta, remembering the window at the loss as Wmax
+def cubic_on_loss(controller, numOfPacketsInFlight, isTimeout, now):
+    controller['wMax'] = controller['cwnd']
+    controller['ssthresh'] = max(controller['cwnd'] * cubicBeta, 2)
+    controller['cwnd'] = 1 if isTimeout else controller['ssthresh']
+    controller['epochStart'] = None
+
+    return
+
+# ------------------------------------  Controllers  ------------------------------------
+
+congestionControllers = {
+    'fixed': (fixed_on_ack, fixed_on_loss),
+    'reno': (reno_on_ack, reno_on_loss),
+    'cubic': (cubic_on_ack, cubic_on_loss),
+}
+
+# Create the state of the congestion controller called name
+# cwnd starts at initialWindow (maxWindow for the fixed controller) and never grows beyond maxWindow
+def create_congestion_controller(name, initialWindow, maxWindow):
+    if name not in congestionControllers:
+        raise ValueError(f'Unknown congestion controller {name}; choose one of {", ".join(congestionControllers)}')
+
+    return {
+        'name': name,
+        'cwnd': maxWindow if name == 'fixed' else min(initialWindow, maxWindow),
+        'ssthresh': maxWindow,
+        'maxWindow': maxWindow,
+        'wMax': 0,
+        'k': 0,
+        'epochStart': None,
+    }
+
+# Signal that numOfAckedPackets packets were newly acknowledged, with the current smoothed RTT (or None)
+def on_ack(controller, numOfAckedPackets, rtt, now):
+    congestionControllers[controller['name']][0](controller, numOfAckedPackets, rtt, now)
+
+    return
+
+# Signal a loss, detected by a timeout (isTimeout) or by duplicate ACKs
+def on_loss(controller, numOfPacketsInFlight, isTimeout, now):
+    congestionControllers[controller['name']][1](controller, numOfPacketsInFlight, isTimeout, now)
+
+    return
+
+# Get the number of packets that may be in flight
+def get_congestion_window(controller):
+    return max(int(controller['cwnd']), 1)
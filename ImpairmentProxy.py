@@ -0,0 +1,323 @@
+# ImpairmentProxy.py
+
+# Usage: python3 ImpairmentProxy.py -l listenPortNumber -s senderIPAddress -p senderPortNumber
+#                                   [--loss p] [--ge-p p] [--ge-r r] [--ge-loss-good p] [--ge-loss-bad p]
+#                                   [--delay seconds] [--jitter seconds] [--rate Mbps] [--queue-bytes N]
+#                                   [--reorder p] [--reorder-delay seconds] [--duplicate p] [--corrupt p]
+#                                   [--direction both|data|ack] [--spare-control 0|1] [--seed N] [--idle-timeout seconds]
+# Example: python3 ImpairmentProxy.py -l 9999 -s 127.0.0.1 -p 8888 --loss 0.02 --delay 0.01 --jitter 0.002
+# Example: python3 ImpairmentProxy.py -l 9999 -s 127.0.0.1 -p 8888 --ge-p 0.01 --ge-r 0.3 --ge-loss-bad 0.5 --rate 100
+# Then run NewSender.py with port senderPortNumber, and NewReceiver.py with port listenPortNumber:
+#     python3 NewSender.py -s 127.0.0.1 -p 8888 -t Apple.jpg OutputApple.jpg
+#     python3 NewReceiver.py -s 127.0.0.1 -p 9999
+
+# A UDP relay between Receiver and Sender that impairs the packets passing through it, like a bad network link:
+#   loss:       each packet is lost with probability --loss, or by a Gilbert-Elliott model when --ge-p is given:
+#               the link moves from a good to a bad state with probability --ge-p, and back with probability --ge-r,
+#               for every packet, and loses packets with probability --ge-loss-good (0 by default) in the good state
+#               and --ge-loss-bad (1 by default) in the bad state, so that losses come in bursts
+#   delay:      every packet is delayed by --delay seconds, plus a uniformly random jitter of up to --jitter seconds either way
+#   rate:       packets leave the link no faster than --rate megabits per second. Packets wait in a queue of
+#               --queue-bytes bytes for their turn, and packets that do not fit in it are lost (drop-tail)
+#   reordering: with probability --reorder, a packet is held back an extra --reorder-delay seconds, so that later packets overtake it
+#   duplication: with probability --duplicate, a packet is delivered twice
+#   corruption: with probability --corrupt, one random bit of the packet is flipped
+#
+# Data packets (Sender to Receiver) and ACK packets (Receiver to Sender) go through separate links with the same settings,
+#   unless --direction limits the impairments to one of them. Each link draws from its own random generator seeded from
+#   --seed, so the same packets are impaired in the same way in every run.
+# NewSender.py and NewReceiver.py do not retransmit the SYN, FIN and handshake ACK packets, so these are spared
+#   from loss, corruption and duplication unless --spare-control 0 is given.
+#
+# The proxy stops after --idle-timeout seconds without packets (never, by default), or on Ctrl-C or SIGTERM,
+#   and prints what it did to the packets of each link.
+
+import heapq
+import random
+import select
+import signal
+import struct
+import sys
+import time
+
+from socket import *
+
+pktStruct = struct.Struct('!BBBIII')
+
+# ------------------------------------  Handle Arguments  ------------------------------------
+
+# Get listenPortNumber, senderIPAddress and senderPortNumber based on sys.argv
+def setup_arguments():
+    '''
+    sys.argv[0]: ImpairmentProxy.py;    sys.argv[1]: -l
+    sys.argv[2]: <listenPortNumber>;    sys.argv[3]: -s
+    sys.argv[4]: <senderIPAddress>;     sys.argv[5]: -p
+    sys.argv[6]: <senderPortNumber>
+    '''
+    listenPortNumber = int(sys.argv[2])
+    senderIPAddress = sys.argv[4]
+    senderPortNumber = int(sys.argv[6])
+
+    return (listenPortNumber, senderIPAddress, senderPortNumber)
+
+# Get the value that follows an optional flag in sys.argv, converted to the type of defaultValue
+# If the flag is not in sys.argv, use defaultValue
+def get_optional_argument(flag, defaultValue):
+    if flag in sys.argv[7:-1]:
+        return type(defaultValue)(sys.argv[sys.argv.index(flag) + 1])
+
+    return defaultValue
+
+# ------------------------------------  Links  ------------------------------------
+
+# Create the state of a link called name, impaired if isImpaired
+def create_link(name, isImpaired, seed):
+    return {
+        'name': name,
+        'isImpaired': isImpaired,
+        'random': random.Random(f'{seed}-{name}'),
+        'isBadState': False,
+        'linkFreeTime': 0,
+        'counters': dict.fromkeys(['received', 'delivered', 'lost', 'queueDropped', 'reordered', 'duplicated', 'corrupted'], 0),
+    }
+
+# Check whether packet is part of the handshake or termination (SYN, FIN, or the ACK that ends the handshake)
+# The payload of the ACK that ends the handshake starts with the control word ACK, which options (e.g. 'ACK resume=<offset>')
+#   or a NUL byte and block signatures may follow; only its first bytes are looked at, since data packets can be large
+def is_control_packet(packet):
+    synBit, ackBit, finBit, seqNum, ackNum, checksum = pktStruct.unpack_from(packet)
+    controlWord = bytes(packet[pktStruct.size:pktStruct.size + 4])
+
+    return synBit == 1 or finBit == 1 or controlWord in (b'ACK', b'ACK ', b'ACK\0')
+
+# Decide whether the link loses its next packet, following the random or Gilbert-Elliott loss model
+def is_packet_lost(link):
+    global lossRate, geGoodToBad, geBadToGood, geLossGood, geLossBad
+
+    randomGenerator = link['random']
+
+    if geGoodToBad <= 0:
+        return randomGenerator.random() < lossRate
+
+    # Gilbert-Elliott: move between the good and bad states, then lose the packet with the probability of the new state
+    if link['isBadState']:
+        link['isBadState'] = randomGenerator.random() >= geBadToGood
+    else:
+        link['isBadState'] = randomGenerator.random() < geGoodToBad
+
+    return randomGenerator.random() < (geLossBad if link['isBadState'] else geLossGood)
+
+# Flip one random bit of packet
+def corrupt_packet(packet, randomGenerator):
+    corruptedPacket = bytearray(packet)
+    bitIndex = randomGenerator.randrange(len(corruptedPacket) * 8)
+    corruptedPacket[bitIndex // 8] ^= 1 << (bitIndex % 8)
+
+    return bytes(corruptedPacket)
+
+# Get the time packet leaves the link, after waiting for its turn behind the packets queued before it
+# Return None if the queue is full and packet is lost
+def get_departure_time(link, packet, now):
+    global rateInBitsPerSecond, queueBytes
+
+    if rateInBitsPerSecond <= 0:
+        return now
+
+    # Bytes waiting in the queue in front of packet
+    queuedBytes = max(0, link['linkFreeTime'] - now) * rateInBitsPerSecond / 8
+    if queuedBytes + len(packet) > queueBytes:
+        return None
+
+    link['linkFreeTime'] = max(now, link['linkFreeTime']) + len(packet) * 8 / rateInBitsPerSecond
+
+    return link['linkFreeTime']
+
+# Put packet on the link, to be delivered to address through outputSocket once it has been delayed
+def impair_packet(link, packet, outputSocket, address, now):
+    global delay, jitter, reorderRate, reorderDelay, duplicateRate, corruptRate, spareControlPackets, pendingPackets, packetCounter
+
+    link['counters']['received'] += 1
+    randomGenerator = link['random']
+
+    if not link['isImpaired']:
+        schedule_packet(now, packet, outputSocket, address)
+        return
+
+    isSpared = spareControlPackets and is_control_packet(packet)
+
+    if not isSpared and is_packet_lost(link):
+        link['counters']['lost'] += 1
+        return
+
+    departureTime = get_departure_time(link, packet, now)
+    if departureTime is None:
+        link['counters']['queueDropped'] += 1
+        return
+
+    if not isSpared and randomGenerator.random() < corruptRate:
+        link['counters']['corrupted'] += 1
+        packet = corrupt_packet(packet, randomGenerator)
+
+    copies = 1
+    if not isSpared and randomGenerator.random() < duplicateRate:
+        link['counters']['duplicated'] += 1
+        copies = 2
+
+    for i in range(copies):
+        deliveryTime = departureTime + delay + randomGenerator.uniform(-jitter, jitter)
+        if randomGenerator.random() < reorderRate:
+            link['counters']['reordered'] += 1
+            deliveryTime += reorderDelay
+        schedule_packet(max(deliveryTime, now), packet, outputSocket, address)
+
+    return
+
+# ------------------------------------  Deliver Packets  ------------------------------------
+
+# Deliver packet to address through outputSocket at deliveryTime
+# packetCounter keeps packets due at the same time in the order they were scheduled
+def schedule_packet(deliveryTime, packet, outputSocket, address):
+    global pendingPackets, packetCounter
+
+    heapq.heappush(pendingPackets, (deliveryTime, packetCounter, packet, outputSocket, address))
+    packetCounter += 1
+
+    return
+
+# Deliver every pending packet that is due
+def deliver_due_packets(now):
+    global pendingPackets, links
+
+    while pendingPackets and pendingPackets[0][0] <= now:
+        deliveryTime, counter, packet, outputSocket, address = heapq.heappop(pendingPackets)
+        try:
+            outputSocket.sendto(packet, address)
+        except OSError:
+            continue
+        links[outputSocket is receiverSideSocket]['counters']['delivered'] += 1
+
+    return
+
+# Get the number of seconds until the next pending packet is due, or None if there is none
+def get_time_until_next_delivery(now):
+    global pendingPackets
+
+    if not pendingPackets:
+        return None
+
+    return max(0, pendingPackets[0][0] - now)
+
+# Print what each link did to its packets
+def print_link_counters():
+    global links
+
+    for link in links.values():
+        print(f'{link["name"]}: ' + ', '.join(f'{name} {value}' for name, value in link['counters'].items()))
+
+    return
+
+# Stop on SIGTERM like on Ctrl-C, so that the link counters are printed
+def handle_sigterm(signalNumber, frame):
+    raise KeyboardInterrupt
+
+# Relay packets between Receiver and Sender until the proxy is stopped
+def perform_proxy_operation():
+    global receiverSideSocket, senderSideSocket, senderIPAddress, senderPortNumber, links, idleTimeout
+
+    receiverAddress = None
+    lastPacketTime = time.monotonic()
+
+    while True:
+        now = time.monotonic()
+        waitTime = get_time_until_next_delivery(now)
+        if idleTimeout > 0:
+            idleWaitTime = max(0, lastPacketTime + idleTimeout - now)
+            waitTime = idleWaitTime if waitTime is None else min(waitTime, idleWaitTime)
+
+        readySockets = select.select([receiverSideSocket, senderSideSocket], [], [], waitTime)[0]
+        now = time.monotonic()
+
+        for readySocket in readySockets:
+            try:
+                packet, address = readySocket.recvfrom(65535)
+            except OSError:
+                continue
+            lastPacketTime = now
+
+            if readySocket is receiverSideSocket:
+                # ACK (or handshake) packet from Receiver, relayed to Sender
+                receiverAddress = address
+                impair_packet(links[False], packet, senderSideSocket, (senderIPAddress, senderPortNumber), now)
+            elif receiverAddress is not None:
+                # Data packet from Sender, relayed to Receiver
+                impair_packet(links[True], packet, receiverSideSocket, receiverAddress, now)
+
+        deliver_due_packets(now)
+
+        if idleTimeout > 0 and not pendingPackets and now - lastPacketTime >= idleTimeout:
+            break
+
+    return
+
+# ------------------------------------  Main  ------------------------------------
+
+if __name__ == '__main__':
+    try:
+        listenPortNumber, senderIPAddress, senderPortNumber = setup_arguments()
+
+        lossRate = get_optional_argument('--loss', 0.0)
+        geGoodToBad = get_optional_argument('--ge-p', 0.0)
+        geBadToGood = get_optional_argument('--ge-r', 1.0)
+        geLossGood = get_optional_argument('--ge-loss-good', 0.0)
+        geLossBad = get_optional_argument('--ge-loss-bad', 1.0)
+        delay = get_optional_argument('--delay', 0.0)
+        jitter = get_optional_argument('--jitter', 0.0)
+        rateInBitsPerSecond = get_optional_argument('--rate', 0.0) * 1e6
+        queueBytes = get_optional_argument('--queue-bytes', 1024 * 1024)
+        reorderRate = get_optional_argument('--reorder', 0.0)
+        reorderDelay = get_optional_argument('--reorder-delay', 0.01)
+        duplicateRate = get_optional_argument('--duplicate', 0.0)
+        corruptRate = get_optional_argument('--corrupt', 0.0)
+        direction = get_optional_argument('--direction', 'both')
+        spareControlPackets = get_optional_argument('--spare-control', 1) == 1
+        seed = get_optional_argument('--seed', 1)
+        idleTimeout = get_optional_argument('--idle-timeout', 0.0)
+    except (IndexError, ValueError):
+        print('Error: Invalid arguments. Syntax: ImpairmentProxy.py -l <listenPortNumber> -s <senderIPAddress> -p <senderPortNumber> [options]')
+        exit(0)
+
+    if direction not in ('both', 'data', 'ack'):
+        print(f'Error: Unknown direction {direction}; choose one of both, data, ack.')
+        exit(0)
+
+    # links[True] carries data packets from Sender to Receiver, and links[False] carries ACK packets from Receiver to Sender
+    links = {
+        True: create_link('data', direction in ('both', 'data'), seed),
+        False: create_link('ack', direction in ('both', 'ack'), seed),
+    }
+
+    # Packets waiting on a link, as a heap of (deliveryTime, packetCounter, packet, outputSocket, address)
+    pendingPackets = []
+    packetCounter = 0
+
+    # Receiver sends to receiverSideSocket, and Sender answers to senderSideSocket
+    receiverSideSocket = socket(AF_INET, SOCK_DGRAM)
+    receiverSideSocket.bind(('', listenPortNumber))
+    senderSideSocket = socket(AF_INET, SOCK_DGRAM)
+    for proxySocket in (receiverSideSocket, senderSideSocket):
+        proxySocket.setsockopt(SOL_SOCKET, SO_SNDBUF, 4 * 1024 * 1024)
+        proxySocket.setsockopt(SOL_SOCKET, SO_RCVBUF, 4 * 1024 * 1024)
+
+    signal.signal(signal.SIGTERM, handle_sigterm)
+
+    try:
+        perform_proxy_operation()
+    except KeyboardInterrupt:
+        pass
+
+    print_link_counters()
+
+    receiverSideSocket.close()
+    senderSideSocket.close()
+
+    exit(0)
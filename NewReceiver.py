@@ -1,26 +1,395 @@
 # NewReceiver.py
 
-# Usage: python3 NewReceiver.py -s serverIPAddress -p serverPortNumber
+# Usage: python3 NewReceiver.py -s serverIPAddress -p serverPortNumber [--mode gbn|sr] [--window N] [--sack 0|1]
+#                                [--segment-size N] [--gro 0|1] [--ack-every N] [--ack-delay seconds] [--fsync 0|1]
+#                                [--checkpoint-interval bytes] [--verify 0|1] [--delta 0|1] [--stats statsFilename] [--prometheus metricsFilename] [--metrics-interval seconds]
+#                                [--trace traceFilename] [--trace-level 1|2] [--isn N]
 # Example: python3 NewReceiver.py -s 127.0.0.1 -p 8888
+# Example: python3 NewReceiver.py -s 127.0.0.1 -p 8888 --ack-every 4 --ack-delay 0.005
+# Example: python3 NewReceiver.py -s 127.0.0.1 -p 8888 --mode sr --window 32
 
 # To execute NewReceiver.py, run the Sender side program (NewSender.py) first.
 
+# Resuming: when Sender announces the name and size of its file, Receiver keeps a checkpoint of the output file next to it
+#   ('.checkpoint' added to the name) every --checkpoint-interval bytes (64 MiB by default, 0 for none): how many bytes
+#   from its start are written and synced, and their CRC-32. If a transfer stops before FIN, the next transfer of the same
+#   file offers Sender to resume from the checkpoint, and Sender does if the CRC-32 matches the same bytes of its file.
+
+# Verifying: unless turned off with --verify 0, Receiver asks Sender for the BLAKE2b digest of every block of about 1 MiB
+#   of the file, sent right after the segments of the block (and for the last block, in FIN). Each block is hashed as its
+#   content is delivered, and checked as soon as its digest arrives, so the file is never read again to verify it.
+#   Blocks that do not match are reported to Sender in ACK/FIN, and the checkpoint is kept at the first of them.
+
+# Delta transfers: when Sender asks for one (NewSender.py --delta 1) and Receiver already has a file of the name it sends,
+#   e.g. an older version of it, Receiver offers that copy in its handshake ACK (unless turned off with --delta 0), and
+#   sends the signatures of its blocks when Sender asks for them, in as many packets as they take. Sender then sends
+#   literal data and references to those blocks, and Receiver rebuilds the file next to its copy ('.delta' added to the
+#   name), which it replaces once FIN arrives.
+
 from socket import *
+import PacketTrace
+import TransferMetrics
+import collections
+import errno
+import hashlib
+import json
+import math
 import secrets
 import struct
 import sys
 import time
+import urllib.parse
 import zlib
 
 import os
 
 # ------------------------------------  Handle Files  ------------------------------------
 
-# Append content to a byte file
-def deliver_data(payload, filename):
-    with open(filename, 'ab') as bf:
-        bf.write(payload)
+# Get the path of the output file that Sender asks for as filename
+# ReceiverServer.py replaces this function, to keep output files in its directory
+def get_output_path(filename):
+    return filename
+
+# Open the byte file that the received content is written to. It stays open for the whole transfer
+# Writes are collected in a buffer of writeBufferSize bytes, so most packets do not cost a write syscall
+# When Sender announced the file size, the file is allocated at its full size first, so that it is not fragmented,
+#   and a full disk stops the transfer before any content arrives. Content then starts at outputOffset: a resumed
+#   transfer keeps the content before it. The file is opened for reading too, so that checkpoints can read it back
+def open_output_file(filename):
+    global writeBufferSize, fileSize, outputOffset
+    
+    if fileSize is None:
+        return open(filename, 'wb', buffering=writeBufferSize)
+    
+    fileDescriptor = os.open(filename, os.O_RDWR | os.O_CREAT | (0 if outputOffset else os.O_TRUNC), 0o644)
+    try:
+        preallocate_output_file(fileDescriptor, fileSize)
+    except OSError as e:
+        os.close(fileDescriptor)
+        raise OSError(e.errno, e.strerror, filename)
+    outputFile = open(fileDescriptor, 'wb', buffering=writeBufferSize)
+    outputFile.seek(outputOffset)
+    
+    return outputFile
+
+# Allocate disk space for size bytes of the output file, and extend it to size bytes
+# A full disk (or quota) is an error; where the file system cannot allocate space ahead, the file is only extended
+def preallocate_output_file(fileDescriptor, size):
+    if size > 0 and hasattr(os, 'posix_fallocate'):
+        try:
+            os.posix_fallocate(fileDescriptor, 0, size)
+            return
+        except OSError as e:
+            if e.errno in (errno.ENOSPC, errno.EDQUOT, errno.EFBIG):
+                raise
+    os.ftruncate(fileDescriptor, size)
+    
+    return
+
+# Get the offset in the output file of the content of the packet with seqNum
+# Every segment but the last has payloadBufferSize bytes, and the first one (firstDataSeqNum) starts at outputOffset
+# When blocks are verified, the digest packet that follows every segmentsPerBlock segments takes no room in the file
+def get_output_offset(seqNum):
+    global firstDataSeqNum, payloadBufferSize, outputOffset, segmentsPerBlock
+    
+    packetIndex = seqNum - firstDataSeqNum
+    if segmentsPerBlock:
+        packetIndex -= packetIndex // (segmentsPerBlock + 1)
+    
+    return outputOffset + packetIndex * payloadBufferSize
+
+# Check whether the packet with seqNum is the digest of a block, rather than content: one follows every segmentsPerBlock segments
+# In delta mode, blocks are of bytes of the file rather than segments, and digest packets are told by their 'D' instead
+def is_block_digest_packet(seqNum):
+    global firstDataSeqNum, segmentsPerBlock, deltaBlockSize
+    
+    return segmentsPerBlock and not deltaBlockSize and (seqNum - firstDataSeqNum) % (segmentsPerBlock + 1) == segmentsPerBlock
+
+# Append content to the output file, and add it to the block being hashed, if blocks are verified
+# payload is the length of the content instead, if it was already written at its offset when it arrived out of order;
+#   then the output file only moves past it, and the content is read back from the file to hash it
+def deliver_data(payload):
+    global outputFile, outputPosition, blockHasher
+    
+    if isinstance(payload, int):
+        if blockHasher is not None:
+            blockHasher.update(os.pread(outputFile.fileno(), payload, outputPosition))
+        outputFile.seek(payload, os.SEEK_CUR)
+        TransferMetrics.count_goodput(payload)
+        outputPosition += payload
+    else:
+        if blockHasher is not None:
+            blockHasher.update(payload)
+        outputFile.write(payload)
+        TransferMetrics.count_goodput(len(payload))
+        outputPosition += len(payload)
+
+    return
+
+# Keep a packet that arrived out of order in reorderBuffer, until every packet before it has been delivered
+# When Sender announced the file size, the place of the packet in the output file is known: it is written there right away,
+#   and only its length is kept. Otherwise it is copied out of the receive buffer, which will be reused before it is delivered
+# Digest packets of blocks are always copied, as they are not content
+# So are delta packets, whose place in the output file is only known once every packet before them is delivered
+def store_out_of_order_packet(seqNum, payload):
+    global reorderBuffer, fileSize, filenameReceived, outputFile, deltaBlockSize
+    
+    if fileSize is not None and filenameReceived and not is_block_digest_packet(seqNum) and not deltaBlockSize:
+        os.pwrite(outputFile.fileno(), payload, get_output_offset(seqNum))
+        reorderBuffer[seqNum] = len(payload)
+    else:
+        reorderBuffer[seqNum] = bytes(payload)
+    
+    return
+
+# ------------------------------------  Handle Checkpoints  ------------------------------------
+
+# Get the offer to resume the transfer from the checkpoint in checkpointFilename, as handshake options
+#   (resume=<offset> crc=<CRC-32>), or {} if there is no checkpoint for a file of fileSize bytes
+def get_resume_offer():
+    global checkpointFilename, fileSize
+    
+    if not checkpointFilename:
+        return {}
+    
+    try:
+        with open(checkpointFilename, 'r') as cf:
+            checkpoint = json.load(cf)
+        outputSize = os.path.getsize(checkpointFilename.removesuffix('.checkpoint'))
+    except (OSError, ValueError):
+        return {}
+    
+    if checkpoint.get('size') != fileSize or not 0 < checkpoint.get('offset', 0) <= min(fileSize, outputSize):
+        return {}
+    
+    return {'resume': checkpoint['offset'], 'crc': checkpoint['crc']}
+
+# Start the output file where the transfer resumes: at the offset in resumeOptions (from the filename packet of Sender)
+#   if it is the one Receiver offered, so that the content before it is kept. Otherwise the transfer starts over,
+#   and the checkpoint of an earlier transfer is removed
+def start_from_checkpoint(resumeOptions):
+    global resumeOffer, outputOffset, outputPosition, checkpointOffset, checkpointChecksum, blockStartOffset
+    
+    if resumeOffer and resumeOptions.get('offset') == str(resumeOffer['resume']):
+        outputOffset = resumeOffer['resume']
+        checkpointChecksum = resumeOffer['crc']
+        print(f'Resuming from byte {outputOffset} \n')
+    else:
+        remove_checkpoint()
+    
+    outputPosition, checkpointOffset, blockStartOffset = outputOffset, outputOffset, outputOffset
+    
+    return
 
+# Write a checkpoint of the output file: every byte up to get_checkpoint_position() is synced to disk first, and read back
+#   to extend the CRC-32 of the checkpoint. The checkpoint file is replaced in one step, so that it is never half-written
+def write_checkpoint():
+    global outputFile, fileSize, checkpointFilename, checkpointOffset, checkpointChecksum
+    
+    outputFile.flush()
+    os.fsync(outputFile.fileno())
+    
+    checkpointPosition = get_checkpoint_position()
+    while checkpointOffset < checkpointPosition:
+        chunk = os.pread(outputFile.fileno(), min(1024 * 1024, checkpointPosition - checkpointOffset), checkpointOffset)
+        checkpointChecksum = zlib.crc32(chunk, checkpointChecksum)
+        checkpointOffset += len(chunk)
+    
+    temporaryFilename = checkpointFilename + '.tmp'
+    with open(temporaryFilename, 'w') as cf:
+        json.dump({'size': fileSize, 'offset': checkpointOffset, 'crc': checkpointChecksum}, cf)
+        cf.flush()
+        os.fsync(cf.fileno())
+    os.replace(temporaryFilename, checkpointFilename)
+    
+    return
+
+# Remove the checkpoint in checkpointFilename, once the transfer is complete or starts over
+def remove_checkpoint():
+    global checkpointFilename
+    
+    if checkpointFilename and os.path.exists(checkpointFilename):
+        os.remove(checkpointFilename)
+    
+    return
+
+# ------------------------------------  Handle Delta  ------------------------------------
+
+# Get the block size and the number of blocks of basisFilename, the copy of the file Receiver already has, to offer Sender
+#   a delta transfer, or (0, 0) if there is none. Blocks are about the square root of the size of the copy, as in rsync,
+#   but no smaller than minDeltaBlockSize bytes, and no larger than maxDeltaBlockSize bytes, since larger blocks are less
+#   likely to be found unchanged. A last block shorter than the others has no signature, and is sent as literal data
+def get_basis_blocks():
+    global basisFilename, minDeltaBlockSize, maxDeltaBlockSize
+    
+    if not basisFilename or not os.path.isfile(basisFilename):
+        return 0, 0
+    
+    basisSize = os.path.getsize(basisFilename)
+    blockSize = min(max(math.isqrt(basisSize), minDeltaBlockSize), maxDeltaBlockSize)
+    
+    return (blockSize, basisSize // blockSize) if basisSize >= blockSize else (0, 0)
+
+# Make the payload of the handshake ACK. It offers to resume the transfer, if a checkpoint of an earlier one is kept, 
+#   or else a delta transfer from the copy of the file Receiver has, if Sender asked for one: delta=<block size>
+#   blocks=<number of blocks>. Sender asks for the signatures of the blocks after the handshake
+# A delta transfer rebuilds the file next to its copy, so it keeps no checkpoints
+def make_handshake_ack_payload():
+    global resumeOffer, deltaBlockSize, numOfBasisBlocks, basisSignatures, checkpointFilename
+    
+    resumeOffer = get_resume_offer()
+    if resumeOffer:
+        return encode_handshake_options('ACK', resumeOffer)
+    
+    deltaBlockSize, numOfBasisBlocks = get_basis_blocks()
+    if not deltaBlockSize:
+        return b'ACK'
+    
+    checkpointFilename = ''
+    basisSignatures = bytearray()
+    
+    return encode_handshake_options('ACK', {'delta': deltaBlockSize, 'blocks': numOfBasisBlocks})
+
+# Event: Receive a request for signatures from Sender: an ACK packet with 'SIGS from=<first block> count=<number of blocks>'
+# Send them in ACK packets of as many as fit in a segment, each 'SIGS from=<first block>', a NUL byte and the signatures
+# The signature of a block is its weak (Adler-32) and strong (BLAKE2b) checksum. Signatures are computed as they are first
+#   asked for, by reading the blocks of basisFilename in order, and kept in basisSignatures to answer a request again
+def send_basis_signatures(payload):
+    global ackBit, basisFilename, deltaBlockSize, numOfBasisBlocks, basisSignatures, deltaSignatureStruct, payloadBufferSize
+    
+    requestOptions = decode_handshake_options(payload)
+    try:
+        firstBlock = int(requestOptions.get('from', 0))
+        endBlock = min(firstBlock + int(requestOptions.get('count', 0)), numOfBasisBlocks)
+    except ValueError:
+        return
+    if not deltaBlockSize or firstBlock < 0:
+        return
+    
+    signatureSize = deltaSignatureStruct.size
+    if len(basisSignatures) < endBlock * signatureSize:
+        with open(basisFilename, 'rb') as bf:
+            bf.seek(len(basisSignatures) // signatureSize * deltaBlockSize)
+            while len(basisSignatures) < endBlock * signatureSize:
+                block = bf.read(deltaBlockSize)
+                basisSignatures += deltaSignatureStruct.pack(zlib.adler32(block), hashlib.blake2b(block, digest_size=16).digest())
+    
+    ackBit = 1
+    signaturesPerPacket = (payloadBufferSize - 32) // signatureSize
+    for blockIndex in range(firstBlock, endBlock, signaturesPerPacket):
+        signatures = basisSignatures[blockIndex * signatureSize:min(blockIndex + signaturesPerPacket, endBlock) * signatureSize]
+        udt_send(make_pkt(encode_handshake_options('SIGS', {'from': blockIndex}) + b'\0' + signatures))
+    ackBit = 0
+    
+    return
+
+# Deliver a delta packet: 'C', the first block and number of blocks, which are copied from the copy of the file Receiver has,
+#   or 'L' and literal data. With block digests, 'D' and the digest of the block of the file delivered since the last one
+def deliver_delta_packet(payload):
+    global basisFile, deltaBlockSize, deltaCopyStruct
+    
+    if payload[:1] == b'C':
+        kind, firstBlock, numOfBlocks = deltaCopyStruct.unpack_from(payload)
+        for blockIndex in range(firstBlock, firstBlock + numOfBlocks):
+            deliver_data(os.pread(basisFile.fileno(), deltaBlockSize, blockIndex * deltaBlockSize))
+    elif payload[:1] == b'D':
+        verify_block(bytes(payload[1:]))
+    else:
+        deliver_data(payload[1:])
+    
+    return
+
+# Replace the copy of the file Receiver had with the file rebuilt from it, once every delta packet has been delivered
+# If a block of it was bad, the rebuilt file is dropped instead, and the copy is kept for the next delta transfer
+def finish_delta_output():
+    global basisFile, basisFilename, badBlockRanges
+    
+    basisFile.close()
+    if badBlockRanges:
+        os.remove(basisFilename + '.delta')
+    else:
+        os.replace(basisFilename + '.delta', basisFilename)
+    
+    return
+
+# ------------------------------------  Handle Block Digests  ------------------------------------
+
+# Check the block delivered since blockStartOffset against its BLAKE2b digest from Sender, and start hashing the next block
+# A block that does not match is added to badBlockRanges, as the range [start, end) of bytes of the output file
+def verify_block(digest):
+    global blockHasher, blockDigestSize, blockStartOffset, outputPosition, badBlockRanges
+    
+    if blockHasher.digest() == digest:
+        TransferMetrics.count('blocksVerified')
+    else:
+        TransferMetrics.count('blocksFailed')
+        if badBlockRanges and badBlockRanges[-1][1] == blockStartOffset:
+            badBlockRanges[-1][1] = outputPosition
+        else:
+            badBlockRanges.append([blockStartOffset, outputPosition])
+    
+    blockHasher = hashlib.blake2b(digest_size=blockDigestSize)
+    blockStartOffset = outputPosition
+    
+    return
+
+# Get the offset up to which the output file may be checkpointed: outputPosition, or when blocks are verified, the start of
+#   the first bad block, or else of the block being received, so that a resumed transfer only keeps verified content
+def get_checkpoint_position():
+    global outputPosition, segmentsPerBlock, badBlockRanges, blockStartOffset
+    
+    if not segmentsPerBlock:
+        return outputPosition
+    
+    return badBlockRanges[0][0] if badBlockRanges else blockStartOffset
+
+# Get the byte ranges of the bad blocks, as 'start-end,start-end,...', to report to Sender
+# Only the first maxReportedBadRanges ranges are reported, so that the report fits in one packet
+def format_bad_block_ranges():
+    global badBlockRanges, maxReportedBadRanges
+    
+    return ','.join(f'{start}-{end}' for start, end in badBlockRanges[:maxReportedBadRanges])
+
+# Finish the output file when FIN arrives: verify the last block against its digest in the FIN payload (digest=<hex>),
+#   then flush and close the file. The checkpoint is removed, unless a block was bad: then it is kept at the start of the
+#   first bad block, so that sending the file again resends it from there
+# In a delta transfer, the rebuilt file then replaces the copy it was rebuilt from
+def finish_output_file(finPayload):
+    global segmentsPerBlock, badBlockRanges, checkpointFilename, deltaBlockSize
+    
+    finOptions = decode_handshake_options(finPayload)
+    if segmentsPerBlock and 'digest' in finOptions:
+        verify_block(bytes.fromhex(finOptions['digest']))
+    
+    if badBlockRanges and checkpointFilename:
+        write_checkpoint()
+    close_output_file()
+    if not badBlockRanges:
+        remove_checkpoint()
+    if deltaBlockSize:
+        finish_delta_output()
+    
+    return
+
+# Make the payload of the ACK/FIN packet: 'ACK/FIN', followed by the byte ranges of the bad blocks (bad=<ranges>), if any
+def make_ack_fin_payload():
+    global badBlockRanges
+    
+    if not badBlockRanges:
+        return b'ACK/FIN'
+    
+    return encode_handshake_options('ACK/FIN', {'bad': format_bad_block_ranges()})
+
+# Flush buffered content to the output file; with fsyncOutputFile, also wait until it is stored on disk
+# Then close the output file
+def close_output_file():
+    global outputFile, fsyncOutputFile
+    
+    outputFile.flush()
+    if fsyncOutputFile:
+        os.fsync(outputFile.fileno())
+    outputFile.close()
+    
     return
 
 # ------------------------------------  Handle Basic Operations  ------------------------------------ 
@@ -37,69 +406,189 @@ def setup_arguments():
         
     return (senderIPAddress, senderPortNumber)
 
+# Get the value that follows an optional flag in sys.argv, converted to the type of defaultValue
+# If the flag is not in sys.argv, use defaultValue
+def get_optional_argument(flag, defaultValue):
+    if flag in sys.argv[5:-1]:
+        return type(defaultValue)(sys.argv[sys.argv.index(flag) + 1])
+    
+    return defaultValue
+
 # Create a new UDP socket
+# Its send and receive buffers are enlarged to socketBufferSize, so that a window of large segments fits in them
 def create_udp_socket():
+    global socketBufferSize
+    
     UDPSocket = socket(AF_INET, SOCK_DGRAM)
+    UDPSocket.setsockopt(SOL_SOCKET, SO_SNDBUF, socketBufferSize)
+    UDPSocket.setsockopt(SOL_SOCKET, SO_RCVBUF, socketBufferSize)
     
     return UDPSocket
 
 # ------------------------------------  Handle Packets  ------------------------------------ 
 
+# Trace a packet sent to the peer, at trace level PACKETS
+def trace_sent_packet(packet, isRetransmit):
+    global pktStruct
+    
+    sentSynBit, sentAckBit, sentFinBit, seqNum, ackNum, checksum = pktStruct.unpack_from(packet)
+    PacketTrace.trace_packet('send', sentSynBit, sentAckBit, sentFinBit, seqNum, ackNum, len(packet), isRetransmit)
+    
+    return
+
 # Send message
-def udt_send(packet):
+def udt_send(packet, isRetransmit=False):
     global UDPSocket, senderIPAddress, senderPortNumber
     
     UDPSocket.sendto(packet, (senderIPAddress, senderPortNumber))
+    TransferMetrics.count_sent_packet(len(packet), isRetransmit)
+    
+    if PacketTrace.traceLevel >= PacketTrace.PACKETS:
+        trace_sent_packet(packet, isRetransmit)
     
     return
 
+# Turn on UDP GRO (generic receive offload), so that the kernel can hand over several datagrams from Sender
+#   coalesced into one buffer, with one recvmsg call. Return whether it is on: it needs Linux 5.0 or later
+def enable_udp_gro():
+    global UDPSocket, UDP_GRO
+    
+    if not sys.platform.startswith('linux'):
+        return False
+    
+    try:
+        UDPSocket.setsockopt(SOL_UDP, UDP_GRO, 1)
+    except OSError:
+        return False
+    
+    return True
+
+# Get the next buffer of receiveBufferRing to receive into
+# A buffer is only reused after all the other buffers in the ring, by which time its packets have been handled
+def get_next_receive_buffer():
+    global receiveBufferRing, receiveBufferIndex
+    
+    receiveBufferIndex = (receiveBufferIndex + 1) % len(receiveBufferRing)
+    
+    return receiveBufferRing[receiveBufferIndex]
+
 # Receive response
+# Packets are received straight into a preallocated buffer of receiveBufferRing, and returned as memoryviews of it, 
+#   so no new bytes object is created for a packet, and its payload is not copied on its way to the output file
+# With UDP GRO, one recvmsg call may return several packets of the same size back to back, and the size of each
+#   in its control message. They are split into receivedPackets, and handed out one at a time by the following calls
 def udt_rcv():
-    global UDPSocket, messageBufferSize
+    global UDPSocket, messageBufferSize, groEnabled, receivedPackets, groBufferSize, groSizeStruct, UDP_GRO
     
-    response, (socketServer, socketPort) = UDPSocket.recvfrom(messageBufferSize)
+    if receivedPackets:
+        TransferMetrics.count_received_packet(len(receivedPackets[0][0]))
+        return receivedPackets.popleft()
+    
+    receiveBuffer = get_next_receive_buffer()
+    
+    if not groEnabled:
+        responseSize, (socketServer, socketPort) = UDPSocket.recvfrom_into(receiveBuffer, messageBufferSize)
+        TransferMetrics.count_received_packet(responseSize)
         
-    return response, (socketServer, socketPort)
+        return receiveBuffer[:responseSize], (socketServer, socketPort)
+    
+    responseSize, ancdata, flags, (socketServer, socketPort) = UDPSocket.recvmsg_into([receiveBuffer[:groBufferSize]], CMSG_SPACE(groSizeStruct.size))
+    
+    segmentSize = responseSize
+    for level, controlType, data in ancdata:
+        if level == SOL_UDP and controlType == UDP_GRO:
+            segmentSize = groSizeStruct.unpack_from(data)[0]
+    
+    # Each packet is a view of its part of receiveBuffer, so splitting does not copy them
+    for start in range(0, responseSize, segmentSize):
+        receivedPackets.append((receiveBuffer[start:min(start + segmentSize, responseSize)], (socketServer, socketPort)))
+    
+    TransferMetrics.count_received_packet(len(receivedPackets[0][0]))
+    return receivedPackets.popleft()
 
 # Generate a random ISN for Receiver from range [0, 2^32)
 def generate_random_initial_sequence_number():
     return secrets.randbelow(2 ** 32)
 
+# Sequence numbers are 32-bit on the wire, so they wrap around at seqNumModulus (2^32)
+# Inside Receiver they keep counting up instead, so that comparisons and ranges still work across the wrap
+def wrap_seq_num(seqNum):
+    global seqNumModulus
+    
+    return seqNum % seqNumModulus
+
+# Get the counting-up seq num that a 32-bit seq num from the wire stands for, using serial number arithmetic (RFC 1982):
+#   it is the one closest to referenceSeqNum, i.e. less than 2^31 before or after it
+def unwrap_seq_num(wireSeqNum, referenceSeqNum):
+    global seqNumModulus
+    
+    distance = (wireSeqNum - referenceSeqNum) % seqNumModulus
+    if distance >= seqNumModulus // 2:
+        distance -= seqNumModulus
+    
+    return referenceSeqNum + distance
+
 # Generate an unsigned int of 32-bit (or 4 bytes) checksum for the payload
 def generate_checksum(payload):
     return zlib.crc32(payload)
 
-# Print every information about a packet
-def print_pkt_info(synBit, ackBit, finBit, seqNum, ackNum, checksum, payload):
-    print('Seq Num:', seqNum) # 4 bytes
-    print('Ack Num:', ackNum) # 4 bytes
-    print('Checksum:', checksum) # 4 bytes
-    #print(f'Payload: {payload} \n') # up to 1024 bytes
-    
-    return 
-
 # Generate a header and make a packet for payload. Header size: (1-byte * 3) + (4-byte * 3) = 15 bytes
 def make_pkt(payload):
-    global receiverSeqNum, receiverAckNum, synBit, ackBit, finBit, pktFormat
+    global receiverSeqNum, receiverAckNum, synBit, ackBit, finBit, pktStruct
     
     checksum = generate_checksum(payload)
         
-    print('Receiver Packet Info:')
-    print_pkt_info(synBit, ackBit, finBit, receiverSeqNum, receiverAckNum, checksum, payload)
-    
-    pkt = struct.pack(pktFormat, synBit, ackBit, finBit, receiverSeqNum, receiverAckNum, checksum) + payload
+    pkt = pktStruct.pack(synBit, ackBit, finBit, wrap_seq_num(receiverSeqNum), wrap_seq_num(receiverAckNum), checksum) + payload
     
     return pkt
 
+# Get the SACK blocks for the packets in reorderBuffer: up to maxSackBlocks ranges [start, end) of consecutive seq nums
+def get_sack_blocks():
+    global reorderBuffer, maxSackBlocks
+    
+    sackBlocks = []
+    for seqNum in sorted(reorderBuffer):
+        if sackBlocks and sackBlocks[-1][1] == seqNum:
+            sackBlocks[-1][1] = seqNum + 1
+        elif len(sackBlocks) < maxSackBlocks:
+            sackBlocks.append([seqNum, seqNum + 1])
+        else:
+            break
+    
+    return sackBlocks
+
+# Generate an ACK packet in the preallocated ackBuffer, so that no new packet is created for each ACK
+# The payload is empty, unless SACK was negotiated: then it has the SACK blocks, 8 bytes (start, end) each
+def make_ack_pkt():
+    global receiverSeqNum, receiverAckNum, synBit, ackBit, finBit, pktStruct, sackBlockStruct, ackBuffer, headerBufferSize, emptyPayloadChecksum, sackEnabled
+    
+    sackBlocks = get_sack_blocks() if sackEnabled else []
+    for i, (start, end) in enumerate(sackBlocks):
+        sackBlockStruct.pack_into(ackBuffer, headerBufferSize + i * sackBlockStruct.size, wrap_seq_num(start), wrap_seq_num(end))
+    
+    payload = memoryview(ackBuffer)[headerBufferSize:headerBufferSize + len(sackBlocks) * sackBlockStruct.size]
+    checksum = generate_checksum(payload) if sackBlocks else emptyPayloadChecksum
+    
+    pktStruct.pack_into(ackBuffer, 0, synBit, ackBit, finBit, wrap_seq_num(receiverSeqNum), wrap_seq_num(receiverAckNum), checksum)
+    
+    return memoryview(ackBuffer)[:headerBufferSize + len(payload)]
+
 # Decompose the pkt into header and payload parts
 def decompose_pkt(pkt):
-    global pktFormat
+    global pktStruct, headerBufferSize
+    
+    # pkt is a memoryview of a receive buffer, so its payload is a view too, rather than a copy
+    receivedSynBit, receivedAckBit, receivedFinBit, seqNum, ackNum, checksum = pktStruct.unpack_from(pkt)
+    payload = pkt[headerBufferSize:]
     
-    receivedSynBit, receivedAckBit, receivedFinBit, seqNum, ackNum, checksum = struct.unpack(pktFormat, pkt[:15])
-    payload = pkt[15:]
+    if PacketTrace.traceLevel >= PacketTrace.PACKETS:
+        PacketTrace.trace_packet('rcv', receivedSynBit, receivedAckBit, receivedFinBit, seqNum, ackNum, len(pkt))
     
-    print('Receiver received from Sender:')
-    print_pkt_info(receivedSynBit, receivedAckBit, receivedFinBit, seqNum, ackNum, checksum, payload)
+    # Sender's seq num is close to the next one expected (receiverAckNum), and its ack num is close to receiverSeqNum
+    # A SYN packet carries the ISN of Sender, which is taken as it is: there is nothing to unwrap it against yet
+    if not receivedSynBit:
+        seqNum = unwrap_seq_num(seqNum, receiverAckNum)
+    ackNum = unwrap_seq_num(ackNum, receiverSeqNum)
     
     return receivedSynBit, receivedAckBit, receivedFinBit, seqNum, ackNum, checksum, payload
 
@@ -107,26 +596,84 @@ def decompose_pkt(pkt):
 def is_corrupted(payload, providedChecksum):    
     return generate_checksum(payload) != providedChecksum
 
+# Make a handshake payload: the control word, followed by options as space-separated key=value pairs
+def encode_handshake_options(controlWord, options):
+    return ' '.join([controlWord] + [f'{key}={value}' for key, value in options.items()]).encode()
+
+# Get the options (key=value pairs, as strings) from a handshake payload
+# Peers that do not negotiate anything send only the control word, which gives no options
+def decode_handshake_options(payload):
+    words = bytes(payload).decode(errors='replace').split()[1:]
+    
+    return dict(word.split('=', 1) for word in words if '=' in word)
+
 # ------------------------------------  Handle Relaying Packets  ------------------------------------ 
 
+# Use the options Sender accepted in its SYN/ACK packet
+def accept_handshake_options(payload):
+    global protocolMode, sackEnabled, payloadBufferSize, fileSize, checkpointInterval, checkpointFilename, segmentsPerBlock, blockHasher, blockDigestSize, badBlockRanges, basisFilename
+    
+    # Use the protocol mode accepted by Sender. Senders that do not negotiate only support GBN, without SACK
+    acceptedOptions = decode_handshake_options(payload)
+    protocolMode = acceptedOptions.get('mode', 'gbn')
+    sackEnabled = acceptedOptions.get('sack') == '1'
+    
+    # Receive packets of the segment size chosen by Sender; senders that do not negotiate use 1009-byte segments
+    payloadBufferSize = int(acceptedOptions.get('mss', payloadBufferSize))
+    
+    # The size of the file, if Sender announced it (None otherwise)
+    fileSize = int(acceptedOptions['size']) if 'size' in acceptedOptions else None
+    
+    # Checkpoints are kept if Sender announced the size and name of the file too, next to its output file
+    filenameOfSender = urllib.parse.unquote(acceptedOptions.get('name', ''))
+    if checkpointInterval and fileSize is not None and os.path.basename(filenameOfSender):
+        checkpointFilename = get_output_path(filenameOfSender) + '.checkpoint'
+    else:
+        checkpointFilename = ''
+    
+    # Sender follows every block of segmentsPerBlock segments with its digest, if it accepted to hash blocks (0 if not)
+    segmentsPerBlock = int(acceptedOptions.get('block', 0)) if acceptedOptions.get('hash') == 'blake2b' else 0
+    blockHasher = hashlib.blake2b(digest_size=blockDigestSize) if segmentsPerBlock else None
+    badBlockRanges = []
+    
+    # If Sender asked for a delta transfer, the file it would be rebuilt from is the output file of the same name
+    basisFilename = get_output_path(filenameOfSender) if acceptedOptions.get('delta') == '1' and os.path.basename(filenameOfSender) else ''
+    
+    return
+
 def perform_three_way_handshake():
-    global UDPSocket, messageBufferSize, synBit, ackBit, receiverSeqNum, receiverAckNum
+    global UDPSocket, messageBufferSize, payloadBufferSize, headerBufferSize, requestedPayloadBufferSize, synBit, ackBit, receiverSeqNum, receiverAckNum, protocolMode, receiverWindowSize, ackDelay, sackEnabled, firstDataSeqNum, blockHashRequested, deltaRequested, handshakeAckPacket
         
     # Receiver sends SYN packet with its ISN (X) to Sender
+    # The SYN also requests a protocol mode and SACK, and advertises the size of the reorder buffer, the largest segment
+    #   size (mss) Receiver can take, and the longest it delays an ACK (ackdelay), for the RTO of Sender. It may ask for block digests too
     synBit, ackBit = 1, 0
-    synPacket = make_pkt(b'SYN')
+    requestedOptions = {'mode': protocolMode, 'window': receiverWindowSize, 'sack': int(sackEnabled), 'mss': requestedPayloadBufferSize, 'ackdelay': ackDelay}
+    if blockHashRequested:
+        requestedOptions['hash'] = 'blake2b'
+    if deltaRequested:
+        requestedOptions['delta'] = 1
+    synPacket = make_pkt(encode_handshake_options('SYN', requestedOptions))
     udt_send(synPacket)
     receiverSeqNum += 1 # Increment Receiver seq num b/c of the phantom byte
         
     # Receiver receives SYN/ACK packet sent by Sender
     response = udt_rcv()[0]
-    seqNum = decompose_pkt(response)[3]
+    receivedSynBit, receivedAckBit, receivedFinBit, seqNum, ackNum, checksum, payload = decompose_pkt(response)
     receiverAckNum = seqNum + 1 # set Receiver ack num to be Sender seq num
+    
+    # The first packet is the filename, and file content starts with the one after it
+    firstDataSeqNum = receiverAckNum + 1
+    
+    accept_handshake_options(payload)
+    messageBufferSize = headerBufferSize + payloadBufferSize
         
     # Receiver sends ACK packet with Sender's ISN + 1 (Y+1) to Sender
+    # It offers to resume the transfer, if a checkpoint of an earlier transfer of the file is kept, or a delta transfer
+    # It is kept, to be sent again if the SYN/ACK arrives again
     synBit, ackBit = 0, 1
-    ackPacket = make_pkt(b'ACK')
-    udt_send(ackPacket)
+    handshakeAckPacket = make_pkt(make_handshake_ack_payload())
+    udt_send(handshakeAckPacket)
     
     synBit, ackBit = 0, 0
        
@@ -134,64 +681,252 @@ def perform_three_way_handshake():
 
 # Receiver receives connection termination upon receiving every segment in input file
 def perform_connection_termination():
-    global ackBit, finBit, receiverSeqNum, receiverAckNum
+    global UDPSocket, ackBit, finBit, receiverSeqNum, receiverAckNum, finTimeout, maxFinAttempts
     
     receiverAckNum += 1
     
-    # Receiver sends FIN/ACK packet to Sender
+    # Receiver sends FIN/ACK packet to Sender, with the bad blocks, if any
     ackBit, finBit = 1, 1
-    ackFinPacket = make_pkt(b'ACK/FIN')
-    udt_send(ackFinPacket)
+    ackFinPacket = make_pkt(make_ack_fin_payload())
     receiverSeqNum += 1
     
     # Receiver receives ACK packet sent by Sender
-    response = udt_rcv()[0]
-    decompose_pkt(response)
-    receiverAckNum += 1
+    # FIN/ACK is sent again when Sender repeats its FIN (the FIN/ACK was lost), or when no ACK arrives within finTimeout,
+    #   up to maxFinAttempts times. After that, Receiver stops waiting: the file is already complete
+    # Corrupted packets, and data packets that were retransmitted before FIN, are skipped
+    for attempt in range(maxFinAttempts):
+        udt_send(ackFinPacket, attempt > 0)
+        deadline = time.monotonic() + finTimeout
+        try:
+            while True:
+                UDPSocket.settimeout(max(0, deadline - time.monotonic()))
+                response = udt_rcv()[0]
+                receivedSynBit, receivedAckBit, receivedFinBit, seqNum, ackNum, checksum, payload = decompose_pkt(response)
+                if receivedFinBit == 1 and not is_corrupted(payload, checksum):
+                    break
+        except (timeout, BlockingIOError):
+            continue
+        if receivedAckBit == 1:
+            receiverAckNum += 1
+            break
+    UDPSocket.settimeout(None)
     
     ackBit, finBit = 0, 0
     
     return
 
-def perform_receiver_operation():
-    global UDPSocket, receiverAckNum, sndpkt, fileSize, payloadBufferSize, filename
+# Deliver a packet that was received in order: the first one is the filename, and the rest are file content,
+#   or digests of blocks of it. receiverAckNum is the seq num of the packet
+# The filename may be followed by a NUL byte and 'RESUME offset=<offset>', if Sender resumes the transfer from there
+# Once the output file may be checkpointed checkpointInterval bytes further than the last checkpoint, a new one is written
+def deliver_packet(payload):
+    global filename, filenameReceived, outputFile, receiverAckNum, checkpointFilename, checkpointOffset, checkpointInterval, deltaBlockSize, basisFile, basisFilename
     
-    # Used to keep track of whether filename is already receiver by Receiver or not
-    filenameReceived = False
+    if not filenameReceived:
+        # Received filename from Sender
+        filenamePayload, separator, resumePayload = bytes(payload).partition(b'\0')
+        filename = filenamePayload.decode()
+        start_from_checkpoint(decode_handshake_options(resumePayload))
+        if deltaBlockSize:
+            # Rebuild the file next to the copy it is rebuilt from
+            basisFile = open(basisFilename, 'rb', buffering=0)
+            outputFile = open_output_file(filename + '.delta')
+        else:
+            outputFile = open_output_file(filename)
+        filenameReceived = True
+    elif is_block_digest_packet(receiverAckNum):
+        # Received the digest of the block just delivered from Sender
+        verify_block(bytes(payload))
+    elif deltaBlockSize:
+        # Received a delta packet from Sender
+        deliver_delta_packet(payload)
+    else: 
+        # Received file content from Sender 
+        deliver_data(payload)
+    
+    if checkpointFilename and get_checkpoint_position() - checkpointOffset >= checkpointInterval:
+        write_checkpoint()
+    
+    return
+
+# Send an ACK packet for every in-order packet received so far. GBN ACKs are cumulative, 
+#   so the ACK carries the seq num of the last in-order packet (receiverAckNum - 1)
+def send_cumulative_ack():
+    global receiverAckNum, unacknowledgedPackets, ackDeadline
+    
+    receiverAckNum -= 1
+    sndpkt = make_ack_pkt()
+    udt_send(sndpkt)
+    # Revert current ack number back to receiverAckNum
+    receiverAckNum += 1
+    
+    # Nothing is waiting to be acknowledged anymore; stop the delayed ACK timer
+    unacknowledgedPackets = 0
+    ackDeadline = None
+    
+    return
+
+# Get the current time in seconds on the monotonic clock, used by the delayed ACK timer
+# Simulator.py replaces this function with its virtual clock
+def get_current_time():
+    return time.monotonic()
+
+# Get the number of seconds until a delayed ACK has to be sent, or None if no ACK is pending
+def get_time_until_ack_deadline():
+    global ackDeadline
+    
+    if ackDeadline is None:
+        return None
+    
+    return max(0, ackDeadline - get_current_time())
+
+# Send an ACK packet for only the packet with seqNum (Selective Repeat mode)
+def send_selective_ack(seqNum):
+    global receiverAckNum
+    
+    nextExpectedSeqNum = receiverAckNum
+    receiverAckNum = seqNum
+    sndpkt = make_ack_pkt()
+    udt_send(sndpkt)
+    # Revert current ack number back to the next expected seq num
+    receiverAckNum = nextExpectedSeqNum
+    
+    return
+
+# Deliver every packet in reorderBuffer that is now in order, sliding the receive window
+def deliver_buffered_packets():
+    global receiverAckNum, reorderBuffer
+    
+    while receiverAckNum in reorderBuffer:
+        deliver_packet(reorderBuffer.pop(receiverAckNum))
+        receiverAckNum += 1
+    
+    return
+
+# Event: Receive a data packet correctly in Selective Repeat mode
+# receiverAckNum is the start of the receive window (the next in-order seq num), 
+#   and packets within the window that arrive out of order wait in reorderBuffer
+def handle_sr_data_packet(seqNum, payload):
+    global receiverAckNum, receiverWindowSize, reorderBuffer
+    
+    if receiverAckNum <= seqNum < receiverAckNum + receiverWindowSize:
+        # Deliver the packet if it is the next in order, or keep it until every packet before it has been delivered
+        # Either way, acknowledge it right away
+        if seqNum in reorderBuffer:
+            TransferMetrics.count('duplicatePackets')
+        elif seqNum > receiverAckNum:
+            TransferMetrics.count('outOfOrderPackets')
+            store_out_of_order_packet(seqNum, payload)
+        send_selective_ack(seqNum)
+        if seqNum == receiverAckNum:
+            deliver_packet(payload)
+            receiverAckNum += 1
+        deliver_buffered_packets()
+    elif receiverAckNum - receiverWindowSize <= seqNum < receiverAckNum:
+        # Already delivered, but its ACK might have been lost; acknowledge it again
+        TransferMetrics.count('duplicatePackets')
+        send_selective_ack(seqNum)
+    
+    return
+
+# Get statistics about the transfer: the transfer metrics, and the protocol mode
+def get_stats():
+    global protocolMode
+    
+    stats = TransferMetrics.get_stats()
+    stats['protocolMode'] = protocolMode
+    
+    return stats
+
+# Write statistics about the transfer to the JSON file statsFilename
+def write_stats(statsFilename):
+    with open(statsFilename, 'w') as f:
+        json.dump(get_stats(), f, indent=4)
+    
+    return
+
+# Event: Receive a data packet (anything but FIN) from Sender
+def handle_data_packet(seqNum, payload, isCorrupted):
+    global receiverAckNum, receiverWindowSize, reorderBuffer, protocolMode, sackEnabled, unacknowledgedPackets, ackDeadline, ackEveryNPackets, ackDelay
+    
+    if protocolMode == 'sr':
+        # Selective Repeat: every correct packet is acknowledged on its own, and corrupted ones are dropped
+        if not isCorrupted:
+            handle_sr_data_packet(seqNum, payload)
+    elif not isCorrupted and receiverAckNum == seqNum:
+        # Received in-order packet correctly from Sender
+        deliver_packet(payload)
+        # Increment current ack number by one
+        receiverAckNum += 1
+        
+        # Send an acknowledgement packet once every ackEveryNPackets in-order packets, 
+        #   or when the delayed ACK timer times out, whichever comes first
+        # If the packet filled a gap in front of packets held for SACK, deliver them and acknowledge right away
+        unacknowledgedPackets += 1
+        if reorderBuffer:
+            deliver_buffered_packets()
+            send_cumulative_ack()
+        elif unacknowledgedPackets >= ackEveryNPackets:
+            send_cumulative_ack()
+        elif ackDeadline is None:
+            ackDeadline = get_current_time() + ackDelay
+    else:
+        # Received out-of-order packet. 
+        # With SACK, a correct packet within the receive window is kept, so that it does not have to be resent
+        if not isCorrupted:
+            TransferMetrics.count('duplicatePackets' if seqNum < receiverAckNum or seqNum in reorderBuffer else 'outOfOrderPackets')
+        if sackEnabled and not isCorrupted and receiverAckNum < seqNum < receiverAckNum + receiverWindowSize and seqNum not in reorderBuffer:
+            store_out_of_order_packet(seqNum, payload)
+        # Now send a acknowledgement packet with largest correct ack number (receiverAckNum - 1) to Sender, 
+        #   right away so that Sender learns about the gap without waiting for the delayed ACK timer
+        send_cumulative_ack()
+    
+    return
+
+def perform_receiver_operation():
+    global UDPSocket, handshakeAckPacket
     
     # Receiver should do the following operation endlessly, until receiving FIN packet from Sender
     while True:
-        # Event: Receive packet from Receiver
-        rcvpkt = udt_rcv()[0]
+        # Event: Receive packet from Receiver, waiting no longer than the delayed ACK timer allows
+        UDPSocket.settimeout(get_time_until_ack_deadline())
+        try:
+            rcvpkt = udt_rcv()[0]
+        except (timeout, BlockingIOError):
+            # Event: Delayed ACK timer times out
+            send_cumulative_ack()
+            continue
+        
+        TransferMetrics.write_prometheus_if_due()
+        
         if rcvpkt:
             receivedSynBit, receivedAckBit, receivedFinBit, seqNum, ackNum, checksum, payload = decompose_pkt(rcvpkt)
-            if not is_corrupted(payload, checksum) and receivedFinBit == 1:
+            isCorrupted = is_corrupted(payload, checksum)
+            if isCorrupted:
+                TransferMetrics.count('corruptedPackets')
+            
+            if not isCorrupted and receivedFinBit == 1:
                 # Every in input file was received. Now receive FIN packet from Sender
+                # The file is flushed (and synced) first, so that acknowledging FIN means every byte is written
                 print('Hello, world')
+                if PacketTrace.traceLevel >= PacketTrace.EVENTS:
+                    PacketTrace.trace_event('fin')
+                finish_output_file(payload)
+                UDPSocket.settimeout(None)
                 perform_connection_termination()
                 break
-            elif not is_corrupted(payload, checksum) and receiverAckNum == seqNum:
-                # Received in-order packet correctly from Sender
-                if not filenameReceived:
-                    # Received filename from Sender
-                    filename = payload.decode()
-                    filenameReceived = True
-                else: 
-                    # Received file content from Sender 
-                    # Now send an acknowledgement packet with current ack number (receiverAckNum) back to Sender.
-                    # Then, increment current ack number by one
-                    deliver_data(payload, filename)
-                sndpkt = make_pkt(b'')
-                udt_send(sndpkt)
-                receiverAckNum += 1
-            else:
-                # Received out-of-order packet. 
-                # Now send a acknowledgement packet with largest correct ack number (receiverAckNum - 1) to Sender.
-                receiverAckNum -= 1
-                sndpkt = make_pkt(b'')
-                udt_send(sndpkt)
-                # Revert current ack number back to receievrAckNum
-                receiverAckNum += 1
+            
+            if not isCorrupted and receivedSynBit == 1 and receivedAckBit == 1:
+                # Sender sent its SYN/ACK again, since the ACK that completes the handshake was lost: send it again
+                udt_send(handshakeAckPacket, True)
+                continue
+            
+            if not isCorrupted and receivedAckBit == 1:
+                # Sender asks for the signatures of the blocks of the copy of the file Receiver offered for a delta transfer
+                send_basis_signatures(payload)
+                continue
+            
+            handle_data_packet(seqNum, payload, isCorrupted)
                 
     return
             
@@ -204,19 +939,48 @@ if __name__ == '__main__':
     
     # Buffer size of a packet 
     # 15 bytes for header (1-byte for each SYN, ACK and FIN bit, 4-byte for each seqNum, ackNum, checksum)
-    # Up to 1009 bytes for payload
+    # Up to 1009 bytes for payload, unless a larger segment size is negotiated during the handshake
+    # The largest segment fits in one UDP datagram: 65507 bytes, minus the header
     headerBufferSize = 15 # 15 bytes
     payloadBufferSize = 1009 # 1009 bytes
     messageBufferSize = headerBufferSize + payloadBufferSize # 1024 bytes
+    maxPayloadBufferSize = 65507 - headerBufferSize # 65492 bytes
+    
+    # Size of the socket send and receive buffers
+    socketBufferSize = 4 * 1024 * 1024 # 4 MiB
+    
+    # UDP GRO: packets coalesced by the kernel arrive in one buffer of up to 64 KiB, and wait in receivedPackets
+    # Python does not define UDP_GRO, so its value is the one from the Linux headers
+    UDP_GRO = 104
+    groSizeStruct = struct.Struct('=i')
+    groBufferSize = 65535 # 65535 bytes
+    receivedPackets = collections.deque()
+    
+    # Preallocated buffers that packets are received into, used in turn
+    # Each one can hold the largest packet, or a batch of packets coalesced by UDP GRO
+    receiveBufferRingSize = 4
+    receiveBufferRing = [memoryview(bytearray(groBufferSize)) for i in range(receiveBufferRingSize)]
+    receiveBufferIndex = 0
     
     # Receiver SYN, ACK and FIN flag bits
     synBit, ackBit, finBit = 0, 0, 0
     
     pktFormat = '!BBBIII'
+    pktStruct = struct.Struct(pktFormat)
+    
+    # Every ACK packet is generated in this reusable buffer: a header, followed by up to maxSackBlocks SACK blocks
+    sackBlockStruct = struct.Struct('!II')
+    maxSackBlocks = 4
+    ackBuffer = bytearray(headerBufferSize + maxSackBlocks * sackBlockStruct.size)
+    emptyPayloadChecksum = generate_checksum(b'')
         
     # Initialization of Receiver seq num and ack num
     # Assume receiverSeqNum = X, receiverAckNum = 0
-    receiverSeqNum = generate_random_initial_sequence_number()
+    # An ISN can be chosen with --isn, e.g. close to 2^32 to check that seq nums wrap around correctly
+    seqNumModulus = 2 ** 32
+    receiverSeqNum = get_optional_argument('--isn', -1)
+    if receiverSeqNum < 0:
+        receiverSeqNum = generate_random_initial_sequence_number()
     receiverAckNum = 0
     
     # ------------------------------------  Basic Setup  ------------------------------------ 
@@ -224,12 +988,93 @@ if __name__ == '__main__':
     # Get global values from sys.argv
     senderIPAddress, senderPortNumber = setup_arguments()
     
+    # The largest segment size Receiver asks Sender to use
+    requestedPayloadBufferSize = min(get_optional_argument('--segment-size', maxPayloadBufferSize), maxPayloadBufferSize)
+    
+    # Protocol mode requested from Sender: 'gbn' (Go-Back-N) or 'sr' (Selective Repeat)
+    # In Selective Repeat mode, or GBN mode with SACK (selective acknowledgements in ACK packets),
+    #   packets within receiverWindowSize that arrive out of order are kept in reorderBuffer
+    protocolMode = get_optional_argument('--mode', 'gbn')
+    receiverWindowSize = get_optional_argument('--window', 16)
+    sackEnabled = get_optional_argument('--sack', 1) == 1
+    reorderBuffer = {}
+    
+    # ACK policy (GBN mode): acknowledge every ackEveryNPackets in-order packets, or ackDelay seconds after an unacknowledged one
+    ackEveryNPackets = get_optional_argument('--ack-every', 2)
+    ackDelay = get_optional_argument('--ack-delay', 0.002)
+    
+    # FIN/ACK is sent up to maxFinAttempts times, waiting finTimeout seconds for Sender's last ACK after each
+    finTimeout = 1 # 1 second
+    maxFinAttempts = 5
+    
+    # Output file policy: write through a buffer of writeBufferSize bytes, and fsync the file at FIN if fsyncOutputFile
+    writeBufferSize = 1024 * 1024 # 1 MiB
+    fsyncOutputFile = get_optional_argument('--fsync', 1)
+    
+    # In-order packets received since the last ACK, and when the delayed ACK timer times out (None if stopped)
+    unacknowledgedPackets = 0
+    ackDeadline = None
+    
     # Create Receiver UDP socket
     UDPSocket = create_udp_socket()
     
+    # Receive batches of packets with UDP GRO where the kernel supports it, unless turned off with --gro 0
+    groEnabled = get_optional_argument('--gro', 1) == 1 and enable_udp_gro()
+    
     # The filename used to store the requested file from Sender
     # It will have the exact name as Sender's filename2
+    # Used to keep track of whether filename is already receiver by Receiver or not
     filename = ''
+    filenameReceived = False
+    
+    # The output file, opened once the filename is received
+    outputFile = None
+    
+    # The size of the file, if Sender announces it during the handshake. Content is then also written at its offset in the
+    #   output file: the first segment (firstDataSeqNum) at outputOffset, and each one after it payloadBufferSize bytes further
+    fileSize = None
+    firstDataSeqNum = 0
+    outputOffset = 0
+    
+    # Checkpoints: written every checkpointInterval bytes to checkpointFilename ('' if none are kept for this transfer)
+    # Content up to outputPosition has been written, and up to checkpointOffset, with CRC-32 checkpointChecksum, is synced
+    # resumeOffer is the offer to resume from a checkpoint made to Sender during the handshake ({} if none)
+    checkpointInterval = get_optional_argument('--checkpoint-interval', 64 * 1024 * 1024)
+    checkpointFilename = ''
+    outputPosition = 0
+    checkpointOffset = 0
+    checkpointChecksum = 0
+    resumeOffer = {}
+    
+    # Block digests, asked from Sender unless --verify 0: every block of segmentsPerBlock segments (0 if Sender sends none)
+    #   is hashed into blockHasher from blockStartOffset on, and checked against the BLAKE2b digest of blockDigestSize bytes
+    #   that follows it. Blocks that do not match are kept in badBlockRanges, and up to maxReportedBadRanges reported to Sender
+    blockHashRequested = get_optional_argument('--verify', 1) == 1
+    blockDigestSize = 32 # 32 bytes
+    segmentsPerBlock = 0
+    blockHasher = None
+    blockStartOffset = 0
+    badBlockRanges = []
+    maxReportedBadRanges = 16
+    
+    # Delta transfers, offered to Sender unless --delta 0, from basisFilename (opened as basisFile) in blocks of deltaBlockSize
+    #   bytes (0 if the transfer is not a delta), numOfBasisBlocks of them. The signatures computed so far are kept in
+    #   basisSignatures. Signatures and references to blocks are packed as in NewSender.py
+    deltaRequested = get_optional_argument('--delta', 1) == 1
+    deltaSignatureStruct = struct.Struct('!I16s')
+    deltaCopyStruct = struct.Struct('!cII')
+    minDeltaBlockSize = 4096 # 4 KiB
+    maxDeltaBlockSize = 64 * 1024 # 64 KiB
+    basisFilename = ''
+    basisFile = None
+    numOfBasisBlocks = 0
+    basisSignatures = bytearray()
+    deltaBlockSize = 0
+    
+    # Write a trace of connection events (--trace-level 1) or of every packet as well (--trace-level 2, the default)
+    traceFilename = get_optional_argument('--trace', '')
+    if traceFilename:
+        PacketTrace.open_trace(traceFilename, get_optional_argument('--trace-level', PacketTrace.PACKETS))
     
     # ------------------------------------  Handshake  ------------------------------------ 
     
@@ -247,18 +1092,49 @@ if __name__ == '__main__':
     print(f'\nreceiverSeqNum: {receiverSeqNum}')
     print(f'receiverAckNum: {receiverAckNum} \n')
     
+    if PacketTrace.traceLevel >= PacketTrace.EVENTS:
+        PacketTrace.trace_event('connected', mode=protocolMode, sack=sackEnabled, mss=payloadBufferSize)
+    
     # ------------------------------------  Receiver Operation  ------------------------------------ 
+    
+    # Transfer metrics are written to the stats file, and to a Prometheus text file every metricsInterval seconds
+    statsFilename = get_optional_argument('--stats', '')
+    TransferMetrics.start_metrics('receiver', get_optional_argument('--prometheus', ''), get_optional_argument('--metrics-interval', 1.0))
         
-    perform_receiver_operation()
+    try:
+        perform_receiver_operation()
+    except OSError as e:
+        print('Error: %s - %s.' % (e.filename, e.strerror))
+        exit(0)
+    except KeyboardInterrupt:
+        # Keep a checkpoint of what was received so far, so that the transfer can resume from it
+        if checkpointFilename and outputFile is not None and not outputFile.closed:
+            write_checkpoint()
+            print(f'\nStopped; checkpoint written at byte {checkpointOffset}')
+        # A delta transfer cannot resume: the file it was rebuilding is removed, and the copy it was rebuilt from kept
+        if basisFile is not None and not basisFile.closed:
+            basisFile.close()
+            outputFile.close()
+            os.remove(basisFilename + '.delta')
+        exit(0)
+    
+    if statsFilename:
+        write_stats(statsFilename)
+    TransferMetrics.write_prometheus()
     
     # Close UDP socket
     UDPSocket.close()
     
+    PacketTrace.close_trace()
+    
     # Print out the amount of time used for executing this program
     endTime = time.time()
     print('Time lapsed in seconds: {:0.2f}'.format(endTime - startTime))
     
-    # For testing with Simulator
-    os.system('python3 FileComparer.py apple.jpg OutputApple.jpg')
+    # Report whether every block of the file matched its digest from Sender
+    if badBlockRanges:
+        print(f'Error: {filename} has bad blocks at bytes {format_bad_block_ranges()}.')
+    elif segmentsPerBlock:
+        print(f'{filename}: {TransferMetrics.counters["blocksVerified"]} blocks verified with BLAKE2b')
     
     
\ No newline at end of file
@@ -1,16 +1,41 @@
 # NewSender.py
 
 # Usage: python3 NewSender.py -s senderIPAddress -p senderPortNumber -t filename1 filename2
+#                              [--cc fixed|reno|cubic] [--max-window N] [--segment-size N] [--gso 0|1]
+#                              [--stats statsFilename] [--prometheus metricsFilename] [--metrics-interval seconds]
+#                              [--trace traceFilename] [--trace-level 1|2] [--isn N] [--connect serverIPAddress:serverPortNumber]
+#                              [--stripes N] [--delta 0|1]
 # Example: python3 NewSender.py -s 127.0.0.1 -p 8888 -t Apple.jpg OutputApple.jpg
+# Example: python3 NewSender.py -s 127.0.0.1 -p 0 -t Apple.jpg OutputApple.jpg --connect 127.0.0.1:9000
+# Example: python3 NewSender.py -s 127.0.0.1 -p 0 -t Large.bin OutputLarge.bin --connect 127.0.0.1:9000 --stripes 4
+# Example: python3 NewSender.py -s 127.0.0.1 -p 8888 -t Apple.jpg OutputApple.jpg --cc cubic --max-window 512 --stats stats.json
+# Example: python3 NewSender.py -s 127.0.0.1 -p 8888 -t Large.bin OutputLarge.bin --delta 1
+
+# Delta mode (--delta 1): if Receiver already has a copy of the file (e.g. an older version of it), it offers it in the
+#   handshake, and Sender fetches the signature of each of its blocks right after: a weak checksum (Adler-32) and a strong
+#   one (BLAKE2b), in as many packets as they take. Sender looks for
+#   those blocks at every offset of its file, rolling the weak checksum one byte at a time, and only sends what is not
+#   in them as literal data; blocks Receiver has are sent as references to them. The search goes along with the transfer,
+#   a packet at a time. Rolling costs Python time for every byte that is not found, so after 1 MiB without finding a
+#   block, Sender only checks one window per block (and rolls over one block in every 64), until it finds one and rolls
+#   again from there: delta mode pays off when most of the file is unchanged.
 
 from pathlib import Path
 from socket import *
+import PacketTrace
+import TransferMetrics
+import CongestionControl
+import hashlib
+import heapq
+import json
 import math
+import os
 import secrets
+import selectors
 import struct
 import sys
-import threading
 import time
+import urllib.parse
 import zlib
 
 # ------------------------------------  Handle Files  ------------------------------------
@@ -19,31 +44,302 @@ import zlib
 def get_file_size(filename):
     return Path(filename).stat().st_size
 
-# Read content in bytes from the string file
-def read_file_content(filename):
-    content = b''
-    
-    # Read all bytes from the file
-    with open(filename, 'rb') as bf:
-        content = bf.read()
-
-    return content
+# Open the string file for reading segments on demand
+# Unbuffered, so that each segment is read straight from the file with no extra copy in a read-ahead buffer
+def open_input_file(filename):
+    return open(filename, 'rb', buffering=0)
 
-# Get a payload from the input file. Mostly it is 1009 bytes, but the last payload could have less
-def get_one_payload_from_input_file(segmentIndex, numOfTotalSegments):
-    global fileContent, payloadBufferSize
+# Load a payload from the input file into buffer. Mostly it is payloadBufferSize bytes (1009 by default), but the last payload could have less
+# Only the requested segment is read, so the memory used by Sender is bounded by its window rather than the file size
+# Return the number of bytes loaded into buffer
+# In striped mode, the input file of this Sender is the byte range of the file that starts at inputOffset
+def load_one_payload_from_input_file(segmentIndex, numOfTotalSegments, buffer):
+    global inputFile, inputOffset, fileSize, payloadBufferSize
     
     startingIndex = segmentIndex * payloadBufferSize
 
     if segmentIndex != numOfTotalSegments - 1:
-        # Regular segment; have 1009 bytes of payload
-        endingIndex = startingIndex + payloadBufferSize
-        payload = fileContent[startingIndex:endingIndex]
+        # Regular segment; have payloadBufferSize bytes of payload
+        payloadSize = payloadBufferSize
     else:
-        # Last segment; might have less than 1009 bytes of payload
-        payload = fileContent[startingIndex:]
+        # Last segment; might have less than payloadBufferSize bytes of payload
+        payloadSize = fileSize - startingIndex
+    
+    # Read the segment straight into buffer, without creating an intermediate bytes object
+    inputFile.seek(inputOffset + startingIndex)
+    inputFile.readinto(buffer[:payloadSize])
+    
+    return payloadSize
+
+# Get the CRC-32 of the string file, or of its first length bytes, read in chunks of 1 MiB
+def get_file_checksum(filename, length=None):
+    checksum = 0
+    with open(filename, 'rb') as f:
+        while length is None or f.tell() < length:
+            chunk = f.read(1024 * 1024 if length is None else min(1024 * 1024, length - f.tell()))
+            if not chunk:
+                break
+            checksum = zlib.crc32(chunk, checksum)
+    
+    return checksum
+
+# ------------------------------------  Handle Stripes  ------------------------------------
+
+# Split the input file into numOfStripes byte ranges, and start a Sender process for each range
+# Each process returns from here with the manifest of its stripe, and sends its range over its own session with
+#   the receiver server. The manifest ties the stripes together: the ID and size of the whole transfer, the CRC-32
+#   of the whole input file, and the byte range of the stripe. The server writes each range at its offset of one output file,
+#   and checks the whole file once every stripe has been written
+# The process that started them waits for them, and exits once they are all done
+def start_stripes(numOfStripes):
+    global filename1, fileSize
+    
+    stripeLength = max(-(-fileSize // numOfStripes), 1)
+    stripeRanges = [(offset, min(stripeLength, fileSize - offset)) for offset in range(0, fileSize, stripeLength)] or [(0, 0)]
+    transferManifest = {'transfer': format(secrets.randbelow(2 ** 64), '016x'), 'size': fileSize,
+                        'crc': get_file_checksum(filename1), 'stripes': len(stripeRanges)}
+    
+    stripeProcessIds = []
+    for stripeIndex, (offset, length) in enumerate(stripeRanges):
+        processId = os.fork()
+        if processId == 0:
+            return dict(transferManifest, stripe=stripeIndex, offset=offset, length=length)
+        stripeProcessIds.append(processId)
+    
+    numOfFailedStripes = 0
+    for processId in stripeProcessIds:
+        if os.waitstatus_to_exitcode(os.waitpid(processId, 0)[1]) != 0:
+            numOfFailedStripes += 1
+    
+    print(f'Stripes sent: {len(stripeRanges) - numOfFailedStripes} / {len(stripeRanges)}')
+    exit(1 if numOfFailedStripes else 0)
+
+# Get the name of the stats, Prometheus or trace file of this stripe: filename with '.stripe<N>' before its extension
+# Without stripes, it is filename itself
+def get_stripe_filename(filename):
+    global stripeManifest
+    
+    if not filename or not stripeManifest:
+        return filename
+    
+    root, extension = os.path.splitext(filename)
+    
+    return f'{root}.stripe{stripeManifest["stripe"]}{extension}'
+
+# ------------------------------------  Handle Delta  ------------------------------------
+
+# Generate the delta packets that rebuild the input file from the basis file of Receiver, which has blocks of deltaBlockSize
+#   bytes with signatures (a packed weak and strong checksum each). A window of deltaBlockSize bytes rolls over the input file:
+#   where its weak checksum, then its strong one, matches a block, the window is sent as a reference to that block and
+#   jumps past it; otherwise it moves on by one byte, and that byte is sent as literal data
+# Each delta packet is ('C', offset, firstBlock, numOfBlocks) for up to maxDeltaCopyBlocks consecutive blocks Receiver has,
+#   that make up the input file from offset on, or ('L', offset, length, 0) for up to payloadBufferSize - 1 bytes of literal
+#   data at offset. Packets are generated one at a time, as they are sent, so the search for blocks goes along with the transfer
+# Rolling the window costs Python time for every byte, so it stops rolling once it has rolled over maxUnmatchedDeltaBytes
+#   bytes without finding a block. From there on, it only probes the windows one block apart, which costs one weak checksum
+#   in C for every block: that finds blocks Receiver has at the same distance from the last match. Every deltaProbesPerRoll
+#   probes, it rolls over one block again, to find blocks that moved by other distances. Either way, the first block found
+#   starts rolling again from there, so matching goes on up to the end of the file
+# The window rolls over deltaReadSize bytes of the input file at a time, so the search uses no more memory than that
+# With block digests, a reference stands for no more blocks than make up blockHashSize bytes, so that digest blocks stay about that size
+def generate_delta_packets(signatures):
+    global inputFile, fileSize, deltaBlockSize, deltaSignatureStruct, payloadBufferSize, maxDeltaCopyBlocks, maxUnmatchedDeltaBytes, deltaProbesPerRoll, deltaReadSize, segmentsPerBlock, blockHashSize
+    
+    # Blocks by weak checksum, then by strong checksum
+    blockIndexes = {}
+    for blockIndex, (weakChecksum, strongChecksum) in enumerate(deltaSignatureStruct.iter_unpack(signatures)):
+        blockIndexes.setdefault(weakChecksum, {}).setdefault(strongChecksum, blockIndex)
+    
+    blockSize, modulus, maxLiteralSize = deltaBlockSize, 65521, payloadBufferSize - 1
+    maxCopyBlocks = min(maxDeltaCopyBlocks, -(-blockHashSize // blockSize)) if segmentsPerBlock else maxDeltaCopyBlocks
+    
+    # Get the literal data from start up to end as packets of up to maxLiteralSize bytes
+    def get_literal_packets(start, end):
+        return (('L', offset, min(maxLiteralSize, end - offset), 0) for offset in range(start, end, maxLiteralSize))
+    
+    # The literal data not sent yet starts at literalStart, and the search for a block started again at searchStart
+    # The window rolls up to rollEnd, and then probes windows one block apart, counting the probes in probesSinceRoll
+    # A reference to blocks is held back in copyPacket as long as the blocks after them could be added to it
+    literalStart, searchStart = 0, 0
+    rollEnd, probesSinceRoll = maxUnmatchedDeltaBytes, 0
+    copyPacket = None
+    if blockIndexes and fileSize >= blockSize:
+        # data holds the bytes of the input file from dataStart up to dataEnd
+        i = 0
+        dataStart, data = 0, os.pread(inputFile.fileno(), deltaReadSize, 0)
+        dataEnd = len(data)
+        checksum = zlib.adler32(data[0:blockSize])
+        a, b = checksum & 0xffff, checksum >> 16
+        while True:
+            strongChecksums = blockIndexes.get(checksum)
+            blockIndex = None
+            if strongChecksums is not None:
+                blockIndex = strongChecksums.get(hashlib.blake2b(data[i - dataStart:i - dataStart + blockSize], digest_size=16).digest())
+            
+            if blockIndex is not None:
+                if literalStart < i:
+                    if copyPacket:
+                        yield copyPacket
+                        copyPacket = None
+                    yield from get_literal_packets(literalStart, i)
+                if copyPacket and copyPacket[2] + copyPacket[3] == blockIndex and copyPacket[3] < maxCopyBlocks:
+                    copyPacket = ('C', copyPacket[1], copyPacket[2], copyPacket[3] + 1)
+                else:
+                    if copyPacket:
+                        yield copyPacket
+                    copyPacket = ('C', i, blockIndex, 1)
+                i += blockSize
+                literalStart, searchStart = i, i
+                rollEnd, probesSinceRoll = i + maxUnmatchedDeltaBytes, 0
+                if i + blockSize > fileSize:
+                    break
+                if i + blockSize > dataEnd:
+                    dataStart, data = i, os.pread(inputFile.fileno(), deltaReadSize, i)
+                    dataEnd = i + len(data)
+                checksum = zlib.adler32(data[i - dataStart:i - dataStart + blockSize])
+                a, b = checksum & 0xffff, checksum >> 16
+                continue
+            
+            if i < rollEnd:
+                # Roll the window on by one byte (Adler-32: a sums the bytes in the window, b sums the running values of a)
+                if i + blockSize >= fileSize:
+                    break
+                if i + blockSize >= dataEnd:
+                    dataStart, data = i, os.pread(inputFile.fileno(), deltaReadSize, i)
+                    dataEnd = i + len(data)
+                outByte, inByte = data[i - dataStart], data[i - dataStart + blockSize]
+                a = (a - outByte + inByte) % modulus
+                b = (b - blockSize * outByte + a - 1) % modulus
+                checksum = (b << 16) | a
+                i += 1
+            else:
+                # Probe the next window a whole number of blocks from searchStart, and roll over one block after enough probes
+                i = searchStart + ((i - searchStart) // blockSize + 1) * blockSize
+                if i + blockSize > fileSize:
+                    break
+                if i + blockSize > dataEnd:
+                    dataStart, data = i, os.pread(inputFile.fileno(), deltaReadSize, i)
+                    dataEnd = i + len(data)
+                checksum = zlib.adler32(data[i - dataStart:i - dataStart + blockSize])
+                a, b = checksum & 0xffff, checksum >> 16
+                probesSinceRoll += 1
+                if probesSinceRoll == deltaProbesPerRoll:
+                    rollEnd, probesSinceRoll = i + blockSize, 0
+            
+            # Send the literal data the window has passed as soon as it fills a packet
+            while i - literalStart >= maxLiteralSize:
+                if copyPacket:
+                    yield copyPacket
+                    copyPacket = None
+                yield ('L', literalStart, maxLiteralSize, 0)
+                literalStart += maxLiteralSize
+
+    if copyPacket:
+        yield copyPacket
+    yield from get_literal_packets(literalStart, fileSize)
+    
+    return
+
+# Use the offer of Receiver in its handshake ACK to send the file as a delta (delta=<block size> blocks=<number of blocks>),
+#   from the signatures of the blocks of its copy of the file, which are fetched from Receiver first
+def accept_delta_offer(offerOptions):
+    global deltaBlockSize, deltaPackets, resumeOffset
+    
+    if 'delta' not in offerOptions or resumeOffset:
+        return
+    
+    deltaBlockSize = int(offerOptions['delta'])
+    deltaPackets = generate_delta_packets(fetch_basis_signatures(int(offerOptions.get('blocks', 0))))
+    
+    return
+
+# Fetch the signatures of the numOfBlocks blocks of the copy of the file Receiver has, after the handshake
+# Sender asks for them with an ACK packet (the only one Sender sends before FIN): 'SIGS from=<first block> count=<number
+#   of blocks>', up to signatureRequestPackets packets of them at a time. Receiver answers with packets of as many as fit
+#   in a segment: 'SIGS from=<first block>', a NUL byte and the signatures
+# Signatures that do not arrive within a second are asked for again, from the first one missing; after maxConnectAttempts
+#   requests in a row that bring none, Sender gives up
+def fetch_basis_signatures(numOfBlocks):
+    global UDPSocket, ackBit, payloadBufferSize, deltaSignatureStruct, signatureRequestPackets, maxConnectAttempts, receiverIPAddress, receiverPortNumber
+    
+    signatureSize = deltaSignatureStruct.size
+    maxRequestedBlocks = signatureRequestPackets * ((payloadBufferSize - 32) // signatureSize)
+    signatures = bytearray(numOfBlocks * signatureSize)
+    isReceived = bytearray(numOfBlocks)
+    firstMissingBlock = 0
+    requestsWithoutProgress = 0
+    
+    ackBit = 1
+    UDPSocket.settimeout(1)
+    while firstMissingBlock < numOfBlocks:
+        if requestsWithoutProgress == maxConnectAttempts:
+            raise TimeoutError(f'No signatures from receiver {receiverIPAddress}:{receiverPortNumber}')
+        requestEnd = min(firstMissingBlock + maxRequestedBlocks, numOfBlocks)
+        request = encode_handshake_options('SIGS', {'from': firstMissingBlock, 'count': requestEnd - firstMissingBlock})
+        udt_send(make_pkt(request), requestsWithoutProgress > 0)
+        requestsWithoutProgress += 1
+        
+        # Receive signatures until every one asked for has arrived, skipping corrupted packets and anything else
+        try:
+            while firstMissingBlock < requestEnd:
+                response = udt_rcv()[0]
+                receivedSynBit, receivedAckBit, receivedFinBit, seqNum, ackNum, checksum, payload = decompose_pkt(response)
+                if is_corrupted(payload, checksum) or bytes(payload[:4]) != b'SIGS':
+                    continue
+                responseOptions, separator, responseSignatures = bytes(payload).partition(b'\0')
+                firstBlock = int(decode_handshake_options(responseOptions).get('from', -1))
+                endBlock = firstBlock + len(responseSignatures) // signatureSize
+                if firstBlock < 0 or endBlock > numOfBlocks:
+                    continue
+                signatures[firstBlock * signatureSize:endBlock * signatureSize] = responseSignatures[:(endBlock - firstBlock) * signatureSize]
+                isReceived[firstBlock:endBlock] = b'\1' * (endBlock - firstBlock)
+                while firstMissingBlock < numOfBlocks and isReceived[firstMissingBlock]:
+                    firstMissingBlock += 1
+                    requestsWithoutProgress = 0
+        except timeout:
+            continue
+    UDPSocket.settimeout(None)
+    ackBit = 0
+    
+    return bytes(signatures)
+
+# Get the next delta packet to send, generating it if it was not yet; None once every one has been sent
+def get_next_delta_packet():
+    global deltaPackets, nextDeltaPacket
+    
+    if nextDeltaPacket is None:
+        nextDeltaPacket = next(deltaPackets, None)
+    
+    return nextDeltaPacket
+
+# Load the next delta packet into buffer: 'C' and the first block and number of blocks, for blocks Receiver has,
+#   or 'L' and the literal data. Return the number of bytes loaded into buffer
+# With block digests, the content the packet stands for is hashed too: copied blocks are read from the input file for it,
+#   and its bytes are counted in bytesInBlock
+def load_one_delta_payload(buffer):
+    global inputFile, nextDeltaPacket, deltaCopyStruct, deltaBlockSize, deltaCopiedBytes, segmentsPerBlock, blockHasher, bytesInBlock
+    
+    kind, offset, lengthOrFirstBlock, numOfBlocks = get_next_delta_packet()
+    nextDeltaPacket = None
+    
+    if kind == 'C':
+        deltaCopyStruct.pack_into(buffer, 0, b'C', lengthOrFirstBlock, numOfBlocks)
+        deltaCopiedBytes += numOfBlocks * deltaBlockSize
+        if segmentsPerBlock:
+            for blockOffset in range(offset, offset + numOfBlocks * deltaBlockSize, deltaBlockSize):
+                blockHasher.update(os.pread(inputFile.fileno(), deltaBlockSize, blockOffset))
+            bytesInBlock += numOfBlocks * deltaBlockSize
+        
+        return deltaCopyStruct.size
     
-    return payload
+    buffer[0:1] = b'L'
+    inputFile.seek(offset)
+    inputFile.readinto(buffer[1:1 + lengthOrFirstBlock])
+    if segmentsPerBlock:
+        blockHasher.update(buffer[1:1 + lengthOrFirstBlock])
+        bytesInBlock += lengthOrFirstBlock
+    
+    return 1 + lengthOrFirstBlock
 
 # ------------------------------------  Handle Basic Operations  ------------------------------------ 
 
@@ -63,12 +359,56 @@ def setup_arguments():
 
     return (senderIPAddress, senderPortNumber, filename1, filename2)
 
+# Get the value that follows an optional flag in sys.argv, converted to the type of defaultValue
+# If the flag is not in sys.argv, use defaultValue
+def get_optional_argument(flag, defaultValue):
+    if flag in sys.argv[8:-1]:
+        return type(defaultValue)(sys.argv[sys.argv.index(flag) + 1])
+    
+    return defaultValue
+
 # Create a new UDP socket
+# Its send and receive buffers are enlarged to socketBufferSize, so that a window of large segments fits in them
 def create_udp_socket():
+    global socketBufferSize
+    
     UDPSocket = socket(AF_INET, SOCK_DGRAM)
+    UDPSocket.setsockopt(SOL_SOCKET, SO_SNDBUF, socketBufferSize)
+    UDPSocket.setsockopt(SOL_SOCKET, SO_RCVBUF, socketBufferSize)
     
     return UDPSocket
 
+# Get the MTU of the path to address as known by the kernel, with path MTU discovery turned on
+# Return None where it is not available: IP_MTU and IP_MTU_DISCOVER are Linux-only, and Python does not define them
+def get_path_mtu(address):
+    if not sys.platform.startswith('linux'):
+        return None
+    
+    IP_MTU_DISCOVER, IP_PMTUDISC_DO, IP_MTU = 10, 2, 14
+    probeSocket = socket(AF_INET, SOCK_DGRAM)
+    try:
+        probeSocket.setsockopt(IPPROTO_IP, IP_MTU_DISCOVER, IP_PMTUDISC_DO)
+        probeSocket.connect(address)
+        pathMtu = probeSocket.getsockopt(IPPROTO_IP, IP_MTU)
+    except OSError:
+        pathMtu = None
+    finally:
+        probeSocket.close()
+    
+    return pathMtu
+
+# Get the largest payload Sender can send to address in one packet: the segment size set with --segment-size,
+#   or else the largest one that fits in the path MTU without IP fragmentation (28 bytes go to the IP and UDP headers)
+def get_max_payload_size(address):
+    global headerBufferSize, payloadBufferSize, maxPayloadBufferSize
+    
+    maxPayloadSize = get_optional_argument('--segment-size', 0)
+    if not maxPayloadSize:
+        pathMtu = get_path_mtu(address)
+        maxPayloadSize = pathMtu - 28 - headerBufferSize if pathMtu else payloadBufferSize
+    
+    return min(maxPayloadSize, maxPayloadBufferSize)
+
 # Bind UDP socket with tuple <senderIPAddress, senderPortNumber>
 def bind_socket_to_address_and_port():
     global UDPSocket, senderIPAddress, senderPortNumber
@@ -80,37 +420,211 @@ def bind_socket_to_address_and_port():
 
 # ------------------------------------  Handle Timer  ------------------------------------ 
 
-# Provide feedback of being in timer while spinning
-def in_timer():
-    print('in timer')
-    
-    return
+# Get the current time in seconds on the monotonic clock, used by every timer and RTT measurement
+# Simulator.py replaces this function with its virtual clock
+def get_current_time():
+    return time.monotonic()
 
-# Start a new timer that will timeout after 5 seconds
+# Start (or restart) the retransmission timer. It times out retransmissionTimeout seconds from now
+# There is only one timer per connection: it is a deadline on the monotonic clock, checked by the Sender loop
 def start_timer():
-    timer = threading.Timer(0, in_timer)
+    global timerDeadline, retransmissionTimeout
     
-    # Start timer
-    timer.start()
-    timer.join(timeout=5)
+    timerDeadline = get_current_time() + retransmissionTimeout
     
-    return timer
+    return
 
-# Stop an existing timer
-def stop_timer(timer):    
-    # Cancel current timer
-    timer.cancel()
+# Stop the retransmission timer
+def stop_timer():
+    global timerDeadline
+    
+    timerDeadline = None
         
     return
 
+# Start (or restart) the timer of one packet in Selective Repeat mode, where every packet in flight has its own timer
+# Deadlines are kept in a heap, so the earliest one is found without scanning every packet
+def start_packet_timer(seqNum):
+    global packetDeadlines, packetTimerHeap, retransmissionTimeout
+    
+    packetDeadlines[seqNum] = get_current_time() + retransmissionTimeout
+    heapq.heappush(packetTimerHeap, (packetDeadlines[seqNum], seqNum))
+    
+    return
+
+# Stop the timer of one packet in Selective Repeat mode
+# Its entry in the heap is left behind, and skipped once it no longer matches packetDeadlines
+def stop_packet_timer(seqNum):
+    global packetDeadlines
+    
+    packetDeadlines.pop(seqNum, None)
+    
+    return
+
+# Get the earliest deadline among the running timers, or None if every timer is stopped
+def get_next_timer_deadline():
+    global protocolMode, timerDeadline, packetDeadlines, packetTimerHeap
+    
+    if protocolMode != 'sr':
+        return timerDeadline
+    
+    # Drop heap entries of stopped or restarted packet timers
+    while packetTimerHeap and packetDeadlines.get(packetTimerHeap[0][1]) != packetTimerHeap[0][0]:
+        heapq.heappop(packetTimerHeap)
+    
+    return packetTimerHeap[0][0] if packetTimerHeap else None
+
+# Get the seq nums of every packet whose timer has timed out, stopping those timers (Selective Repeat mode)
+def get_expired_packet_timers():
+    global packetDeadlines, packetTimerHeap
+    
+    expiredSeqNums = []
+    now = get_current_time()
+    while get_next_timer_deadline() is not None and packetTimerHeap[0][0] <= now:
+        seqNum = heapq.heappop(packetTimerHeap)[1]
+        stop_packet_timer(seqNum)
+        expiredSeqNums.append(seqNum)
+    
+    return expiredSeqNums
+
+# Check whether a timer is running and its deadline has passed
+def is_timer_expired():
+    deadline = get_next_timer_deadline()
+    
+    return deadline is not None and get_current_time() >= deadline
+
+# Get the number of seconds until the next timer times out, or None if every timer is stopped
+def get_time_until_timeout():
+    deadline = get_next_timer_deadline()
+    
+    if deadline is None:
+        return None
+    
+    return max(0, deadline - get_current_time())
+
+# Update the smoothed RTT, RTT variation and retransmission timeout with a new RTT sample (Jacobson/Karels, RFC 6298)
+# Receiver may hold back the ACK of the last packet in flight for up to peerMaxAckDelay seconds (its delayed ACK timer),
+#   which few RTT samples include, so it is added to the timeout and to its floor (as QUIC does with max_ack_delay)
+def update_retransmission_timeout(rttSample):
+    global smoothedRTT, rttVariation, retransmissionTimeout, clockGranularity, minRetransmissionTimeout, maxRetransmissionTimeout, peerMaxAckDelay
+    
+    TransferMetrics.observe_rtt(rttSample)
+    
+    if smoothedRTT is None:
+        # First RTT sample
+        smoothedRTT = rttSample
+        rttVariation = rttSample / 2
+    else:
+        rttVariation = 0.75 * rttVariation + 0.25 * abs(smoothedRTT - rttSample)
+        smoothedRTT = 0.875 * smoothedRTT + 0.125 * rttSample
+    
+    # Replacing the timeout also clears any backoff from earlier timeouts
+    retransmissionTimeout = smoothedRTT + max(clockGranularity, 4 * rttVariation) + peerMaxAckDelay
+    retransmissionTimeout = min(max(retransmissionTimeout, minRetransmissionTimeout + peerMaxAckDelay), maxRetransmissionTimeout)
+    
+    return
+
+# Double the retransmission timeout after a timeout (exponential backoff)
+def back_off_retransmission_timeout():
+    global retransmissionTimeout, maxRetransmissionTimeout
+    
+    retransmissionTimeout = min(retransmissionTimeout * 2, maxRetransmissionTimeout)
+    
+    return
+
 # ------------------------------------  Handle Packets  ------------------------------------ 
 
+# Trace a packet sent to the peer, at trace level PACKETS
+def trace_sent_packet(packet, isRetransmit):
+    global pktStruct
+    
+    sentSynBit, sentAckBit, sentFinBit, seqNum, ackNum, checksum = pktStruct.unpack_from(packet)
+    PacketTrace.trace_packet('send', sentSynBit, sentAckBit, sentFinBit, seqNum, ackNum, len(packet), isRetransmit)
+    
+    return
+
 # Send message
-def udt_send(packet):
+def udt_send(packet, isRetransmit=False):
     global UDPSocket, receiverIPAddress, receiverPortNumber
     
     # Send packet to Receiver with the specified Receiver IP and port
-    UDPSocket.sendto(packet, (receiverIPAddress, receiverPortNumber))
+    try:
+        UDPSocket.sendto(packet, (receiverIPAddress, receiverPortNumber))
+    except BlockingIOError:
+        # The socket send buffer is full. The packet is lost like on a congested link, and will be retransmitted
+        return
+    TransferMetrics.count_sent_packet(len(packet), isRetransmit)
+    
+    if PacketTrace.traceLevel >= PacketTrace.PACKETS:
+        trace_sent_packet(packet, isRetransmit)
+    
+    return
+
+# Check whether the kernel supports UDP GSO (generic segmentation offload) on UDP sockets: Linux 4.18 or later
+def is_udp_gso_supported():
+    global UDPSocket, UDP_SEGMENT
+    
+    if not sys.platform.startswith('linux'):
+        return False
+    
+    try:
+        UDPSocket.getsockopt(SOL_UDP, UDP_SEGMENT)
+    except OSError:
+        return False
+    
+    return True
+
+# Get the packets from packets[startIndex:] that can be sent together with UDP GSO: 
+#   up to maxGsoSegments packets of the same size (only the last one may be smaller), in at most maxGsoBatchSize bytes
+def get_gso_batch(packets, startIndex):
+    global maxGsoSegments, maxGsoBatchSize
+    
+    segmentSize = len(packets[startIndex])
+    batch = [packets[startIndex]]
+    batchSize = segmentSize
+    
+    for packet in packets[startIndex + 1:]:
+        if len(batch) == maxGsoSegments or batchSize + len(packet) > maxGsoBatchSize or len(packet) > segmentSize:
+            break
+        batch.append(packet)
+        batchSize += len(packet)
+        if len(packet) < segmentSize:
+            break
+    
+    return batch
+
+# Send several packets to Receiver
+# With UDP GSO, each batch of same-size packets is passed to the kernel in one sendmsg call,
+#   and the kernel splits it into one datagram per packet (UDP_SEGMENT), instead of one sendto call per packet
+# If the kernel or network device turns out not to support it, fall back to sending each packet with udt_send
+def udt_send_batch(packets, isRetransmit=False):
+    global UDPSocket, receiverIPAddress, receiverPortNumber, gsoEnabled, gsoSizeStruct, UDP_SEGMENT
+    
+    startIndex = 0
+    while startIndex < len(packets):
+        batch = get_gso_batch(packets, startIndex) if gsoEnabled else packets[startIndex:startIndex + 1]
+        startIndex += len(batch)
+        
+        if len(batch) == 1:
+            udt_send(batch[0], isRetransmit)
+            continue
+        
+        try:
+            UDPSocket.sendmsg(batch, [(SOL_UDP, UDP_SEGMENT, gsoSizeStruct.pack(len(batch[0])))], 0, (receiverIPAddress, receiverPortNumber))
+        except BlockingIOError:
+            # The socket send buffer is full. The batch is lost like on a congested link, and will be retransmitted
+            continue
+        except OSError:
+            gsoEnabled = False
+            for packet in batch:
+                udt_send(packet, isRetransmit)
+            continue
+        
+        for packet in batch:
+            TransferMetrics.count_sent_packet(len(packet), isRetransmit)
+        if PacketTrace.traceLevel >= PacketTrace.PACKETS:
+            for packet in batch:
+                trace_sent_packet(packet, isRetransmit)
     
     return
 
@@ -118,8 +632,9 @@ def udt_send(packet):
 def udt_rcv():
     global UDPSocket, messageBufferSize
 
-    # Receive packet of up to 1024 bytes, along with specified Receiver IP and port, from Receiver
+    # Receive packet of up to messageBufferSize bytes, along with specified Receiver IP and port, from Receiver
     response, (socketIPAddress, socketPortNumber) = UDPSocket.recvfrom(messageBufferSize)
+    TransferMetrics.count_received_packet(len(response))
         
     return response, (socketIPAddress, socketPortNumber)
 
@@ -127,44 +642,78 @@ def udt_rcv():
 def generate_random_initial_sequence_number():
     return secrets.randbelow(2 ** 32)
 
+# Sequence numbers are 32-bit on the wire, so they wrap around at seqNumModulus (2^32)
+# Inside Sender they keep counting up instead, so that comparisons and ranges still work across the wrap
+def wrap_seq_num(seqNum):
+    global seqNumModulus
+    
+    return seqNum % seqNumModulus
+
+# Get the counting-up seq num that a 32-bit seq num from the wire stands for, using serial number arithmetic (RFC 1982):
+#   it is the one closest to referenceSeqNum, i.e. less than 2^31 before or after it
+def unwrap_seq_num(wireSeqNum, referenceSeqNum):
+    global seqNumModulus
+    
+    distance = (wireSeqNum - referenceSeqNum) % seqNumModulus
+    if distance >= seqNumModulus // 2:
+        distance -= seqNumModulus
+    
+    return referenceSeqNum + distance
+
 # Generate an unsigned int of 32-bit (or 4 bytes) checksum for the payload
 def generate_checksum(payload):
     return zlib.crc32(payload)
 
-# Print every information about a packet
-def print_pkt_info(synBit, ackBit, finBit, seqNum, ackNum, checksum, payload):
-    print('Seq Num:', seqNum)       # 4 bytes
-    print('Ack Num:', ackNum)       # 4 bytes
-    print('Checksum:', checksum)    # 4 bytes
-    print(f'Payload: {payload} \n') # up to 1009 bytes
-    
-    return 
-
 # Generate a header and make a packet for payload. Each header is 15 bytes
 def make_pkt(payload):
-    global senderSeqNum, senderAckNum, synBit, ackBit, finBit
+    global senderSeqNum, senderAckNum, synBit, ackBit, finBit, pktStruct
     
     # Calculate the checksum for payload
     checksum = generate_checksum(payload)
-        
-    # Print out info about this pkt
-    print('Sender Packet Info:')
-    print_pkt_info(synBit, ackBit, finBit, senderSeqNum, senderAckNum, checksum, payload)
     
     # Generate pkt with pack(header, checksum) and payload
-    pkt = struct.pack(pktFormat, synBit, ackBit, finBit, senderSeqNum, senderAckNum, checksum) + payload
+    pkt = pktStruct.pack(synBit, ackBit, finBit, wrap_seq_num(senderSeqNum), wrap_seq_num(senderAckNum), checksum) + payload
 
     return pkt
 
+# Get the slot in sendBuffer for the packet with seqNum. Each slot can hold one packet of up to messageBufferSize bytes
+# There is a slot for every packet in the largest possible window, so packets in flight never share a slot
+def get_send_buffer_slot(seqNum):
+    global sendBufferView, maxSenderWindowSize, messageBufferSize
+    
+    slotStart = (seqNum % maxSenderWindowSize) * messageBufferSize
+    
+    return sendBufferView[slotStart:slotStart + messageBufferSize]
+
+# Generate a header in front of a payload that is already in slot, making a packet in place. Each header is 15 bytes
+# Unlike make_pkt, neither the header nor the payload is copied, so it is used for every data packet
+def make_pkt_in_slot(slot, payloadSize):
+    global senderSeqNum, senderAckNum, synBit, ackBit, finBit, pktStruct, headerBufferSize
+    
+    payload = slot[headerBufferSize:headerBufferSize + payloadSize]
+    
+    # Calculate the checksum for payload
+    checksum = generate_checksum(payload)
+    
+    # Write the header into the front of slot
+    pktStruct.pack_into(slot, 0, synBit, ackBit, finBit, wrap_seq_num(senderSeqNum), wrap_seq_num(senderAckNum), checksum)
+    
+    return slot[:headerBufferSize + payloadSize]
+
 # Decompose the pkt into header and payload parts
 def decompose_pkt(pkt):    
     # fields in the 15-byte Header of the rcvpkt
-    receivedSynBit, receivedAckBit, receivedFinBit, seqNum, ackNum, checksum = struct.unpack(pktFormat, pkt[:15])
+    receivedSynBit, receivedAckBit, receivedFinBit, seqNum, ackNum, checksum = pktStruct.unpack_from(pkt)
     payload = pkt[15:]
     
-    # Print out info about this pkt
-    print('Sender received from Receiver:')
-    print_pkt_info(receivedSynBit, receivedAckBit, receivedFinBit, seqNum, ackNum, checksum, payload)
+    if PacketTrace.traceLevel >= PacketTrace.PACKETS:
+        PacketTrace.trace_packet('rcv', receivedSynBit, receivedAckBit, receivedFinBit, seqNum, ackNum, len(pkt))
+    
+    # Receiver's seq num is close to the next one expected (senderAckNum), and its ack num is close to senderSeqNum
+    # A SYN packet carries the ISN of Receiver, which is taken as it is: there is nothing to unwrap it against yet
+    if not receivedSynBit:
+        seqNum = unwrap_seq_num(seqNum, senderAckNum)
+    ackNum = unwrap_seq_num(ackNum, senderSeqNum)
     
     return receivedSynBit, receivedAckBit, receivedFinBit, seqNum, ackNum, checksum, payload
 
@@ -172,49 +721,246 @@ def decompose_pkt(pkt):
 def is_corrupted(payload, providedChecksum):    
     return generate_checksum(payload) != providedChecksum
 
+# Get the SACK blocks from the payload of an ACK packet: ranges [start, end) of seq nums Receiver holds beyond a gap
+def decode_sack_blocks(payload):
+    global sackBlockStruct, sendBase
+    
+    return [(unwrap_seq_num(start, sendBase), unwrap_seq_num(end, sendBase)) for start, end in sackBlockStruct.iter_unpack(payload)]
+
+# Make a handshake payload: the control word, followed by options as space-separated key=value pairs
+def encode_handshake_options(controlWord, options):
+    return ' '.join([controlWord] + [f'{key}={value}' for key, value in options.items()]).encode()
+
+# Get the options (key=value pairs, as strings) from a handshake payload
+# Peers that do not negotiate anything send only the control word, which gives no options
+def decode_handshake_options(payload):
+    words = bytes(payload).decode(errors='replace').split()[1:]
+    
+    return dict(word.split('=', 1) for word in words if '=' in word)
+
+# ------------------------------------  Handle Congestion Control  ------------------------------------ 
+
+# Get the Sender window size: the congestion window, limited by the largest window Sender allows
+#   and, in Selective Repeat mode, by the reorder buffer of Receiver
+def get_sender_window_size():
+    global congestionController, maxSenderWindowSize, protocolMode, receiverWindowSize
+    
+    senderWindowSize = min(CongestionControl.get_congestion_window(congestionController), maxSenderWindowSize)
+    if protocolMode == 'sr' and receiverWindowSize is not None:
+        senderWindowSize = min(senderWindowSize, receiverWindowSize)
+    
+    return senderWindowSize
+
+# Record the congestion window in cwndTrace, as (seconds since the transfer started, cwnd), when it changes
+# Under loss it changes on almost every ACK, so the trace is kept to maxCwndTraceLength entries: at least cwndTraceInterval
+#   seconds apart. Once it is full, every other entry is dropped, and the interval doubled, so it covers the whole transfer
+def record_congestion_window():
+    global congestionController, cwndTrace, transferStartTime, cwndTraceInterval, maxCwndTraceLength
+    
+    cwnd = round(congestionController['cwnd'], 2)
+    elapsedTime = round(get_current_time() - transferStartTime, 6)
+    if cwndTrace and (cwndTrace[-1][1] == cwnd or elapsedTime - cwndTrace[-1][0] < cwndTraceInterval):
+        return
+    
+    cwndTrace.append((elapsedTime, cwnd))
+    if len(cwndTrace) == maxCwndTraceLength:
+        del cwndTrace[1::2]
+        cwndTraceInterval = max(2 * cwndTraceInterval, elapsedTime / len(cwndTrace))
+    
+    return
+
+# Let the congestion controller grow the window after numOfAckedPackets packets were newly acknowledged
+def signal_ack_to_congestion_controller(numOfAckedPackets):
+    global congestionController, smoothedRTT
+    
+    CongestionControl.on_ack(congestionController, numOfAckedPackets, smoothedRTT, get_current_time())
+    record_congestion_window()
+    
+    return
+
+# Let the congestion controller shrink the window after the packet lostSeqNum was lost
+# It reacts at most once per window of data: losses of packets sent before the last reaction are part of the same event
+def signal_loss_to_congestion_controller(lostSeqNum, isTimeout):
+    global congestionController, recoverySeqNum, sendBase, senderSeqNum
+    
+    if lostSeqNum < recoverySeqNum:
+        return
+    recoverySeqNum = senderSeqNum
+    
+    CongestionControl.on_loss(congestionController, senderSeqNum - sendBase, isTimeout, get_current_time())
+    record_congestion_window()
+    
+    return
+
 # ------------------------------------  Handle Relaying Packets  ------------------------------------ 
 
+# Ask the receiver server (ReceiverServer.py) at serverAddress to open a session for this transfer, with a CONNECT packet:
+#   a SYN packet with 'CONNECT id=<connectionId>' as payload, followed by the manifest of the stripe in striped mode.
+#   The server answers with the SYN of the usual handshake
+# The CONNECT is sent again every second, in case it or the SYN was lost, up to maxConnectAttempts times
+# Return the SYN packet and the address it came from
+def request_connection():
+    global UDPSocket, synBit, receiverIPAddress, receiverPortNumber, serverAddress, connectionId, maxConnectAttempts, stripeManifest
+    
+    receiverIPAddress, receiverPortNumber = serverAddress
+    synBit = 1
+    connectPacket = make_pkt(encode_handshake_options('CONNECT', dict({'id': connectionId}, **stripeManifest)))
+    synBit = 0
+    
+    UDPSocket.settimeout(1)
+    for attempt in range(maxConnectAttempts):
+        udt_send(connectPacket, attempt > 0)
+        try:
+            response, (address, port) = udt_rcv()
+        except timeout:
+            continue
+        UDPSocket.settimeout(None)
+        
+        return response, (address, port)
+    
+    raise TimeoutError(f'No answer from receiver server {receiverIPAddress}:{receiverPortNumber}')
+
 def perform_three_way_handshake():
-    global UDPSocket, messageBufferSize, synBit, ackBit, senderSeqNum, senderAckNum, receiverIPAddress, receiverPortNumber
+    global UDPSocket, messageBufferSize, payloadBufferSize, headerBufferSize, synBit, ackBit, senderSeqNum, senderAckNum, receiverIPAddress, receiverPortNumber, protocolMode, receiverWindowSize, peerMaxAckDelay, sackEnabled, serverAddress, fileSize, filename2, segmentsPerBlock, blockHashSize, deltaEnabled, stripeManifest, maxConnectAttempts
         
-    # Sender receives SYN packet sent by Receiver
-    response, (address, port) = udt_rcv()
+    # Sender receives SYN packet sent by Receiver, or by the receiver server it asked for a session
+    if serverAddress:
+        response, (address, port) = request_connection()
+    else:
+        response, (address, port) = udt_rcv()
     
     # Record Receiver IP address name and port number
     receiverIPAddress, receiverPortNumber = address, port
     
     # Set Sender ack num to be Receiver seq num + 1
-    seqNum = decompose_pkt(response)[3]
+    receivedSynBit, receivedAckBit, receivedFinBit, seqNum, ackNum, checksum, payload = decompose_pkt(response)
     senderAckNum = seqNum + 1
+    
+    # Accept the protocol mode requested by Receiver, if Sender supports it. Otherwise, fall back to GBN
+    # Receivers that do not negotiate send a plain SYN, and get a plain SYN/ACK back
+    requestedOptions = decode_handshake_options(payload)
+    acceptedOptions = {}
+    if 'mode' in requestedOptions:
+        protocolMode = requestedOptions['mode'] if requestedOptions['mode'] in ('gbn', 'sr') else 'gbn'
+        acceptedOptions['mode'] = protocolMode
+    # SACK is only used in GBN mode; Selective Repeat already acknowledges every packet on its own
+    if requestedOptions.get('sack') == '1' and protocolMode == 'gbn':
+        sackEnabled = True
+        acceptedOptions['sack'] = 1
+    receiverWindowSize = int(requestedOptions.get('window', 0)) or None
+    # Receiver delays ACKs by up to ackdelay seconds in GBN mode; Selective Repeat acknowledges every packet right away
+    peerMaxAckDelay = float(requestedOptions.get('ackdelay', 0)) if protocolMode == 'gbn' else 0
+    
+    # The segment size is the largest that both Receiver (mss) and the path to Receiver can take
+    # Receivers that do not negotiate can only receive the default 1009-byte segments
+    if 'mss' in requestedOptions:
+        payloadBufferSize = min(int(requestedOptions['mss']), get_max_payload_size((receiverIPAddress, receiverPortNumber)))
+        messageBufferSize = headerBufferSize + payloadBufferSize
+        acceptedOptions['mss'] = payloadBufferSize
+        # Announce the size of the file too, so that Receiver can allocate the output file and write each segment at its offset
+        # and its name (quoted, as options are separated by spaces), so that Receiver can look for a checkpoint to resume from
+        acceptedOptions['size'] = fileSize
+        acceptedOptions['name'] = urllib.parse.quote(filename2)
+        # In delta mode, also ask Receiver for the signatures of its copy of the file, if it has one
+        if deltaEnabled and requestedOptions.get('delta') == '1' and not stripeManifest:
+            acceptedOptions['delta'] = 1
+    
+    # If Receiver asks for it, send the BLAKE2b digest of every block of segmentsPerBlock segments (about blockHashSize bytes)
+    #   along with the content, so that Receiver can verify each block as it arrives
+    if requestedOptions.get('hash') == 'blake2b':
+        segmentsPerBlock = max(blockHashSize // payloadBufferSize, 1)
+        acceptedOptions['hash'] = 'blake2b'
+        acceptedOptions['block'] = segmentsPerBlock
         
     # Sender sends SYN/ACK packet with its ISN (Y) and Receiver's ISN+1 (X+1) to Receiver  
     synBit, ackBit = 1, 1
-    synAckPacket = make_pkt(b'SYN/ACK')
-    udt_send(synAckPacket)
+    synAckPacket = make_pkt(encode_handshake_options('SYN/ACK', acceptedOptions))
     senderSeqNum += 1 # Increment Sender seq num because of the phantom byte
         
     # Sender receives ACK packet sent by Receiver
-    response = udt_rcv()[0]
-    decompose_pkt(response)
+    # It may offer to resume the transfer from the checkpoint of an earlier one, or in delta mode, a delta transfer from
+    #   its copy of the file, whose signatures are fetched right after
+    # The SYN/ACK is sent again every second, in case it or the ACK was lost, up to maxConnectAttempts times
+    #   Receiver answers every SYN/ACK with the same ACK
+    UDPSocket.settimeout(1)
+    for attempt in range(maxConnectAttempts):
+        udt_send(synAckPacket, attempt > 0)
+        try:
+            response = udt_rcv()[0]
+        except timeout:
+            continue
+        receivedSynBit, receivedAckBit, receivedFinBit, seqNum, ackNum, checksum, payload = decompose_pkt(response)
+        # A corrupted ACK is dropped, like corrupted ACKs of data packets, since its offer cannot be trusted
+        #   The SYN/ACK is sent again, and Receiver answers it with the same ACK
+        if is_corrupted(payload, checksum):
+            continue
+        # A SYN sent again is not the ACK
+        if not receivedSynBit:
+            break
+    else:
+        raise TimeoutError(f'No handshake ACK from receiver {receiverIPAddress}:{receiverPortNumber}')
+    UDPSocket.settimeout(None)
     
     # Reset SYN and ACK bits to 0
     synBit, ackBit = 0, 0
     
+    ackOptions = decode_handshake_options(payload)
+    accept_resume_offer(ackOptions)
+    accept_delta_offer(ackOptions)
+    
+    return
+
+# Resume the transfer from the offset Receiver offers in its handshake ACK (resume=<offset> crc=<CRC-32>), if it has
+#   the first offset bytes of the file already: their CRC-32 has to match that of the same bytes of the input file,
+#   which could have changed since. From then on, the input file starts at inputOffset + resumeOffset for this transfer
+# Striped transfers are not resumed
+def accept_resume_offer(offerOptions):
+    global filename1, fileSize, inputOffset, resumeOffset, stripeManifest
+    
+    if 'resume' not in offerOptions or stripeManifest:
+        return
+    
+    offset, checksum = int(offerOptions['resume']), int(offerOptions.get('crc', -1))
+    if not 0 < offset <= fileSize or get_file_checksum(filename1, offset) != checksum:
+        return
+    
+    resumeOffset = offset
+    inputOffset += resumeOffset
+    fileSize -= resumeOffset
+    
     return
 
 # Sender initiates connection termination upon transmitting every segment in input file
 def perform_connection_termination():
-    global ackBit, finBit, senderSeqNum, senderAckNum
+    global UDPSocket, ackBit, finBit, senderSeqNum, senderAckNum, badBlockRanges, retransmissionTimeout, maxFinAttempts
     
     # Sender sends FIN packet to Receiver
     finBit = 1
-    finPacket = make_pkt(b'FIN')
-    udt_send(finPacket)
+    finPacket = make_pkt(make_fin_payload())
     senderSeqNum += 1
     
     # Sender receives ACK packet sent by Receiver
-    response = udt_rcv()[0]
-    decompose_pkt(response)
+    # ACKs for data packets that were still in flight, and corrupted packets, are skipped, until the ACK/FIN packet arrives
+    # It lists the blocks that did not match their digest (bad=<start>-<end>,...), if there are any
+    # FIN is sent again every RTO, backed off each time, in case it or the ACK/FIN was lost, up to maxFinAttempts times
+    #   Receiver answers every FIN with the same ACK/FIN
+    for attempt in range(maxFinAttempts):
+        udt_send(finPacket, attempt > 0)
+        UDPSocket.settimeout(retransmissionTimeout)
+        try:
+            while True:
+                response = udt_rcv()[0]
+                receivedSynBit, receivedAckBit, receivedFinBit, seqNum, ackNum, checksum, payload = decompose_pkt(response)
+                if receivedFinBit == 1 and not is_corrupted(payload, checksum):
+                    break
+        except timeout:
+            back_off_retransmission_timeout()
+            continue
+        break
+    else:
+        raise TimeoutError(f'No ACK/FIN from receiver {receiverIPAddress}:{receiverPortNumber}')
+    UDPSocket.settimeout(None)
+    badBlockRanges = decode_handshake_options(payload).get('bad', '')
     senderAckNum += 1
     
     # Sender sends ACK packet to Receiver
@@ -228,76 +974,361 @@ def perform_connection_termination():
     
     return
 
-# Perform Sender side GBN operations
+# Get the BLAKE2b digest of the block of segments loaded since the last one, and start hashing the next block
+def finish_block_digest():
+    global blockHasher, blockDigestSize, segmentsInBlock, bytesInBlock
+    
+    digest = blockHasher.digest()
+    blockHasher = hashlib.blake2b(digest_size=blockDigestSize)
+    segmentsInBlock = 0
+    bytesInBlock = 0
+    
+    return digest
+
+# Check whether the digest of the block being hashed is due: after segmentsPerBlock segments, where Receiver expects it
+# A delta packet may stand for many more bytes than a segment, so in delta mode a block ends once it has blockHashSize
+#   bytes of the file instead. Its digest packet is 'D' and the digest, which Receiver tells from the delta packets
+def is_block_digest_due():
+    global segmentsPerBlock, segmentsInBlock, bytesInBlock, blockHashSize, deltaPackets
+    
+    if not segmentsPerBlock:
+        return False
+    if deltaPackets is not None:
+        return bytesInBlock >= blockHashSize
+    
+    return segmentsInBlock == segmentsPerBlock
+
+# Make the payload of the digest packet of the block being hashed, and start hashing the next block
+def make_block_digest_payload():
+    global deltaPackets
+    
+    digest = finish_block_digest()
+    if deltaPackets is not None:
+        return b'D' + digest
+    
+    return digest
+
+# Make the payload of the FIN packet: 'FIN', followed by the digest of the last block (digest=<hex>) if blocks are hashed
+# Every other block has its digest in a packet of its own, right after its segments
+def make_fin_payload():
+    global segmentsPerBlock, segmentsInBlock
+    
+    if segmentsPerBlock and segmentsInBlock:
+        return encode_handshake_options('FIN', {'digest': finish_block_digest().hex()})
+    
+    return b'FIN'
+
+# Make the payload of the filename packet: filename2, followed by 'RESUME offset=<offset>' if the transfer resumes
+# A NUL byte separates them, as no filename can have one
+def make_filename_payload():
+    global filename2, resumeOffset
+    
+    if resumeOffset:
+        return filename2.encode() + b'\0' + encode_handshake_options('RESUME', {'offset': resumeOffset})
+    
+    return filename2.encode()
+
+# Check whether every packet (filename and every segment in input file) has been sent
+# In delta mode, the number of delta packets is only known once the last one is generated
+def is_every_packet_sent():
+    global filenameSent, segmentIndex, numOfTotalSegments, deltaPackets
+    
+    if deltaPackets is not None:
+        return filenameSent and get_next_delta_packet() is None
+    
+    return filenameSent and segmentIndex == numOfTotalSegments
+
+# Event: Send packets to Receiver until the Sender window is full or there is nothing left to send
+def send_packets_in_window():
+    global protocolMode, sendBase, senderSeqNum, sndpkt, sendTimes, headerBufferSize, filename2, filenameSent, segmentIndex, numOfTotalSegments, segmentsPerBlock, segmentsInBlock, blockHasher, deltaPackets
+    
+    # Packets are made first, then sent together, so that they can share a sendmsg call with UDP GSO
+    newPackets = []
+    
+    while senderSeqNum < sendBase + get_sender_window_size() and not is_every_packet_sent():
+        # The packet is assembled in its own slot of sendBuffer, right behind the space for its header
+        slot = get_send_buffer_slot(senderSeqNum)
+        payloadBuffer = slot[headerBufferSize:]
+        
+        # Send filename to Receiver
+        if not filenameSent:
+            sendPayload = make_filename_payload()
+            payloadSize = len(sendPayload)
+            payloadBuffer[:payloadSize] = sendPayload
+            filenameSent = True
+        elif is_block_digest_due():
+            # Send the digest of the block of segments just sent to Receiver
+            sendPayload = make_block_digest_payload()
+            payloadSize = len(sendPayload)
+            payloadBuffer[:payloadSize] = sendPayload
+        elif deltaPackets is not None:
+            # Send the next delta packet to Receiver, which hashes the content it stands for
+            payloadSize = load_one_delta_payload(payloadBuffer)
+            segmentIndex += 1
+            if segmentsPerBlock:
+                segmentsInBlock += 1
+        else:
+            # Send filecontent to Receiver
+            # Load current segment, then increment segment index by 1
+            # Each segment is hashed as it is loaded the first time; retransmissions resend the packet in its slot
+            payloadSize = load_one_payload_from_input_file(segmentIndex, numOfTotalSegments, payloadBuffer)
+            segmentIndex += 1
+            if segmentsPerBlock:
+                blockHasher.update(payloadBuffer[:payloadSize])
+                segmentsInBlock += 1
+        
+        # Make the segment a packet by adding a header to it
+        sndpkt[senderSeqNum] = make_pkt_in_slot(slot, payloadSize)
+        
+        # Queue the packet for sending to Receiver, and record when it was sent for measuring RTT
+        newPackets.append(sndpkt[senderSeqNum])
+        sendTimes[senderSeqNum] = get_current_time()
+
+        # Start timer for the oldest on-flight packet. In Selective Repeat mode, every packet has its own timer
+        if protocolMode == 'sr':
+            start_packet_timer(senderSeqNum)
+        elif sendBase == senderSeqNum:
+            start_timer()
+        
+        # Increment senderSeqNum by 1 since we just sent a packet
+        senderSeqNum += 1
+    
+    udt_send_batch(newPackets)
+    TransferMetrics.observe_window(senderSeqNum - sendBase, get_sender_window_size())
+    
+    return
+
+# Event: Receive an ACK packet from Receiver
+# Handshake packets and signatures that Receiver sent again may still arrive after the handshake. They have the SYN or ACK
+#   bit set (the first two bytes of the header), which ACKs of data packets never have, and are skipped
+def handle_ack_packet(rcvpkt):
+    global protocolMode
+    
+    if rcvpkt[0] or rcvpkt[1]:
+        return
+    
+    if protocolMode == 'sr':
+        handle_sr_ack_packet(rcvpkt)
+    else:
+        handle_gbn_ack_packet(rcvpkt)
+    
+    return
+
+# Event: Receive a cumulative ACK packet from Receiver in GBN mode
+def handle_gbn_ack_packet(rcvpkt):
+    global sendBase, senderSeqNum, sndpkt, sendTimes, sackEnabled, sackedSeqNums, duplicateAcks, headerBufferSize
+    
+    receivedSynBit, receivedAckBit, receivedFinBit, seqNum, ackNum, checksum, payload = decompose_pkt(rcvpkt)
+    
+    # Ignore corrupted ACKs
+    if is_corrupted(payload, checksum):
+        TransferMetrics.count('corruptedPackets')
+        return
+    
+    # Record the packets Receiver already holds beyond a gap. Duplicate ACKs carry them too
+    if sackEnabled:
+        for start, end in decode_sack_blocks(payload):
+            sackedSeqNums.update(range(max(start, sendBase), min(end, senderSeqNum)))
+    
+    # Receiver sends a duplicate ACK for every packet that arrives after a gap
+    # After 3 duplicate ACKs, the packet at sendBase is considered lost: resend it without waiting for the timer
+    if ackNum == sendBase - 1 and sendBase < senderSeqNum:
+        TransferMetrics.count('duplicatePackets')
+        duplicateAcks += 1
+        if duplicateAcks == 3:
+            signal_loss_to_congestion_controller(sendBase, False)
+            udt_send(sndpkt[sendBase], True)
+            sendTimes.pop(sendBase, None)
+    
+    # Ignore duplicate ACKs that do not acknowledge any packet in flight
+    if not sendBase <= ackNum < senderSeqNum:
+        return
+    duplicateAcks = 0
+    
+    # Measure RTT with the acknowledged packet. Following Karn's rule, 
+    #   a retransmitted packet has no entry in sendTimes, since its ACK could belong to either transmission
+    if ackNum in sendTimes:
+        update_retransmission_timeout(get_current_time() - sendTimes[ackNum])
+    
+    # Every newly acknowledged packet lets the congestion window grow
+    signal_ack_to_congestion_controller(ackNum + 1 - sendBase)
+    
+    # Sender correctly acknowledged that Receiver has correctly received the packet, increment sendBase
+    # Acknowledged packets will never be retransmitted, so release them from sndpkt
+    for i in range(sendBase, ackNum + 1):
+        TransferMetrics.count_goodput(len(sndpkt.pop(i)) - headerBufferSize)
+        sendTimes.pop(i, None)
+        sackedSeqNums.discard(i)
+    sendBase = ackNum + 1
+    
+    # Stop or start timer accordingly
+    if sendBase == senderSeqNum:
+        stop_timer()
+    else:
+        start_timer()
+    
+    return
+
+# Event: Receive an ACK packet from Receiver in Selective Repeat mode, which acknowledges only the packet ackNum
+def handle_sr_ack_packet(rcvpkt):
+    global sendBase, senderSeqNum, sndpkt, sendTimes, headerBufferSize
+    
+    receivedSynBit, receivedAckBit, receivedFinBit, seqNum, ackNum, checksum, payload = decompose_pkt(rcvpkt)
+    
+    # Ignore corrupted ACKs, and ACKs for packets that are not in flight anymore
+    if is_corrupted(payload, checksum):
+        TransferMetrics.count('corruptedPackets')
+        return
+    if ackNum not in sndpkt:
+        TransferMetrics.count('duplicatePackets')
+        return
+    
+    # Measure RTT with the acknowledged packet, unless it was retransmitted (Karn's rule)
+    if ackNum in sendTimes:
+        update_retransmission_timeout(get_current_time() - sendTimes[ackNum])
+    
+    signal_ack_to_congestion_controller(1)
+    
+    # The packet will never be retransmitted; release it and stop its timer
+    TransferMetrics.count_goodput(len(sndpkt.pop(ackNum)) - headerBufferSize)
+    sendTimes.pop(ackNum, None)
+    stop_packet_timer(ackNum)
+    
+    # Slide the window past every acknowledged packet at its start
+    while sendBase < senderSeqNum and sendBase not in sndpkt:
+        sendBase += 1
+    
+    return
+
+# Event: Timeout
+def handle_timeout():
+    global protocolMode, sendBase, sndpkt, sendTimes
+    
+    # Retransmitted packets wait twice as long as before for their ACK
+    back_off_retransmission_timeout()
+    TransferMetrics.count('timeouts')
+    
+    if PacketTrace.traceLevel >= PacketTrace.EVENTS:
+        PacketTrace.trace_event('timeout', sendBase=wrap_seq_num(sendBase), rto=retransmissionTimeout)
+    
+    if protocolMode == 'sr':
+        # Retransmit only the packets whose own timer timed out
+        expiredSeqNums = get_expired_packet_timers()
+        if expiredSeqNums:
+            signal_loss_to_congestion_controller(min(expiredSeqNums), True)
+        for seqNum in expiredSeqNums:
+            udt_send(sndpkt[seqNum], True)
+            sendTimes.pop(seqNum, None)
+            start_packet_timer(seqNum)
+    else:
+        signal_loss_to_congestion_controller(sendBase, True)
+        retransmit_window()
+    
+    return
+
+# Retransmit every packet in flight, after a timeout in GBN mode
+def retransmit_window():
+    global sendBase, senderSeqNum, sndpkt, sendTimes, sackedSeqNums
+    
+    # Restart timer upon timeout
+    start_timer()
+    
+    # Retransmit all packets in the Sender window
+    # With SACK, packets Receiver already holds are skipped, so only the holes are resent
+    # Retransmitted packets are no longer used for measuring RTT
+    retransmittedPackets = []
+    for i in range(sendBase, senderSeqNum):
+        if i in sackedSeqNums:
+            continue
+        retransmittedPackets.append(sndpkt[i])
+        sendTimes.pop(i, None)
+    udt_send_batch(retransmittedPackets, True)
+    
+    return
+
+# Get statistics about the transfer: the transfer metrics, the congestion controller and how its window changed
+def get_stats():
+    global congestionController, cwndTrace, cwndTraceInterval, resumeOffset, deltaPackets, deltaBlockSize, deltaCopiedBytes, segmentIndex
+    
+    stats = TransferMetrics.get_stats()
+    stats['congestionControl'] = congestionController['name']
+    stats['cwndTrace'] = cwndTrace
+    stats['cwndTraceInterval'] = cwndTraceInterval
+    stats['resumeOffset'] = resumeOffset
+    if deltaPackets is not None:
+        stats['delta'] = {'blockSize': deltaBlockSize, 'copiedBytes': deltaCopiedBytes, 'packets': segmentIndex}
+    
+    return stats
+
+# Write statistics about the transfer to the JSON file statsFilename
+def write_stats(statsFilename):
+    with open(statsFilename, 'w') as f:
+        json.dump(get_stats(), f, indent=4)
+    
+    return
+
+# Perform Sender side GBN (or Selective Repeat) operations
+# The loop never blocks on a single ACK: it keeps the window full, drains every pending ACK,
+#   and otherwise sleeps in select() until an ACK arrives or the retransmission timer times out
 def perform_sender_operation():
-    global UDPSocket, sendBase, senderSeqNum, senderWindowSize, sndpkt, fileSize, payloadBufferSize, filename2
+    global UDPSocket, sendBase, senderSeqNum, fileSize, payloadBufferSize, filenameSent, segmentIndex, numOfTotalSegments, transferStartTime, prometheusFilename, metricsInterval, blockHasher, blockDigestSize, segmentsInBlock, bytesInBlock, deltaPackets
     
     # Used to keep track of whether filename2 is already sent by Sender or not
     filenameSent = False
+    
+    # The block of segments being hashed, if Receiver asked for block digests
+    blockHasher = hashlib.blake2b(digest_size=blockDigestSize)
+    segmentsInBlock = 0
+    bytesInBlock = 0
         
-    # Calculate the amount of segments we'll be dividing the input file; each segment is up to 1009 bytes
+    # Calculate the amount of segments we'll be dividing the input file; each segment is up to payloadBufferSize bytes
+    # In delta mode, the delta packets are sent instead, and segmentIndex counts them
     segmentIndex = 0
     numOfTotalSegments = 0
     if fileSize % payloadBufferSize == 0:
         numOfTotalSegments = math.floor(fileSize / payloadBufferSize)        
     else: 
         numOfTotalSegments = math.floor(fileSize / payloadBufferSize) + 1
+    
+    transferStartTime = get_current_time()
+    TransferMetrics.start_metrics('sender', prometheusFilename, metricsInterval)
+    record_congestion_window()
+    
+    # Wait for ACKs with a selector instead of blocking in recvfrom
+    UDPSocket.setblocking(False)
+    selector = selectors.DefaultSelector()
+    selector.register(UDPSocket, selectors.EVENT_READ)
         
     # Sender should do the following operation endlessly, 
     #   until Sender knows that all packets have been correctly sent to Receiver
-    while True:
-        # Every in input file was sent. Now send FIN packet to Receiver
-        if segmentIndex == numOfTotalSegments:
-            perform_connection_termination()
-            break
+    while not (is_every_packet_sent() and sendBase == senderSeqNum):
+        # Event: Send packets to Receiver
+        send_packets_in_window()
         
-        # Event: Send packet to Receiver
-        if senderSeqNum < sendBase + senderWindowSize:
-            # Send filename to Receiver
-            if not filenameSent:
-                sendPayload = filename2.encode()
-                filenameSent = True
-            else:
-                # Send filecontent to Receiver
-                # Get current segment, then increment segment index by 1
-                sendPayload = get_one_payload_from_input_file(segmentIndex, numOfTotalSegments)
-                segmentIndex += 1
-            
-            # Make the segment a packet by adding a header to it
-            sndpkt[senderSeqNum] = make_pkt(sendPayload)
-            
-            # Send the packet to Receiver
-            udt_send(sndpkt[senderSeqNum])
-
-            # Start timer for the oldest on-flight packet
-            if sendBase == senderSeqNum:
-                timer = start_timer()
-            
-            # Increment senderSeqNum by 1 since we just sent a packet
-            senderSeqNum += 1
+        # Wait until an ACK arrives or the timer times out
+        selector.select(get_time_until_timeout())
         
-        # Event: Receive packet from Receiver
-        rcvpkt = udt_rcv()[0]
-        if rcvpkt:
-            receivedSynBit, receivedAckBit, receivedFinBit, seqNum, ackNum, checksum, payload = decompose_pkt(rcvpkt)
-            if not is_corrupted(payload, checksum):
-                # Sender correctly acknowledged that Receiver has correctly received the packet, increment sendBase
-                sendBase = ackNum + 1
-                
-                # Stop or start timer accordingly
-                if sendBase == senderSeqNum:
-                    stop_timer(timer)
-                else:
-                    timer = start_timer()
+        # Event: Receive packets from Receiver, until no more packets are pending
+        while True:
+            try:
+                rcvpkt = udt_rcv()[0]
+            except (BlockingIOError, InterruptedError):
+                break
+            handle_ack_packet(rcvpkt)
 
         # Event: Timeout
-        if not timer.is_alive():
-            # Restart timer upon timeout
-            timer = start_timer()
-                        
-            # Retransmit N packets (i.e. all packets in the Sender window)
-            for i in range(sendBase, senderSeqNum):
-                udt_send(sndpkt[i])
+        if is_timer_expired():
+            handle_timeout()
+        
+        TransferMetrics.write_prometheus_if_due()
+    
+    selector.close()
+    UDPSocket.setblocking(True)
+    
+    # Every packet in input file was sent and acknowledged. Now send FIN packet to Receiver
+    if PacketTrace.traceLevel >= PacketTrace.EVENTS:
+        PacketTrace.trace_event('fin')
+    perform_connection_termination()
                 
     return
             
@@ -310,23 +1341,55 @@ if __name__ == '__main__':
     
     # Buffer size of a packet 
     # 15 bytes for header (1-byte for each SYN, ACK and FIN bit, 4-byte for each seqNum, ackNum, checksum)
-    # Up to 1009 bytes for payload
+    # Up to 1009 bytes for payload, unless a larger segment size is negotiated during the handshake
+    # The largest segment fits in one UDP datagram: 65507 bytes, minus the header
     headerBufferSize = 15 # 15 bytes
     payloadBufferSize = 1009 # 1009 bytes
     messageBufferSize = headerBufferSize + payloadBufferSize # 1024 bytes
+    maxPayloadBufferSize = 65507 - headerBufferSize # 65492 bytes
+    
+    # Size of the socket send and receive buffers
+    socketBufferSize = 4 * 1024 * 1024 # 4 MiB
+    
+    # UDP GSO: up to 64 packets, and no more than the largest UDP datagram in total, are sent in one sendmsg call
+    # Python does not define UDP_SEGMENT, so its value is the one from the Linux headers
+    UDP_SEGMENT = 103
+    gsoSizeStruct = struct.Struct('=H')
+    maxGsoSegments = 64
+    maxGsoBatchSize = 65507 # 65507 bytes
     
     # Sender SYN, ACK and FIN flag bits
     synBit, ackBit, finBit = 0, 0, 0
     
     pktFormat = '!BBBIII'
+    pktStruct = struct.Struct(pktFormat)
     
     # Any packet (segment with header) that is sent by Sender will be added to sndpkt
     # sndpkt is used for retransmitting unacknowledged packets upon timeout of the timer
+    # Each entry is a view of the packet's slot in sendBuffer, so retransmitting does not copy it either
     sndpkt = {}
     
+    # Protocol mode, negotiated with Receiver during the handshake: 'gbn' (Go-Back-N) or 'sr' (Selective Repeat)
+    # receiverWindowSize is the reorder buffer size Receiver advertises in Selective Repeat mode
+    protocolMode = 'gbn'
+    receiverWindowSize = None
+    
+    # The longest Receiver may delay an ACK, which it advertises during the handshake (0 if it does not)
+    peerMaxAckDelay = 0
+    
+    # SACK (selective acknowledgements in ACK packets), negotiated with Receiver during the handshake in GBN mode
+    # sackedSeqNums has the packets in flight that Receiver reported it holds beyond a gap
+    sackEnabled = False
+    sackBlockStruct = struct.Struct('!II')
+    sackedSeqNums = set()
+    
     # Initialization of Sender seq num and ack num
     # Assume senderSeqNum = Y, senderAckNum = 0
-    senderSeqNum = generate_random_initial_sequence_number()
+    # An ISN can be chosen with --isn, e.g. close to 2^32 to check that seq nums wrap around correctly
+    seqNumModulus = 2 ** 32
+    senderSeqNum = get_optional_argument('--isn', -1)
+    if senderSeqNum < 0:
+        senderSeqNum = generate_random_initial_sequence_number()
     senderAckNum = 0
      
     # ------------------------------------  Basic Setup  ------------------------------------ 
@@ -337,11 +1400,17 @@ if __name__ == '__main__':
     # Initialize Receiver IP and port number
     receiverIPAddress, receiverPortNumber = '', 0
     
-    # Create Sender UDP socket
-    UDPSocket = create_udp_socket()
+    # With --connect receiverIPAddress:receiverPortNumber, Sender connects to a receiver server (ReceiverServer.py),
+    #   instead of waiting for Receiver to send SYN. connectionId tells this transfer apart from earlier ones from the same port
+    connectArgument = get_optional_argument('--connect', '')
+    serverAddress = None
+    if connectArgument:
+        serverIPAddress, serverPortNumber = connectArgument.rsplit(':', 1)
+        serverAddress = (serverIPAddress, int(serverPortNumber))
+    maxConnectAttempts = 10
     
-    # Bind Sender IP and port to the UDP socket
-    bind_socket_to_address_and_port()
+    # FIN is sent up to maxFinAttempts times, waiting an RTO (backed off every time) for the ACK/FIN after each
+    maxFinAttempts = 10
     
     # Get the size of input file
     try:
@@ -350,8 +1419,67 @@ if __name__ == '__main__':
         print('Error: %s - %s.' % (e.filename, e.strerror))
         exit(0)
     
-    # Read byte message of content from input file
-    fileContent = read_file_content(filename1)
+    # Striped mode (--stripes N): the input file is sent by N Sender processes, each sending one byte range of it
+    #   to the receiver server over its own session. From here on, this is one of them, sending the range in
+    #   stripeManifest; inputOffset is where its range starts, and fileSize its length
+    # The processes are started before the socket is created and the input file is opened, so that each has its own
+    numOfStripes = get_optional_argument('--stripes', 1)
+    stripeManifest = {}
+    inputOffset = 0
+    
+    # The offset the transfer resumes from, if Receiver has the file up to there from an earlier transfer (see accept_resume_offer)
+    resumeOffset = 0
+    
+    # Block digests: if Receiver asks for them, every block of segmentsPerBlock segments (about blockHashSize bytes) is followed
+    #   by a packet with its BLAKE2b digest of blockDigestSize bytes (0 segments if not). In delta mode, every block of
+    #   blockHashSize bytes of the file is. Receiver reports the byte ranges of blocks that did not match in badBlockRanges
+    blockHashSize = 1024 * 1024 # 1 MiB
+    blockDigestSize = 32 # 32 bytes
+    segmentsPerBlock = 0
+    badBlockRanges = ''
+    
+    # Delta mode (see accept_delta_offer): the signatures of the blocks of deltaBlockSize bytes of the copy Receiver has
+    #   are a 4-byte weak and a 16-byte strong checksum each, fetched signatureRequestPackets packets of them at a time, and
+    #   a reference to blocks in a delta packet is 'C', the first block and the number of blocks. deltaPackets generates the
+    #   delta packets, and is None unless the file is sent as a delta
+    deltaEnabled = get_optional_argument('--delta', 0) == 1
+    deltaSignatureStruct = struct.Struct('!I16s')
+    deltaCopyStruct = struct.Struct('!cII')
+    maxDeltaCopyBlocks = 256
+    signatureRequestPackets = 16
+    maxUnmatchedDeltaBytes = 1024 * 1024 # 1 MiB
+    deltaProbesPerRoll = 64
+    deltaReadSize = 4 * 1024 * 1024 # 4 MiB
+    deltaBlockSize = 0
+    deltaPackets = None
+    nextDeltaPacket = None
+    deltaCopiedBytes = 0
+    
+    if numOfStripes > 1:
+        if serverAddress is None:
+            print('Error: --stripes needs a receiver server (--connect).')
+            exit(0)
+        stripeManifest = start_stripes(numOfStripes)
+        inputOffset, fileSize = stripeManifest['offset'], stripeManifest['length']
+        senderPortNumber = 0
+    connectionId = format(secrets.randbelow(2 ** 32), '08x')
+    
+    # Create Sender UDP socket
+    UDPSocket = create_udp_socket()
+    
+    # Bind Sender IP and port to the UDP socket
+    bind_socket_to_address_and_port()
+    
+    # Send batches of packets with UDP GSO where the kernel supports it, unless turned off with --gso 0
+    gsoEnabled = get_optional_argument('--gso', 1) == 1 and is_udp_gso_supported()
+    
+    # Open input file; its content is read one segment at a time while sending
+    inputFile = open_input_file(filename1)
+    
+    # Write a trace of connection events (--trace-level 1) or of every packet as well (--trace-level 2, the default)
+    traceFilename = get_stripe_filename(get_optional_argument('--trace', ''))
+    if traceFilename:
+        PacketTrace.open_trace(traceFilename, get_optional_argument('--trace-level', PacketTrace.PACKETS))
     
     # ------------------------------------  Handshake  ------------------------------------ 
     
@@ -362,26 +1490,104 @@ if __name__ == '__main__':
     print(f'senderAckNum: {senderAckNum} \n')
     
     # Perform handshake with Receiver
-    perform_three_way_handshake()
+    try:
+        perform_three_way_handshake()
+    except TimeoutError as e:
+        print(f'Error: {e}.')
+        exit(0)
     
     # After performing three-way handshake:
     #   senderSeqNum should be Y + 1
     #   senderAckNum should be X + 1, where X is Receiver's seq num
     print(f'\nsenderSeqNum: {senderSeqNum}')
     print(f'senderAckNum: {senderAckNum} \n')
+    if resumeOffset:
+        print(f'Resuming from byte {resumeOffset}: Receiver already has the file up to there \n')
+    if deltaPackets is not None:
+        print(f'Sending a delta of the copy Receiver has, in blocks of {deltaBlockSize} bytes \n')
+    
+    if PacketTrace.traceLevel >= PacketTrace.EVENTS:
+        PacketTrace.trace_event('connected', mode=protocolMode, sack=sackEnabled, mss=payloadBufferSize)
     
     # ------------------------------------  Sender Operation  ------------------------------------ 
     
     # Sender send base
     sendBase = senderSeqNum
-    # Sender window size N=16
-    senderWindowSize = 16
     
-    perform_sender_operation()
+    # Sender window size is the congestion window (cwnd), adjusted from ACKs and losses by the congestion controller
+    # It never exceeds maxSenderWindowSize; the fixed controller keeps it at maxSenderWindowSize
+    maxSenderWindowSize = get_optional_argument('--max-window', 256)
+    try:
+        congestionController = CongestionControl.create_congestion_controller(get_optional_argument('--cc', 'reno'), 10, maxSenderWindowSize)
+    except ValueError as e:
+        print(f'Error: {e}.')
+        exit(0)
+    
+    # Losses of packets before recoverySeqNum were already reacted to by the congestion controller
+    recoverySeqNum = senderSeqNum
+    duplicateAcks = 0
+    
+    # (seconds since the transfer started, cwnd) when cwnd changes, written to the stats file
+    # Entries are at least cwndTraceInterval seconds apart, which grows so that there are fewer than maxCwndTraceLength
+    cwndTrace = []
+    cwndTraceInterval = 0
+    maxCwndTraceLength = 1024
+    transferStartTime = get_current_time()
+    statsFilename = get_stripe_filename(get_optional_argument('--stats', ''))
+    
+    # Transfer metrics are written to the stats file, and to a Prometheus text file every metricsInterval seconds
+    prometheusFilename = get_stripe_filename(get_optional_argument('--prometheus', ''))
+    metricsInterval = get_optional_argument('--metrics-interval', 1.0)
+    
+    # The time each packet in sndpkt was first sent, for measuring RTT
+    sendTimes = {}
+    
+    # Retransmission timer; timerDeadline is None while the timer is stopped
+    # In Selective Repeat mode, packetDeadlines has the deadline of each packet in flight instead
+    timerDeadline = None
+    packetDeadlines = {}
+    packetTimerHeap = []
+    
+    # Retransmission timeout (RTO), estimated from the measured RTT
+    # Before the first RTT sample, RTO is 1 second. It is never below minRetransmissionTimeout + peerMaxAckDelay
+    smoothedRTT = None
+    rttVariation = None
+    retransmissionTimeout = 1 # 1 second
+    clockGranularity = 0.001 # 1 millisecond
+    minRetransmissionTimeout = 0.005 # 5 milliseconds
+    maxRetransmissionTimeout = 60 # 60 seconds
+    
+    # Preallocated packet slots, one for each packet in the largest Sender window
+    # Each slot holds one packet of the negotiated segment size
+    sendBuffer = bytearray(maxSenderWindowSize * messageBufferSize)
+    sendBufferView = memoryview(sendBuffer)
+    
+    try:
+        perform_sender_operation()
+    except TimeoutError as e:
+        print(f'Error: {e}.')
+        exit(1)
+    
+    # Close input file
+    inputFile.close()
+    
+    if deltaPackets is not None:
+        print(f'Sent as a delta: {deltaCopiedBytes} of {fileSize} bytes were in the copy Receiver has')
+    
+    if statsFilename:
+        write_stats(statsFilename)
+    TransferMetrics.write_prometheus()
     
     # Close UDP socket
     UDPSocket.close()
     
+    PacketTrace.close_trace()
+    
     # Print out the amount of time used for executing this program
     endTime = time.time()
     print('Time lapsed in seconds: {:0.2f}'.format(endTime - startTime))
+    
+    # With checkpoints, Receiver keeps the file up to the first bad block, so sending it again resends from there
+    if badBlockRanges:
+        print(f'Error: Receiver found bad blocks at bytes {badBlockRanges} of {filename2}. Send the file again to resend them.')
+        exit(1)
@@ -0,0 +1,78 @@
+# PacketBenchmark.py
+
+# Usage: python3 PacketBenchmark.py [numOfPackets]
+# Example: python3 PacketBenchmark.py 1000000
+
+# Measures how many data packets per second can be assembled by Sender,
+# comparing the old make_pkt (struct.pack(...) + payload) with packets made in place in a preallocated slot
+# by NewSender.make_pkt_in_slot.
+
+import struct
+import sys
+import time
+import zlib
+
+import NewSender
+
+headerBufferSize = 15 # 15 bytes
+payloadBufferSize = 1009 # 1009 bytes
+messageBufferSize = headerBufferSize + payloadBufferSize # 1024 bytes
+
+pktFormat = '!BBBIII'
+
+# Old way: pack a new header, then concatenate it with the payload into a new packet
+def make_pkt_with_concatenation(seqNum, payload):
+    checksum = zlib.crc32(payload)
+    pkt = struct.pack(pktFormat, 0, 0, 0, seqNum, 0, checksum) + payload
+
+    return pkt
+
+# New way: NewSender.make_pkt_in_slot, with the payload already in slot, so only the header is written in front of it
+def make_pkt_in_slot(seqNum, slot, payloadSize):
+    NewSender.senderSeqNum = seqNum
+
+    return NewSender.make_pkt_in_slot(slot, payloadSize)
+
+# Set the globals of NewSender that make_pkt_in_slot uses, as after the handshake
+def setup_sender():
+    NewSender.headerBufferSize = headerBufferSize
+    NewSender.pktStruct = struct.Struct(pktFormat)
+    NewSender.synBit, NewSender.ackBit, NewSender.finBit = 0, 0, 0
+    NewSender.seqNumModulus = 2 ** 32
+    NewSender.senderSeqNum, NewSender.senderAckNum = 0, 0
+
+    return
+
+# Run makePacket for numOfPackets times and return the number of packets made per second
+def measure_packets_per_second(makePacket, numOfPackets):
+    startTime = time.perf_counter()
+    for seqNum in range(numOfPackets):
+        makePacket(seqNum)
+    endTime = time.perf_counter()
+
+    return numOfPackets / (endTime - startTime)
+
+if __name__ == '__main__':
+    try:
+        numOfPackets = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    except ValueError:
+        print('Error: Invalid arguments. Syntax: PacketBenchmark.py [numOfPackets]')
+        exit(0)
+
+    payload = bytes(payloadBufferSize)
+    setup_sender()
+
+    # A window of 16 preallocated slots, each already holding a payload like Sender's sendBuffer
+    senderWindowSize = 16
+    sendBuffer = bytearray(senderWindowSize * messageBufferSize)
+    sendBufferView = memoryview(sendBuffer)
+    slots = [sendBufferView[i * messageBufferSize:(i + 1) * messageBufferSize] for i in range(senderWindowSize)]
+
+    before = measure_packets_per_second(lambda seqNum: make_pkt_with_concatenation(seqNum, payload), numOfPackets)
+    after = measure_packets_per_second(lambda seqNum: make_pkt_in_slot(seqNum, slots[seqNum % senderWindowSize], payloadBufferSize), numOfPackets)
+
+    print(f'struct.pack + payload: {before:,.0f} packets/second')
+    print(f'pack_into slot:        {after:,.0f} packets/second')
+    print(f'Speedup: {after / before:0.2f}x')
+
+    exit(0)
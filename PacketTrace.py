@@ -0,0 +1,69 @@
+# PacketTrace.py
+
+# Structured tracing for NewSender.py and NewReceiver.py
+# When tracing is on, every event is written to the trace file as one JSON line (JSONL), e.g.
+#     {"t": 0.012345, "dir": "send", "seq": 123, "ack": 0, "flags": "", "len": 1024, "rtx": 1}
+#
+# Tracing is off unless open_trace is called. Call sites check the level before building an event:
+#     if PacketTrace.traceLevel >= PacketTrace.PACKETS:
+#         PacketTrace.trace_packet(...)
+# so a disabled trace costs one comparison per packet, and nothing is formatted or written.
+#
+# Use TraceSummarizer.py to summarise a trace file.
+
+import json
+import time
+
+# Trace levels
+OFF = 0      # Nothing is traced
+EVENTS = 1   # Connection events: handshake, timeouts, termination
+PACKETS = 2  # Connection events, and every packet sent and received
+
+traceLevel = OFF
+traceFile = None
+traceStartTime = 0
+
+# Start writing events up to level to the trace file filename. Timestamps are seconds from now
+def open_trace(filename, level):
+    global traceLevel, traceFile, traceStartTime
+
+    traceFile = open(filename, 'w', buffering=1024 * 1024)
+    traceLevel = level
+    traceStartTime = time.monotonic()
+
+    return
+
+# Stop tracing, and write out what is left in the trace file
+def close_trace():
+    global traceLevel, traceFile
+
+    if traceFile is not None:
+        traceFile.close()
+    traceFile = None
+    traceLevel = OFF
+
+    return
+
+# Write one event to the trace file
+def write_event(event):
+    global traceFile, traceStartTime
+
+    event['t'] = round(time.monotonic() - traceStartTime, 6)
+    traceFile.write(json.dumps(event, separators=(',', ':')) + '\n')
+
+    return
+
+# Trace a packet that was sent ('send') or received ('rcv'); isRetransmit marks packets that were sent before
+# seqNum and ackNum are the 32-bit values on the wire
+def trace_packet(direction, synBit, ackBit, finBit, seqNum, ackNum, length, isRetransmit=False):
+    flags = ('S' if synBit else '') + ('A' if ackBit else '') + ('F' if finBit else '')
+    write_event({'dir': direction, 'seq': seqNum, 'ack': ackNum, 'flags': flags, 'len': length, 'rtx': int(isRetransmit)})
+
+    return
+
+# Trace a connection event called name, with any extra fields
+def trace_event(name, **fields):
+    fields['event'] = name
+    write_event(fields)
+
+    return
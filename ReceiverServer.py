@@ -0,0 +1,897 @@
+# ReceiverServer.py
+
+# Usage: python3 ReceiverServer.py -s serverIPAddress -p serverPortNumber [--directory outputDirectory]
+#                                  [--mode gbn|sr] [--window N] [--sack 0|1] [--segment-size N] [--gro 0|1]
+#                                  [--ack-every N] [--ack-delay seconds] [--fsync 0|1] [--write-buffer bytes]
+#                                  [--max-sessions N] [--idle-timeout seconds] [--max-transfers N] [--workers N]
+#                                  [--checkpoint-interval bytes] [--verify 0|1] [--delta 0|1]
+#                                  [--stats statsFilename] [--prometheus metricsFilename] [--metrics-interval seconds]
+# Example: python3 ReceiverServer.py -s 0.0.0.0 -p 9000 --directory uploads
+# Then run any number of NewSender.py at the same time, each connecting to the server:
+#     python3 NewSender.py -s 127.0.0.1 -p 0 -t Apple.jpg OutputApple.jpg --connect 127.0.0.1:9000
+
+# A long-running Receiver that takes uploads from many Senders at once, on one UDP port.
+#
+# With NewReceiver.py, Receiver starts the handshake by sending SYN to a Sender it knows. Here it is the other way round:
+#   a Sender started with --connect sends a CONNECT packet (a SYN packet with 'CONNECT id=<connection ID>' as payload)
+#   to the server, and the server answers with the SYN of the usual handshake. From then on, the Sender cannot tell
+#   the server from NewReceiver.py.
+#
+# Every upload is a session, kept by the address of its Sender. A session holds the state of one NewReceiver.py: its seq and
+#   ack nums, protocol mode, reorder buffer, delayed ACK timer and output file. The packets of all sessions are
+#   handled by the Receiver logic of NewReceiver.py itself, with the session they belong to swapped into its globals.
+# The packet header has no room for a connection ID, so it is only sent in CONNECT: a CONNECT with a new connection ID
+#   from the address of a session means that its Sender restarted, and replaces the session. After CONNECT, the ISN the
+#   server picked at random for the session stands for it: every later packet of its Sender echoes it in its ack num,
+#   and packets that do not are dropped, e.g. late packets of an earlier Sender at the same address. A packet that echoes
+#   the ISN of a session from another address moves the session there, as when a NAT gives Sender a new port. With
+#   --workers, the packets from the new address may be handed to another worker, which drops them as part of no session.
+#
+# Memory is bounded per session: the reorder buffer holds no more than --window packets, and the output file is written
+#   through a buffer of --write-buffer bytes. No more than --max-sessions sessions are kept at once; further CONNECTs are
+#   ignored until a session ends. Sessions without packets for --idle-timeout seconds are dropped, and their output kept.
+# A session that received FIN sends its FIN/ACK again, on a repeated FIN or every second, until the last ACK of Sender
+#   arrives, up to 5 times; then it completes, since the whole file was received.
+#
+# As with NewReceiver.py, every session keeps a checkpoint of its output file every --checkpoint-interval bytes, and
+#   writes one more when it is dropped before FIN. A Sender that uploads the same file again resumes from it.
+# Unless turned off with --verify 0, every session also asks its Sender for block digests, and verifies each block of the
+#   file as it arrives, as NewReceiver.py does. Senders with --delta 1 get the signatures of the file of the same name in
+#   --directory, if there is one, and send it as a delta (unless turned off with --delta 0).
+#
+# One Python process handles the packets of all sessions on one CPU core. With --workers N, the server runs in N worker
+#   processes instead, each with its own socket bound to the same port with SO_REUSEPORT (Linux 3.9 or later). The kernel
+#   hands each Sender to one of them by a hash of its address, so every session lives in one worker, and the workers
+#   share nothing but the count of completed uploads. Each worker writes its own Prometheus file (with '.worker<N>'
+#   added to the name), and their stats are merged into one stats file.
+#
+# Striped transfers (NewSender.py --stripes N) arrive as N sessions, one for each byte range of the file, each with the
+#   manifest of its stripe in its CONNECT. Every stripe writes its range at its offset of the same output file, and keeps
+#   track of the stripes written so far in a manifest file next to it ('.manifest' added to the name), which worker
+#   processes share. Once every stripe is written, the whole output file is checked against the CRC-32 of the input file.
+#   Each stripe counts as an upload for --max-transfers. Stripes keep no checkpoints, are not resumed, and are not sent as deltas.
+#
+# Output files are written to --directory, under the name Sender asks for without its directory part.
+# The server runs until Ctrl-C or SIGTERM, or until --max-transfers uploads have completed, and then writes its stats.
+
+import fcntl
+import heapq
+import json
+import multiprocessing
+import os
+import selectors
+import signal
+import socket
+import sys
+import zlib
+
+import NewReceiver
+import TransferMetrics
+
+# open_output_file of NewReceiver.py, which open_session_output_file replaces, and uses for every output file but stripes
+openReceiverOutputFile = NewReceiver.open_output_file
+
+# Globals of NewReceiver.py that belong to one session, and are swapped in before handling its packets
+sessionVariables = [
+    'senderIPAddress', 'senderPortNumber', 'receiverSeqNum', 'receiverAckNum', 'protocolMode', 'receiverWindowSize',
+    'sackEnabled', 'reorderBuffer', 'unacknowledgedPackets', 'ackDeadline', 'filename', 'filenameReceived', 'outputFile',
+    'payloadBufferSize', 'fileSize', 'firstDataSeqNum', 'outputOffset', 'outputPosition', 'checkpointFilename',
+    'checkpointOffset', 'checkpointChecksum', 'resumeOffer', 'segmentsPerBlock', 'blockHasher', 'blockStartOffset', 'badBlockRanges',
+    'basisFilename', 'basisFile', 'deltaBlockSize', 'numOfBasisBlocks', 'basisSignatures',
+]
+
+# The session whose variables are in the globals of NewReceiver.py (None if no session is)
+activeSession = None
+
+# Session counters, added to the counters of TransferMetrics.py
+sessionCounterDescriptions = {
+    'sessionsOpened': ('sessions_opened_total', 'Sessions opened for a CONNECT from Sender'),
+    'sessionsCompleted': ('sessions_completed_total', 'Sessions that received the whole file and closed with FIN'),
+    'sessionsReaped': ('sessions_reaped_total', 'Sessions dropped after receiving no packet for the idle timeout'),
+    'sessionsRejected': ('sessions_rejected_total', 'CONNECTs ignored because the largest number of sessions was open'),
+    'sessionsFailed': ('sessions_failed_total', 'Sessions dropped because their output file could not be written'),
+    'sessionsMoved': ('sessions_moved_total', 'Sessions moved to another Sender address that echoed their ISN'),
+    'stripedTransfersVerified': ('striped_transfers_verified_total', 'Striped transfers whose whole output file matched the input file'),
+    'stripedTransfersFailed': ('striped_transfers_failed_total', 'Striped transfers whose whole output file did not match the input file'),
+}
+
+# ------------------------------------  Handle Arguments  ------------------------------------
+
+# Get serverIPAddress and serverPortNumber based on sys.argv
+def setup_arguments():
+    '''
+    sys.argv[0]: ReceiverServer.py;     sys.argv[1]: -s
+    sys.argv[2]: <serverIPAddress>;     sys.argv[3]: -p
+    sys.argv[4]: <serverPortNumber>
+    '''
+    serverIPAddress = sys.argv[2]
+    serverPortNumber = int(sys.argv[4])
+
+    return (serverIPAddress, serverPortNumber)
+
+# Get the value that follows an optional flag in sys.argv, converted to the type of defaultValue
+# If the flag is not in sys.argv, use defaultValue
+def get_optional_argument(flag, defaultValue):
+    if flag in sys.argv[5:-1]:
+        return type(defaultValue)(sys.argv[sys.argv.index(flag) + 1])
+
+    return defaultValue
+
+# ------------------------------------  Set Up Receiver  ------------------------------------
+
+# Create a non-blocking UDP socket for every Sender, bound to serverAddress
+# With reusePort, several sockets can be bound to the same address (SO_REUSEPORT), one for each worker process;
+#   the kernel hands the packets of each Sender to one of them, by a hash of its address
+def create_server_socket(serverAddress, reusePort):
+    NewReceiver.socketBufferSize = 4 * 1024 * 1024
+    serverSocket = NewReceiver.create_udp_socket()
+    if reusePort:
+        serverSocket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    serverSocket.bind(serverAddress)
+    serverSocket.setblocking(False)
+
+    return serverSocket
+
+# Set the globals of NewReceiver.py that its main block sets and that are shared by every session, receiving on serverSocket
+def setup_receiver():
+    global serverSocket, ackEveryNPackets, ackDelay, fsyncOutputFile, writeBufferSize, groEnabled, checkpointInterval, blockHashRequested
+    receiver = NewReceiver
+
+    receiver.headerBufferSize = 15
+    receiver.maxPayloadBufferSize = 65507 - receiver.headerBufferSize
+    receiver.payloadBufferSize = receiver.maxPayloadBufferSize
+    # Sessions negotiate different segment sizes, so every datagram is received with room for the largest one
+    receiver.messageBufferSize = receiver.headerBufferSize + receiver.maxPayloadBufferSize
+
+    receiver.UDP_GRO = 104
+    receiver.groSizeStruct = NewReceiver.struct.Struct('=i')
+    receiver.groBufferSize = 65535
+    receiver.receivedPackets = NewReceiver.collections.deque()
+    receiver.receiveBufferRing = [memoryview(bytearray(receiver.groBufferSize)) for i in range(4)]
+    receiver.receiveBufferIndex = 0
+
+    receiver.synBit, receiver.ackBit, receiver.finBit = 0, 0, 0
+    receiver.pktStruct = NewReceiver.struct.Struct('!BBBIII')
+    receiver.sackBlockStruct = NewReceiver.struct.Struct('!II')
+    receiver.maxSackBlocks = 4
+    receiver.ackBuffer = bytearray(receiver.headerBufferSize + receiver.maxSackBlocks * receiver.sackBlockStruct.size)
+    receiver.emptyPayloadChecksum = receiver.generate_checksum(b'')
+    receiver.seqNumModulus = 2 ** 32
+    # Packets that belong to no session are decomposed against these seq and ack nums
+    receiver.receiverSeqNum, receiver.receiverAckNum = 0, 0
+
+    receiver.ackEveryNPackets = ackEveryNPackets
+    receiver.ackDelay = ackDelay
+    receiver.fsyncOutputFile = fsyncOutputFile
+    receiver.writeBufferSize = writeBufferSize
+    receiver.checkpointInterval = checkpointInterval
+    receiver.blockDigestSize = 32
+    receiver.maxReportedBadRanges = 16
+    receiver.deltaSignatureStruct = NewReceiver.struct.Struct('!I16s')
+    receiver.deltaCopyStruct = NewReceiver.struct.Struct('!cII')
+    receiver.minDeltaBlockSize = 4096
+    receiver.maxDeltaBlockSize = 64 * 1024
+    receiver.get_output_path = get_session_output_path
+    receiver.open_output_file = open_session_output_file
+
+    receiver.UDPSocket = serverSocket
+    receiver.groEnabled = groEnabled and receiver.enable_udp_gro()
+
+    return
+
+# Get the path of the output file for the filename Sender asks for: only its last part is used, in outputDirectory,
+#   so that a Sender cannot write outside outputDirectory. It replaces get_output_path in NewReceiver.py
+def get_session_output_path(filename):
+    global outputDirectory
+
+    return os.path.join(outputDirectory, os.path.basename(filename))
+
+# Open the output file of the active session in outputDirectory. It replaces open_output_file in NewReceiver.py
+# Every output file but a stripe is opened as NewReceiver.py does: allocated at its full size first when Sender announced
+#   the file size, and kept up to outputOffset when the transfer resumes
+# A stripe of a striped transfer writes its byte range of the output file, from its offset on. The file is not truncated,
+#   since other stripes may have written their ranges already, but sized and allocated for the whole file
+def open_session_output_file(filename):
+    global writeBufferSize, activeSession
+
+    if not os.path.basename(filename):
+        return open(os.devnull, 'wb')
+
+    outputFilename = get_session_output_path(filename)
+    activeSession['outputFilename'] = outputFilename
+    stripeManifest = activeSession['stripeManifest']
+
+    if not stripeManifest:
+        return openReceiverOutputFile(outputFilename)
+
+    try:
+        fileDescriptor = os.open(outputFilename, os.O_RDWR | os.O_CREAT, 0o644)
+        os.ftruncate(fileDescriptor, stripeManifest['size'])
+        NewReceiver.preallocate_output_file(fileDescriptor, stripeManifest['size'])
+    except OSError as e:
+        raise OSError(e.errno, e.strerror, outputFilename)
+    outputFile = open(fileDescriptor, 'wb', buffering=writeBufferSize)
+    outputFile.seek(NewReceiver.outputOffset)
+
+    return outputFile
+
+# ------------------------------------  Handle Stripes  ------------------------------------
+
+# Get the manifest of a stripe from the options of its CONNECT, or {} if the transfer is not striped
+# Sender puts in it the ID, size and CRC-32 of the whole transfer, its number of stripes, and the byte range of this stripe
+def get_stripe_manifest(connectOptions):
+    if 'transfer' not in connectOptions:
+        return {}
+
+    try:
+        stripeManifest = {name: int(connectOptions[name]) for name in ('size', 'crc', 'stripes', 'stripe', 'offset', 'length')}
+    except (KeyError, ValueError):
+        return {}
+    stripeManifest['transfer'] = connectOptions['transfer']
+
+    return stripeManifest
+
+# Record that the stripe in stripeManifest has been written to outputFilename
+# The stripes written so far are kept in a manifest file next to the output file, which is shared by every worker
+#   process that receives a stripe of the transfer, and locked while it is updated. Once every stripe has been written,
+#   the manifest file is removed, and the whole output file is checked once
+def finish_stripe(stripeManifest, outputFilename):
+    manifestFilename = outputFilename + '.manifest'
+
+    with open(os.open(manifestFilename, os.O_RDWR | os.O_CREAT, 0o644), 'r+') as mf:
+        fcntl.flock(mf, fcntl.LOCK_EX)
+        content = mf.read()
+        manifest = json.loads(content) if content else {}
+        if manifest.get('transfer') != stripeManifest['transfer']:
+            manifest = {name: stripeManifest[name] for name in ('transfer', 'size', 'crc', 'stripes')}
+            manifest['finishedStripes'] = []
+        if stripeManifest['stripe'] not in manifest['finishedStripes']:
+            manifest['finishedStripes'].append(stripeManifest['stripe'])
+
+        isTransferComplete = len(manifest['finishedStripes']) == manifest['stripes']
+        if isTransferComplete:
+            os.remove(manifestFilename)
+        else:
+            mf.seek(0)
+            mf.truncate()
+            json.dump(manifest, mf)
+
+    if isTransferComplete:
+        check_striped_output(manifest, outputFilename)
+
+    return
+
+# Check that the output file of a striped transfer has the size and CRC-32 of the input file, now that every stripe is written
+def check_striped_output(manifest, outputFilename):
+    checksum = 0
+    with open(outputFilename, 'rb') as f:
+        while chunk := f.read(1024 * 1024):
+            checksum = zlib.crc32(chunk, checksum)
+
+    if os.path.getsize(outputFilename) == manifest['size'] and checksum == manifest['crc']:
+        TransferMetrics.count('stripedTransfersVerified')
+        print(f'Striped transfer {manifest["transfer"]} into {outputFilename}: {manifest["stripes"]} stripes, verified')
+    else:
+        TransferMetrics.count('stripedTransfersFailed')
+        print(f'Error: Striped transfer {manifest["transfer"]} into {outputFilename} does not match the CRC-32 of its input file.')
+
+    return
+
+# ------------------------------------  Handle Sessions  ------------------------------------
+
+# Create a session for the Sender at address, which asked for it with connectionId (and stripeManifest, for a stripe)
+# Its variables start as those of NewReceiver.py before the handshake. Its random ISN is not that of any other session
+def create_session(address, connectionId, stripeManifest):
+    global sessions, sessionsByIsn, protocolMode, receiverWindowSize, sackEnabled, payloadBufferSize
+
+    isn = NewReceiver.generate_random_initial_sequence_number()
+    while isn in sessionsByIsn:
+        isn = NewReceiver.generate_random_initial_sequence_number()
+
+    session = {
+        'address': address,
+        'connectionId': connectionId,
+        'isn': isn,
+        'stripeManifest': stripeManifest,
+        'outputFilename': '',
+        'state': 'syn-sent',
+        'synPacket': None,
+        'ackPacket': None,
+        'ackFinPacket': None,
+        'finAttempts': 0,
+        'finDeadline': None,
+        'lastPacketTime': NewReceiver.get_current_time(),
+        'senderIPAddress': address[0],
+        'senderPortNumber': address[1],
+        'receiverSeqNum': isn,
+        'receiverAckNum': 0,
+        'protocolMode': protocolMode,
+        'receiverWindowSize': receiverWindowSize,
+        'sackEnabled': sackEnabled,
+        'reorderBuffer': {},
+        'unacknowledgedPackets': 0,
+        'ackDeadline': None,
+        'filename': '',
+        'filenameReceived': False,
+        'outputFile': None,
+        'payloadBufferSize': payloadBufferSize,
+        'fileSize': None,
+        'firstDataSeqNum': 0,
+        'outputOffset': stripeManifest['offset'] if stripeManifest else 0,
+        'outputPosition': 0,
+        'checkpointFilename': '',
+        'checkpointOffset': 0,
+        'checkpointChecksum': 0,
+        'resumeOffer': {},
+        'segmentsPerBlock': 0,
+        'blockHasher': None,
+        'blockStartOffset': 0,
+        'badBlockRanges': [],
+        'basisFilename': '',
+        'basisFile': None,
+        'deltaBlockSize': 0,
+        'numOfBasisBlocks': 0,
+        'basisSignatures': bytearray(),
+    }
+    sessions[address] = session
+    sessionsByIsn[isn] = session
+
+    return session
+
+# Get the session that a packet from address with seqNum and ackNum (as they are on the wire) belongs to, or None if it is
+#   part of none. Sender echoes the ISN of its session in the ack num of every packet after CONNECT: ISN + 1, and ISN + 2
+#   in its last ACK
+# The session at address is the one, if the ISN matches. Otherwise, the session with the ISN moves to address if mayMove,
+#   unless another session is there. Only a packet that Receiver has not received yet moves it, so that a late packet
+#   from the address Sender used before does not move it back
+def find_session(address, seqNum, ackNum, mayMove):
+    global sessions, sessionsByIsn
+
+    session = sessions.get(address)
+    if session is not None:
+        return session if (ackNum - session['isn']) % NewReceiver.seqNumModulus in (1, 2) else None
+    if not mayMove:
+        return None
+
+    session = sessionsByIsn.get((ackNum - 1) % NewReceiver.seqNumModulus) or sessionsByIsn.get((ackNum - 2) % NewReceiver.seqNumModulus)
+    if session is None:
+        return None
+    activate_session(session)
+    if NewReceiver.unwrap_seq_num(seqNum, NewReceiver.receiverAckNum) < NewReceiver.receiverAckNum:
+        return None
+    move_session(session, address)
+
+    return session
+
+# Move the active session to address, where its Sender sends from now on
+def move_session(session, address):
+    global sessions
+
+    del sessions[session['address']]
+    session['address'] = address
+    sessions[address] = session
+    NewReceiver.senderIPAddress, NewReceiver.senderPortNumber = address
+    TransferMetrics.count('sessionsMoved')
+
+    return
+
+# Swap session into the globals of NewReceiver.py, after saving the variables of the session that was there
+def activate_session(session):
+    global activeSession
+
+    if session is activeSession:
+        return
+
+    if activeSession is not None:
+        for name in sessionVariables:
+            activeSession[name] = getattr(NewReceiver, name)
+    for name in sessionVariables:
+        setattr(NewReceiver, name, session[name])
+    activeSession = session
+
+    return
+
+# Drop session; its output file is closed first, so that what it received so far is kept
+# Unless the session completed, a checkpoint is written too, so that Sender can resume the transfer from there
+# A delta transfer that did not complete cannot be resumed; the file it was rebuilding is removed, and its copy kept
+def remove_session(session):
+    global sessions, activeSession
+
+    activate_session(session)
+    if NewReceiver.basisFile is not None and not NewReceiver.basisFile.closed:
+        NewReceiver.basisFile.close()
+        NewReceiver.outputFile.close()
+        os.remove(session['outputFilename'])
+    if NewReceiver.outputFile is not None and not NewReceiver.outputFile.closed:
+        try:
+            try:
+                if NewReceiver.checkpointFilename:
+                    NewReceiver.write_checkpoint()
+            finally:
+                NewReceiver.close_output_file()
+        except OSError as e:
+            print('Error: %s - %s.' % (e.filename, e.strerror))
+    activeSession = None
+    del sessions[session['address']]
+    del sessionsByIsn[session['isn']]
+
+    return
+
+# Drop session, which received the whole file, and count it as a completed upload
+def complete_session(session):
+    global completedTransfers, totalCompletedTransfers
+
+    remove_session(session)
+    completedTransfers += 1
+    with totalCompletedTransfers.get_lock():
+        totalCompletedTransfers.value += 1
+    TransferMetrics.count('sessionsCompleted')
+
+    return
+
+# Send the FIN/ACK of the active session again, and restart its timer: the FIN/ACK is sent again finTimeout seconds later,
+#   unless the last ACK of Sender arrives first
+def send_ack_fin_packet(isRetransmit):
+    global ackTimerHeap, activeSession, finTimeout
+
+    NewReceiver.udt_send(activeSession['ackFinPacket'], isRetransmit)
+    activeSession['finAttempts'] += 1
+    activeSession['finDeadline'] = NewReceiver.get_current_time() + finTimeout
+    heapq.heappush(ackTimerHeap, (activeSession['finDeadline'], activeSession['isn']))
+
+    return
+
+# Schedule the delayed ACK timer of the active session, if it was started
+# The heap keeps timers that were stopped or restarted since; they are skipped when they come up
+def schedule_ack_deadline():
+    global ackTimerHeap, activeSession
+
+    if NewReceiver.ackDeadline is not None and NewReceiver.ackDeadline != activeSession.get('scheduledAckDeadline'):
+        activeSession['scheduledAckDeadline'] = NewReceiver.ackDeadline
+        heapq.heappush(ackTimerHeap, (NewReceiver.ackDeadline, activeSession['isn']))
+
+    return
+
+# ------------------------------------  Handle Packets  ------------------------------------
+
+# Event: Receive a CONNECT packet. Start the handshake of a new session by sending SYN, as NewReceiver.py does
+# A CONNECT for a session whose handshake has not completed means the SYN was lost, and it is sent again
+def handle_connect_packet(address, payload):
+    global sessions, maxSessions, payloadBufferSize, ackDelay, blockHashRequested, deltaRequested
+
+    connectOptions = NewReceiver.decode_handshake_options(payload)
+    connectionId = connectOptions.get('id', '')
+    session = sessions.get(address)
+
+    if session is not None and session['connectionId'] == connectionId:
+        if session['state'] == 'syn-sent':
+            activate_session(session)
+            NewReceiver.udt_send(session['synPacket'], True)
+        return
+
+    if session is not None:
+        # The Sender at address restarted; its previous upload will not go on
+        remove_session(session)
+    elif len(sessions) >= maxSessions:
+        TransferMetrics.count('sessionsRejected')
+        return
+
+    session = create_session(address, connectionId, get_stripe_manifest(connectOptions))
+    activate_session(session)
+
+    NewReceiver.synBit, NewReceiver.ackBit = 1, 0
+    requestedOptions = {'mode': NewReceiver.protocolMode, 'window': NewReceiver.receiverWindowSize, 'sack': int(NewReceiver.sackEnabled), 'mss': payloadBufferSize, 'ackdelay': ackDelay}
+    if blockHashRequested:
+        requestedOptions['hash'] = 'blake2b'
+    if deltaRequested:
+        requestedOptions['delta'] = 1
+    session['synPacket'] = NewReceiver.make_pkt(NewReceiver.encode_handshake_options('SYN', requestedOptions))
+    NewReceiver.udt_send(session['synPacket'])
+    NewReceiver.receiverSeqNum += 1 # Increment Receiver seq num b/c of the phantom byte
+    NewReceiver.synBit = 0
+
+    TransferMetrics.count('sessionsOpened')
+
+    return
+
+# Event: Receive the SYN/ACK packet of a session. Use the options accepted by Sender, and complete the handshake with ACK,
+#   which offers to resume the transfer if a checkpoint of an earlier one is kept, or a delta transfer (but not for a stripe)
+def handle_syn_ack_packet(session, seqNum, payload):
+    NewReceiver.receiverAckNum = seqNum + 1
+    NewReceiver.firstDataSeqNum = NewReceiver.receiverAckNum + 1
+    NewReceiver.accept_handshake_options(payload)
+    if session['stripeManifest']:
+        NewReceiver.checkpointFilename = ''
+        NewReceiver.basisFilename = ''
+
+    # The ACK is kept, to be sent again if the SYN/ACK arrives again
+    NewReceiver.ackBit = 1
+    session['ackPacket'] = NewReceiver.make_pkt(NewReceiver.make_handshake_ack_payload())
+    NewReceiver.udt_send(session['ackPacket'])
+    NewReceiver.ackBit = 0
+
+    session['state'] = 'established'
+    session['synPacket'] = None
+
+    return
+
+# Event: Receive the FIN packet of a session. The last block is verified, and the output file flushed (and synced)
+#   before FIN is acknowledged, as NewReceiver.py does, and the session waits for the last ACK of Sender
+def handle_fin_packet(session, payload):
+    NewReceiver.finish_output_file(payload)
+    if NewReceiver.badBlockRanges:
+        print(f'Error: {session["outputFilename"]} has bad blocks at bytes {NewReceiver.format_bad_block_ranges()}.')
+    if session['stripeManifest']:
+        finish_stripe(session['stripeManifest'], session['outputFilename'])
+
+    # The FIN/ACK is kept, to be sent again if FIN arrives again, or no ACK arrives in time
+    NewReceiver.receiverAckNum += 1
+    NewReceiver.ackBit, NewReceiver.finBit = 1, 1
+    session['ackFinPacket'] = NewReceiver.make_pkt(NewReceiver.make_ack_fin_payload())
+    NewReceiver.receiverSeqNum += 1
+    NewReceiver.ackBit, NewReceiver.finBit = 0, 0
+
+    session['state'] = 'closing'
+    send_ack_fin_packet(False)
+
+    return
+
+# Handle a packet from the Sender at address, in the session it belongs to
+def handle_server_packet(packet, address):
+    global sessions
+
+    if len(packet) < NewReceiver.headerBufferSize:
+        return
+
+    # The session is found by the header as it is on the wire, before its seq and ack nums are unwrapped against the session
+    # A CONNECT belongs to the session at its address, if there is one; a corrupted packet never moves a session
+    receivedSynBit, receivedAckBit, receivedFinBit, seqNum, ackNum, checksum = NewReceiver.pktStruct.unpack_from(packet)
+    isCorrupted = NewReceiver.is_corrupted(packet[NewReceiver.headerBufferSize:], checksum)
+    if receivedSynBit == 1 and receivedAckBit == 0:
+        session = sessions.get(address)
+    else:
+        session = find_session(address, seqNum, ackNum, not isCorrupted)
+    if session is not None:
+        activate_session(session)
+        session['lastPacketTime'] = NewReceiver.get_current_time()
+
+    receivedSynBit, receivedAckBit, receivedFinBit, seqNum, ackNum, checksum, payload = NewReceiver.decompose_pkt(packet)
+    if isCorrupted:
+        # As with NewReceiver.py, a corrupted packet of an established session goes to the Receiver logic,
+        #   which answers it with a duplicate ACK in GBN mode. Other corrupted packets are dropped
+        TransferMetrics.count('corruptedPackets')
+        if session is not None and session['state'] == 'established':
+            NewReceiver.handle_data_packet(seqNum, payload, isCorrupted)
+            schedule_ack_deadline()
+        return
+
+    if receivedSynBit == 1 and receivedAckBit == 0:
+        handle_connect_packet(address, payload)
+    elif session is None:
+        # Not part of any session, e.g. a late packet of a session that was dropped
+        return
+    elif session['state'] == 'syn-sent':
+        if receivedSynBit == 1 and receivedAckBit == 1:
+            handle_syn_ack_packet(session, seqNum, payload)
+    elif session['state'] == 'established':
+        if receivedSynBit == 1 and receivedAckBit == 1:
+            # Sender sent its SYN/ACK again, since the ACK that completes the handshake was lost
+            NewReceiver.udt_send(session['ackPacket'], True)
+        elif receivedAckBit == 1 and receivedFinBit == 0:
+            # Sender asks for the signatures of the copy of the file offered for a delta transfer
+            NewReceiver.send_basis_signatures(payload)
+        elif receivedFinBit == 1:
+            handle_fin_packet(session, payload)
+        else:
+            try:
+                NewReceiver.handle_data_packet(seqNum, payload, isCorrupted)
+            except OSError as e:
+                # The output file cannot be written, e.g. the disk is full; the upload cannot go on
+                print('Error: %s - %s.' % (e.filename, e.strerror))
+                remove_session(session)
+                TransferMetrics.count('sessionsFailed')
+                return
+            schedule_ack_deadline()
+    elif session['state'] == 'closing':
+        # The last ACK of Sender (with its FIN bit still set), or FIN again, since the FIN/ACK was lost
+        # Data packets that were still in flight before FIN are ignored
+        if receivedFinBit == 1 and receivedAckBit == 1:
+            complete_session(session)
+        elif receivedFinBit == 1:
+            send_ack_fin_packet(True)
+
+    return
+
+# ------------------------------------  Handle Timers  ------------------------------------
+
+# Event: Delayed ACK timers time out. Send the cumulative ACK of every session whose timer is due by now
+# The FIN/ACK timers of closing sessions are in the same heap. A due one sends the FIN/ACK again, up to maxFinAttempts
+#   times; after that, the session completes without the last ACK of Sender, since its file was received already
+def handle_due_ack_timers(now):
+    global ackTimerHeap, sessionsByIsn, maxFinAttempts
+
+    while ackTimerHeap and ackTimerHeap[0][0] <= now:
+        deadline, isn = heapq.heappop(ackTimerHeap)
+        session = sessionsByIsn.get(isn)
+        if session is None:
+            continue
+
+        if session['state'] == 'closing':
+            if session['finDeadline'] is not None and session['finDeadline'] <= now:
+                activate_session(session)
+                if session['finAttempts'] >= maxFinAttempts:
+                    complete_session(session)
+                else:
+                    send_ack_fin_packet(True)
+            continue
+        if session['state'] != 'established':
+            continue
+
+        # Unless the timer was stopped since, or restarted with a later deadline that has its own entry in the heap
+        activate_session(session)
+        if NewReceiver.ackDeadline is not None and NewReceiver.ackDeadline <= now:
+            NewReceiver.send_cumulative_ack()
+            session['scheduledAckDeadline'] = None
+
+    return
+
+# Drop every session that has received no packet for idleTimeout seconds
+def reap_idle_sessions(now):
+    global sessions, idleTimeout
+
+    for session in [session for session in sessions.values() if now - session['lastPacketTime'] >= idleTimeout]:
+        remove_session(session)
+        TransferMetrics.count('sessionsReaped')
+
+    return
+
+# Get the number of seconds until the next delayed ACK timer or idle session check is due
+def get_time_until_next_timer(now):
+    global ackTimerHeap, nextReapTime
+
+    nextTime = min(ackTimerHeap[0][0], nextReapTime) if ackTimerHeap else nextReapTime
+
+    return max(0, nextTime - now)
+
+# ------------------------------------  Handle Stats  ------------------------------------
+
+# Get statistics about the server: the transfer metrics of every session together, and the sessions open now
+def get_stats():
+    global sessions, completedTransfers
+
+    stats = TransferMetrics.get_stats()
+    stats['activeSessions'] = len(sessions)
+    stats['completedTransfers'] = completedTransfers
+
+    return stats
+
+# Get the statistics of all worker processes together: their counters, sessions and goodput added up,
+#   along with the statistics of each worker
+def merge_worker_stats(workerStatsList):
+    counters = {}
+    for workerStats in workerStatsList:
+        for name, value in workerStats['counters'].items():
+            counters[name] = counters.get(name, 0) + value
+
+    return {
+        'role': 'receiver-server',
+        'workers': len(workerStatsList),
+        'elapsedSeconds': max([workerStats['elapsedSeconds'] for workerStats in workerStatsList], default=0),
+        'goodputBytesPerSecond': sum(workerStats['goodputBytesPerSecond'] for workerStats in workerStatsList),
+        'counters': counters,
+        'activeSessions': sum(workerStats['activeSessions'] for workerStats in workerStatsList),
+        'completedTransfers': sum(workerStats['completedTransfers'] for workerStats in workerStatsList),
+        'workerStats': workerStatsList,
+    }
+
+# Get the name of the stats or Prometheus file of worker process workerIndex: filename with '.worker<workerIndex>'
+#   before its extension. Without worker processes (workerIndex 0), it is filename itself
+def get_worker_filename(filename, workerIndex):
+    if not filename or not workerIndex:
+        return filename
+
+    root, extension = os.path.splitext(filename)
+
+    return f'{root}.worker{workerIndex}{extension}'
+
+# Write statistics about the server to the JSON file statsFilename
+def write_stats(statsFilename):
+    with open(statsFilename, 'w') as f:
+        json.dump(get_stats(), f, indent=4)
+
+    return
+
+# Stop on SIGTERM like on Ctrl-C, so that output files are closed and the stats are written
+def handle_sigterm(signalNumber, frame):
+    raise KeyboardInterrupt
+
+# ------------------------------------  Handle Relaying Packets  ------------------------------------
+
+# Receive packets from every Sender until the server is stopped, or maxTransfers uploads have completed
+# The socket is non-blocking: every packet that is waiting is handled before waiting for the next timer again
+# Uploads are counted in totalCompletedTransfers, which all worker processes share
+def perform_server_operation():
+    global serverSocket, sessions, totalCompletedTransfers, maxTransfers, nextReapTime, reapInterval
+
+    selector = selectors.DefaultSelector()
+    selector.register(serverSocket, selectors.EVENT_READ)
+
+    while not maxTransfers or totalCompletedTransfers.value < maxTransfers:
+        selector.select(get_time_until_next_timer(NewReceiver.get_current_time()))
+
+        while True:
+            try:
+                packet, address = NewReceiver.udt_rcv()
+            except (BlockingIOError, ConnectionRefusedError):
+                break
+            handle_server_packet(packet, address)
+
+        now = NewReceiver.get_current_time()
+        handle_due_ack_timers(now)
+        if now >= nextReapTime:
+            reap_idle_sessions(now)
+            nextReapTime = now + reapInterval
+
+        TransferMetrics.write_prometheus_if_due()
+
+    selector.close()
+
+    return
+
+# Run the server on serverSocket until it is stopped, or maxTransfers uploads have completed
+# Sessions still open then are dropped, and what they received so far is kept. Then the stats are written
+# workerIndex numbers the worker processes from 1; it is 0 without --workers
+def run_server(socketOfServer, workerIndex):
+    global serverSocket, sessions, statsFilename, prometheusFilename, metricsInterval
+
+    serverSocket = socketOfServer
+    role = f'receiver-server-{workerIndex}' if workerIndex else 'receiver-server'
+    TransferMetrics.start_metrics(role, get_worker_filename(prometheusFilename, workerIndex), metricsInterval)
+    setup_receiver()
+
+    try:
+        perform_server_operation()
+    except KeyboardInterrupt:
+        # Ctrl-C reaches the worker processes, and SIGTERM from the main process may follow; stop only once
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+
+    for session in list(sessions.values()):
+        remove_session(session)
+
+    if statsFilename:
+        write_stats(get_worker_filename(statsFilename, workerIndex))
+    TransferMetrics.write_prometheus()
+
+    serverSocket.close()
+
+    return
+
+# Run the server in a worker process for each of serverSockets, and wait until they have all stopped
+# The stats of the workers are merged into one stats file; each of them writes its own Prometheus file
+def run_workers(serverSockets):
+    global multiprocessingContext, statsFilename
+
+    workers = [multiprocessingContext.Process(target=run_server, args=(serverSocket, i + 1)) for i, serverSocket in enumerate(serverSockets)]
+    for worker in workers:
+        worker.start()
+    for serverSocket in serverSockets:
+        serverSocket.close()
+
+    try:
+        for worker in workers:
+            worker.join()
+    except KeyboardInterrupt:
+        for worker in workers:
+            worker.terminate()
+        for worker in workers:
+            worker.join()
+
+    if statsFilename:
+        workerStatsList = []
+        for workerIndex in range(1, len(workers) + 1):
+            workerStatsFilename = get_worker_filename(statsFilename, workerIndex)
+            try:
+                with open(workerStatsFilename, 'r') as f:
+                    workerStatsList.append(json.load(f))
+                os.remove(workerStatsFilename)
+            except FileNotFoundError:
+                continue
+        with open(statsFilename, 'w') as f:
+            json.dump(merge_worker_stats(workerStatsList), f, indent=4)
+
+    return
+
+# ------------------------------------  Main  ------------------------------------
+
+if __name__ == '__main__':
+    try:
+        serverIPAddress, serverPortNumber = setup_arguments()
+
+        outputDirectory = get_optional_argument('--directory', '.')
+
+        # Protocol mode, reorder buffer size and SACK requested from every Sender, as with NewReceiver.py
+        protocolMode = get_optional_argument('--mode', 'gbn')
+        receiverWindowSize = get_optional_argument('--window', 16)
+        sackEnabled = get_optional_argument('--sack', 1) == 1
+        payloadBufferSize = min(get_optional_argument('--segment-size', 65492), 65492)
+        groEnabled = get_optional_argument('--gro', 1) == 1
+
+        ackEveryNPackets = get_optional_argument('--ack-every', 2)
+        ackDelay = get_optional_argument('--ack-delay', 0.002)
+        fsyncOutputFile = get_optional_argument('--fsync', 1)
+
+        # Each session writes its output file through a buffer of writeBufferSize bytes
+        #   and keeps a checkpoint of it every checkpointInterval bytes (none with 0)
+        writeBufferSize = get_optional_argument('--write-buffer', 256 * 1024)
+        checkpointInterval = get_optional_argument('--checkpoint-interval', 64 * 1024 * 1024)
+
+        # Every session asks its Sender for block digests, unless --verify 0, and offers delta transfers, unless --delta 0
+        blockHashRequested = get_optional_argument('--verify', 1) == 1
+        deltaRequested = get_optional_argument('--delta', 1) == 1
+
+        maxSessions = get_optional_argument('--max-sessions', 1024)
+        idleTimeout = get_optional_argument('--idle-timeout', 30.0)
+        maxTransfers = get_optional_argument('--max-transfers', 0)
+
+        # Worker processes, each with its own socket bound to the same port; each one can use another CPU core
+        numOfWorkers = max(get_optional_argument('--workers', 1), 1)
+
+        statsFilename = get_optional_argument('--stats', '')
+        prometheusFilename = get_optional_argument('--prometheus', '')
+        metricsInterval = get_optional_argument('--metrics-interval', 1.0)
+    except (IndexError, ValueError):
+        print('Error: Invalid arguments. Syntax: ReceiverServer.py -s <serverIPAddress> -p <serverPortNumber> [options]')
+        exit(0)
+
+    if protocolMode not in ('gbn', 'sr'):
+        print(f'Error: Unknown mode {protocolMode}; choose one of gbn, sr.')
+        exit(0)
+
+    os.makedirs(outputDirectory, exist_ok=True)
+
+    # Sessions by Sender address and by ISN, and the delayed ACK and FIN/ACK timers of all sessions, as a heap of (deadline, ISN)
+    sessions = {}
+    sessionsByIsn = {}
+    ackTimerHeap = []
+    completedTransfers = 0
+
+    # FIN/ACK is sent up to maxFinAttempts times, waiting finTimeout seconds for the last ACK of Sender after each
+    finTimeout = 1.0
+    maxFinAttempts = 5
+
+    # Uploads completed by the server, and by all of its worker processes together
+    multiprocessingContext = multiprocessing.get_context('fork')
+    totalCompletedTransfers = multiprocessingContext.Value('q', 0)
+
+    # Idle sessions are looked for every reapInterval seconds
+    reapInterval = min(1.0, idleTimeout)
+    nextReapTime = NewReceiver.get_current_time() + reapInterval
+
+    # The server counts sessions along with the transfer metrics of NewReceiver.py, and writes them all in its stats
+    TransferMetrics.counterDescriptions.update(sessionCounterDescriptions)
+    TransferMetrics.counters.update(dict.fromkeys(sessionCounterDescriptions, 0))
+
+    # Every worker process has its own socket. They are all bound before any worker starts, so that the kernel
+    #   spreads Senders over all of them from the first CONNECT on
+    if numOfWorkers > 1 and not hasattr(socket, 'SO_REUSEPORT'):
+        print('Error: --workers needs SO_REUSEPORT, which this platform does not have.')
+        exit(0)
+    try:
+        serverSockets = [create_server_socket((serverIPAddress, serverPortNumber), numOfWorkers > 1)]
+        serverPortNumber = serverSockets[0].getsockname()[1]
+        serverSockets += [create_server_socket((serverIPAddress, serverPortNumber), True) for i in range(numOfWorkers - 1)]
+    except OSError as e:
+        print(f'Error: Cannot listen on {serverIPAddress}:{serverPortNumber} - {e.strerror}.')
+        exit(0)
+
+    print(f'Receiving uploads on {serverIPAddress}:{serverPortNumber}, into {outputDirectory}')
+
+    signal.signal(signal.SIGTERM, handle_sigterm)
+
+    if numOfWorkers == 1:
+        run_server(serverSockets[0], 0)
+    else:
+        run_workers(serverSockets)
+
+    print(f'Completed transfers: {totalCompletedTransfers.value}')
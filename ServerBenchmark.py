@@ -0,0 +1,111 @@
+# ServerBenchmark.py
+
+# Usage: python3 ServerBenchmark.py [--workers N,N,...] [--senders N] [--size bytes] [--segment-size N]
+#                                   [--mode gbn|sr] [--max-window N] [--repeat N] [--seed N] [--output resultsFilename]
+# Example: python3 ServerBenchmark.py
+# Example: python3 ServerBenchmark.py --workers 1,2,4,8 --senders 64 --size 4194304
+
+# Measures how the aggregate throughput of ReceiverServer.py scales with its number of worker processes (--workers):
+# for every number of workers, --senders NewSender.py programs upload a file of --size bytes to the server at the same time,
+# on loopback, and the benchmark records:
+#   aggregate throughput (all bytes uploaded, over the time from starting the Senders until the last one is done),
+#   its speedup over the first number of workers in the list, CPU time and peak RSS of the server (all its workers together),
+#   and whether every upload arrived intact.
+# Every configuration is run --repeat times (3 by default) and the medians are kept. Results are written as JSON to resultsFilename.
+#
+# The Senders run on the same machine, and take CPU time too: the server can only scale up to the cores they leave free.
+# The number of CPU cores is printed, and stored with the results.
+
+import filecmp
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from TransferBenchmark import get_optional_argument, get_optional_list_argument, get_free_port, wait_for_process, create_input_file, get_median_result
+
+programDirectory = os.path.dirname(os.path.abspath(__file__))
+
+# Longest time the uploads of one configuration may take before they are considered stuck
+uploadTimeout = 300 # 300 seconds
+
+# ------------------------------------  Run Uploads  ------------------------------------
+
+# Upload a file of fileSize random bytes from numOfSenders Senders at once to a server with numOfWorkers workers, and measure it
+def run_uploads(numOfWorkers, numOfSenders, fileSize, segmentSize, protocolMode, maxWindowSize, seed):
+    with tempfile.TemporaryDirectory() as directory:
+        create_input_file(os.path.join(directory, 'Input.bin'), fileSize, seed)
+
+        serverPortNumber = get_free_port()
+        serverCommand = [sys.executable, os.path.join(programDirectory, 'ReceiverServer.py'), '-s', '127.0.0.1', '-p', str(serverPortNumber),
+                         '--directory', 'Output', '--mode', protocolMode, '--segment-size', str(segmentSize), '--fsync', '0',
+                         '--max-transfers', str(numOfSenders), '--workers', str(numOfWorkers), '--stats', 'ServerStats.json']
+        server = subprocess.Popen(serverCommand, cwd=directory, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        time.sleep(0.5)
+
+        startTime = time.monotonic()
+        senders = []
+        for i in range(numOfSenders):
+            senderCommand = [sys.executable, os.path.join(programDirectory, 'NewSender.py'), '-s', '127.0.0.1', '-p', '0',
+                             '-t', 'Input.bin', f'Output{i}.bin', '--max-window', str(maxWindowSize),
+                             '--connect', f'127.0.0.1:{serverPortNumber}']
+            senders.append(subprocess.Popen(senderCommand, cwd=directory, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL))
+
+        deadline = startTime + uploadTimeout
+        senderStatuses = [wait_for_process(sender, deadline)[0] for sender in senders]
+        elapsedTime = time.monotonic() - startTime
+
+        # The server stops once it has counted every upload; its CPU time includes its worker processes
+        serverStatus, serverCpuTime, serverPeakRss = wait_for_process(server, time.monotonic() + 10)
+
+        inputFilename = os.path.join(directory, 'Input.bin')
+        numOfCorrectUploads = 0
+        for i in range(numOfSenders):
+            outputFilename = os.path.join(directory, 'Output', f'Output{i}.bin')
+            if os.path.exists(outputFilename) and filecmp.cmp(inputFilename, outputFilename, shallow=False):
+                numOfCorrectUploads += 1
+
+    return {
+        'correct': numOfCorrectUploads == numOfSenders and senderStatuses.count(0) == numOfSenders and serverStatus == 0,
+        'elapsedSeconds': elapsedTime,
+        'throughputMBps': numOfSenders * fileSize / elapsedTime / 1e6,
+        'serverCpuSeconds': serverCpuTime,
+        'serverPeakRssKiB': serverPeakRss,
+    }
+
+# ------------------------------------  Main  ------------------------------------
+
+if __name__ == '__main__':
+    try:
+        workerCounts = get_optional_list_argument('--workers', [1, 2, 4])
+        numOfSenders = get_optional_argument('--senders', 32)
+        fileSize = get_optional_argument('--size', 1024 * 1024)
+        segmentSize = get_optional_argument('--segment-size', 8192)
+        protocolMode = get_optional_argument('--mode', 'gbn')
+        maxWindowSize = get_optional_argument('--max-window', 64)
+        numOfRepeats = get_optional_argument('--repeat', 3)
+        seed = get_optional_argument('--seed', 1)
+    except ValueError:
+        print('Error: Invalid arguments. Syntax: ServerBenchmark.py [--workers N,N,...] [--senders N] [--size bytes] ...')
+        exit(0)
+
+    resultsFilename = get_optional_argument('--output', 'ServerBenchmarkResults.json')
+
+    print(f'{os.cpu_count()} CPU cores, {numOfSenders} Senders of {fileSize} bytes each')
+
+    results = {'cpuCores': os.cpu_count(), 'senders': numOfSenders, 'size': fileSize, 'segmentSize': segmentSize, 'workers': {}}
+    for numOfWorkers in workerCounts:
+        runs = [run_uploads(numOfWorkers, numOfSenders, fileSize, segmentSize, protocolMode, maxWindowSize, seed + i) for i in range(numOfRepeats)]
+        result = get_median_result(runs)
+        result['speedup'] = result['throughputMBps'] / results['workers'][str(workerCounts[0])]['throughputMBps'] if results['workers'] else 1
+        results['workers'][str(numOfWorkers)] = result
+
+        print(f'workers={numOfWorkers}: {result["throughputMBps"]:0.1f} MB/s (x{result["speedup"]:0.2f}), '
+              f'server CPU {result["serverCpuSeconds"]:0.2f} s, peak RSS {result["serverPeakRssKiB"] // 1024} MiB, '
+              f'{"correct" if result["correct"] else "FAILED"}')
+
+    with open(resultsFilename, 'w') as f:
+        json.dump(results, f, indent=4)
+    print(f'Results written to {resultsFilename}')
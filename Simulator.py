@@ -0,0 +1,419 @@
+# Simulator.py
+
+# Usage: python3 Simulator.py [--size bytes] [--segment-size N] [--mode gbn|sr] [--cc fixed|reno|cubic]
+#                             [--windows N,N,...] [--rtts seconds,...] [--losses p,p,...] [--min-rtos seconds,...]
+#                             [--receiver-window N] [--sack 0|1] [--ack-every N] [--ack-delay seconds]
+#                             [--rate Mbps] [--queue-bytes N] [--jitter seconds] [--reorder p] [--duplicate p] [--corrupt p]
+#                             [--ge-p p] [--ge-r r] [--ge-loss-good p] [--ge-loss-bad p]
+#                             [--seed N] [--isn N] [--max-time seconds] [--output resultsFilename] [--prometheus metricsFilename]
+# Example: python3 Simulator.py --size 1073741824 --segment-size 65492 --rtts 0.1
+# Example: python3 Simulator.py --windows 16,64,256 --rtts 0.01,0.1 --losses 0,0.01,0.05 --min-rtos 0.005,0.2
+
+# Runs the Sender and Receiver logic of NewSender.py and NewReceiver.py in a discrete-event simulation:
+# time is a virtual clock that jumps from one event to the next (a packet arriving, or a timer timing out),
+# and packets travel over simulated links instead of sockets, so a transfer takes as long as its events take to handle,
+# however long it would take on a real network.
+#
+# The simulated links are the links of ImpairmentProxy.py: each direction has a one-way delay of half the RTT, and the
+# same loss (random, or Gilbert-Elliott with --ge-p), jitter, bandwidth cap, reordering, duplication and corruption.
+# There is no FIN, and the handshake only exchanges the ISNs (--isn, for both Sender and Receiver): the transfer starts
+#   as if the handshake had negotiated the mode, SACK and segment size given here.
+# Sender reads its input from /dev/zero, and Receiver writes its output to /dev/null, so no file of --size bytes is needed.
+#   run_simulation can read and write real files instead (inputFilename and outputFilename in its configuration).
+#
+# A simulation is run for every combination of window size, RTT, loss rate and minimum RTO.
+# Each result is one JSON line in resultsFilename, holding the statistics of Sender and Receiver in the same format as their
+#   --stats files, along with the configuration and the simulated and real time it took. The Prometheus text of the last
+#   simulation is written to metricsFilename, if given.
+
+import heapq
+import importlib.util
+import json
+import os
+import struct
+import sys
+import time
+import types
+
+import CongestionControl
+import ImpairmentProxy
+import NewReceiver
+import NewSender
+
+programDirectory = os.path.dirname(os.path.abspath(__file__))
+
+# The virtual clock, in seconds since the simulation started
+simulatedTime = 0
+
+# ------------------------------------  Handle Arguments  ------------------------------------
+
+# Get the value that follows an optional flag in sys.argv, converted to the type of defaultValue
+# If the flag is not in sys.argv, use defaultValue
+def get_optional_argument(flag, defaultValue):
+    if flag in sys.argv[1:-1]:
+        return type(defaultValue)(sys.argv[sys.argv.index(flag) + 1])
+
+    return defaultValue
+
+# Get the comma-separated list of values that follows an optional flag in sys.argv, converted to the type of defaultValues[0]
+def get_optional_list_argument(flag, defaultValues):
+    if flag in sys.argv[1:-1]:
+        return [type(defaultValues[0])(value) for value in sys.argv[sys.argv.index(flag) + 1].split(',')]
+
+    return defaultValues
+
+# ------------------------------------  Virtual Clock and Links  ------------------------------------
+
+# Get the time on the virtual clock. It replaces get_current_time in NewSender.py, NewReceiver.py and TransferMetrics.py
+def get_simulated_time():
+    global simulatedTime
+
+    return simulatedTime
+
+# Load a separate copy of TransferMetrics.py, so that Sender and Receiver each count their own metrics
+def load_transfer_metrics(name):
+    spec = importlib.util.spec_from_file_location(name, os.path.join(programDirectory, 'TransferMetrics.py'))
+    metrics = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(metrics)
+    metrics.get_current_time = get_simulated_time
+
+    return metrics
+
+# Make a socket that puts every packet sent through it on the link to destination ('sender' or 'receiver')
+# The packet is copied, like the kernel copies it, since Sender and Receiver reuse their packet buffers
+def create_simulated_socket(link, destination):
+    def sendto(packet, address):
+        ImpairmentProxy.impair_packet(link, bytes(packet), destination, address, simulatedTime)
+
+        return len(packet)
+
+    return types.SimpleNamespace(sendto=sendto)
+
+# Set up the links of ImpairmentProxy.py with the impairments of configuration; each one delays packets by half the RTT
+def setup_links(configuration):
+    ImpairmentProxy.lossRate = configuration['loss']
+    ImpairmentProxy.geGoodToBad = configuration['geGoodToBad']
+    ImpairmentProxy.geBadToGood = configuration['geBadToGood']
+    ImpairmentProxy.geLossGood = configuration['geLossGood']
+    ImpairmentProxy.geLossBad = configuration['geLossBad']
+    ImpairmentProxy.delay = configuration['rtt'] / 2
+    ImpairmentProxy.jitter = configuration['jitter']
+    ImpairmentProxy.rateInBitsPerSecond = configuration['rate'] * 1e6
+    ImpairmentProxy.queueBytes = configuration['queueBytes']
+    ImpairmentProxy.reorderRate = configuration['reorder']
+    ImpairmentProxy.reorderDelay = max(configuration['rtt'] / 2, 0.001)
+    ImpairmentProxy.duplicateRate = configuration['duplicate']
+    ImpairmentProxy.corruptRate = configuration['corrupt']
+    ImpairmentProxy.spareControlPackets = False
+    ImpairmentProxy.pendingPackets = []
+    ImpairmentProxy.packetCounter = 0
+    ImpairmentProxy.links = {
+        True: ImpairmentProxy.create_link('data', True, configuration['seed']),
+        False: ImpairmentProxy.create_link('ack', True, configuration['seed']),
+    }
+
+    return
+
+# ------------------------------------  Set Up Sender and Receiver  ------------------------------------
+
+# Set the globals of NewSender.py that its main block sets, as they are after the handshake
+def setup_sender(configuration):
+    sender = NewSender
+    sender.get_current_time = get_simulated_time
+    sender.TransferMetrics = load_transfer_metrics('SenderTransferMetrics')
+
+    sender.headerBufferSize = 15
+    sender.payloadBufferSize = configuration['segmentSize']
+    sender.messageBufferSize = sender.headerBufferSize + sender.payloadBufferSize
+    sender.synBit, sender.ackBit, sender.finBit = 0, 0, 0
+    sender.pktStruct = ImpairmentProxy.pktStruct
+    sender.sndpkt = {}
+    sender.protocolMode = configuration['mode']
+    sender.receiverWindowSize = configuration['receiverWindow']
+    sender.sackEnabled = configuration['sack'] and configuration['mode'] == 'gbn'
+    sender.sackBlockStruct = struct.Struct('!II')
+    sender.sackedSeqNums = set()
+    sender.seqNumModulus = 2 ** 32
+    sender.senderSeqNum, sender.senderAckNum = configuration['isn'], 0
+    sender.receiverIPAddress, sender.receiverPortNumber = 'receiver', 0
+    sender.UDPSocket = create_simulated_socket(ImpairmentProxy.links[True], 'receiver')
+    sender.gsoEnabled = False
+
+    # The input file; filename2 tells Receiver where to write it
+    sender.fileSize = configuration['size']
+    sender.inputFile = sender.open_input_file(configuration['inputFilename'])
+    sender.inputOffset = 0
+    sender.resumeOffset = 0
+    sender.segmentsPerBlock = 0
+    sender.segmentsInBlock = 0
+    sender.bytesInBlock = 0
+    sender.deltaPackets = None
+    sender.filename2 = configuration['outputFilename']
+    sender.filenameSent = False
+    sender.segmentIndex = 0
+    sender.numOfTotalSegments = -(-sender.fileSize // sender.payloadBufferSize)
+
+    sender.maxSenderWindowSize = configuration['window']
+    sender.congestionController = CongestionControl.create_congestion_controller(configuration['cc'], 10, sender.maxSenderWindowSize)
+    sender.duplicateAcks = 0
+    sender.cwndTrace = []
+    sender.cwndTraceInterval = 0
+    sender.maxCwndTraceLength = 1024
+    sender.transferStartTime = simulatedTime
+    sender.sendTimes = {}
+
+    sender.timerDeadline = None
+    sender.packetDeadlines = {}
+    sender.packetTimerHeap = []
+    sender.smoothedRTT = None
+    sender.rttVariation = None
+    sender.retransmissionTimeout = 1
+    sender.clockGranularity = 0.001
+    sender.minRetransmissionTimeout = configuration['minRto']
+    # Receiver would advertise its ACK delay during the handshake; it only delays ACKs in GBN mode
+    sender.peerMaxAckDelay = configuration['ackDelay'] if configuration['mode'] == 'gbn' else 0
+    sender.maxRetransmissionTimeout = 60
+
+    sender.sendBuffer = bytearray(sender.maxSenderWindowSize * sender.messageBufferSize)
+    sender.sendBufferView = memoryview(sender.sendBuffer)
+
+    sender.TransferMetrics.start_metrics('sender')
+    sender.record_congestion_window()
+
+    return
+
+# Set the globals of NewReceiver.py that its main block sets, as they are after the handshake
+def setup_receiver(configuration):
+    receiver = NewReceiver
+    receiver.get_current_time = get_simulated_time
+    receiver.TransferMetrics = load_transfer_metrics('ReceiverTransferMetrics')
+
+    receiver.headerBufferSize = 15
+    receiver.payloadBufferSize = configuration['segmentSize']
+    receiver.messageBufferSize = receiver.headerBufferSize + receiver.payloadBufferSize
+    receiver.synBit, receiver.ackBit, receiver.finBit = 0, 0, 0
+    receiver.pktStruct = ImpairmentProxy.pktStruct
+    receiver.sackBlockStruct = struct.Struct('!II')
+    receiver.maxSackBlocks = 4
+    receiver.ackBuffer = bytearray(receiver.headerBufferSize + receiver.maxSackBlocks * receiver.sackBlockStruct.size)
+    receiver.emptyPayloadChecksum = receiver.generate_checksum(b'')
+    receiver.seqNumModulus = 2 ** 32
+    receiver.receiverSeqNum, receiver.receiverAckNum = configuration['isn'], 0
+    receiver.senderIPAddress, receiver.senderPortNumber = 'sender', 0
+    receiver.UDPSocket = create_simulated_socket(ImpairmentProxy.links[False], 'sender')
+
+    receiver.protocolMode = configuration['mode']
+    receiver.receiverWindowSize = configuration['receiverWindow']
+    receiver.sackEnabled = configuration['sack'] and configuration['mode'] == 'gbn'
+    receiver.reorderBuffer = {}
+    receiver.ackEveryNPackets = configuration['ackEvery']
+    receiver.ackDelay = configuration['ackDelay']
+    receiver.writeBufferSize = 1024 * 1024
+    receiver.fsyncOutputFile = 0
+    receiver.unacknowledgedPackets = 0
+    receiver.ackDeadline = None
+
+    receiver.filename = ''
+    receiver.filenameReceived = False
+    receiver.outputFile = None
+    # The file size is not announced, since /dev/null cannot be allocated
+    receiver.fileSize = None
+    receiver.outputOffset = 0
+    receiver.outputPosition = 0
+    receiver.checkpointInterval = 0
+    receiver.checkpointFilename = ''
+    receiver.checkpointOffset = 0
+    receiver.checkpointChecksum = 0
+    receiver.resumeOffer = {}
+    receiver.segmentsPerBlock = 0
+    receiver.blockHasher = None
+    receiver.blockStartOffset = 0
+    receiver.badBlockRanges = []
+    receiver.basisFilename = ''
+    receiver.basisFile = None
+    receiver.deltaBlockSize = 0
+
+    receiver.TransferMetrics.start_metrics('receiver')
+
+    return
+
+# Exchange the SYN and SYN/ACK packets of the handshake, straight from one side to the other rather than over the links
+# Each side takes the ISN of the other from the packet it receives, as perform_three_way_handshake does; options are
+#   not negotiated, since both sides already use those of the configuration. The ACK that completes the handshake is not sent
+def simulate_handshake():
+    # Receiver sends SYN packet with its ISN (X) to Sender
+    NewReceiver.synBit = 1
+    synPacket = NewReceiver.make_pkt(b'SYN')
+    NewReceiver.receiverSeqNum += 1
+    NewReceiver.synBit = 0
+
+    # Sender sends SYN/ACK packet with its ISN (Y) and X + 1 to Receiver
+    NewSender.senderAckNum = NewSender.decompose_pkt(synPacket)[3] + 1
+    NewSender.synBit, NewSender.ackBit = 1, 1
+    synAckPacket = NewSender.make_pkt(b'SYN/ACK')
+    NewSender.senderSeqNum += 1
+    NewSender.synBit, NewSender.ackBit = 0, 0
+    NewSender.sendBase = NewSender.senderSeqNum
+    NewSender.recoverySeqNum = NewSender.senderSeqNum
+
+    # Receiver sets its ack num to Y + 1; the first packet is the filename, and file content starts with the one after it
+    NewReceiver.receiverAckNum = NewReceiver.decompose_pkt(synAckPacket)[3] + 1
+    NewReceiver.firstDataSeqNum = NewReceiver.receiverAckNum + 1
+
+    return
+
+# ------------------------------------  Simulate  ------------------------------------
+
+# Event: a packet arrives at Receiver, which handles it like perform_receiver_operation does
+def deliver_to_receiver(packet):
+    NewReceiver.TransferMetrics.count_received_packet(len(packet))
+    receivedSynBit, receivedAckBit, receivedFinBit, seqNum, ackNum, checksum, payload = NewReceiver.decompose_pkt(packet)
+    isCorrupted = NewReceiver.is_corrupted(payload, checksum)
+    if isCorrupted:
+        NewReceiver.TransferMetrics.count('corruptedPackets')
+    NewReceiver.handle_data_packet(seqNum, payload, isCorrupted)
+
+    return
+
+# Event: a packet arrives at Sender, which handles it like perform_sender_operation does
+def deliver_to_sender(packet):
+    NewSender.TransferMetrics.count_received_packet(len(packet))
+    NewSender.handle_ack_packet(packet)
+
+    return
+
+# Get the time of the next event: a packet arriving, the retransmission timer or the delayed ACK timer timing out
+# Return None if nothing is going to happen anymore
+def get_next_event_time():
+    eventTimes = [NewSender.get_next_timer_deadline(), NewReceiver.ackDeadline]
+    if ImpairmentProxy.pendingPackets:
+        eventTimes.append(ImpairmentProxy.pendingPackets[0][0])
+    eventTimes = [eventTime for eventTime in eventTimes if eventTime is not None]
+
+    return min(eventTimes) if eventTimes else None
+
+# Simulate one transfer with configuration, and return its results
+def run_simulation(configuration):
+    global simulatedTime
+
+    simulatedTime = 0
+    setup_links(configuration)
+    setup_sender(configuration)
+    setup_receiver(configuration)
+    simulate_handshake()
+
+    startTime = time.perf_counter()
+    isStalled = False
+
+    # The same events as the loop of perform_sender_operation, in the order they happen on the virtual clock
+    while not (NewSender.is_every_packet_sent() and NewSender.sendBase == NewSender.senderSeqNum):
+        # Event: Send packets to Receiver
+        NewSender.send_packets_in_window()
+
+        nextEventTime = get_next_event_time()
+        if nextEventTime is None or nextEventTime > configuration['maxTime']:
+            isStalled = True
+            break
+        simulatedTime = max(simulatedTime, nextEventTime)
+
+        # Event: Packets arrive at Sender or Receiver
+        while ImpairmentProxy.pendingPackets and ImpairmentProxy.pendingPackets[0][0] <= simulatedTime:
+            deliveryTime, counter, packet, destination, address = heapq.heappop(ImpairmentProxy.pendingPackets)
+            ImpairmentProxy.links[destination == 'receiver']['counters']['delivered'] += 1
+            if destination == 'receiver':
+                deliver_to_receiver(packet)
+            else:
+                deliver_to_sender(packet)
+
+        # Event: Delayed ACK timer times out
+        if NewReceiver.ackDeadline is not None and simulatedTime >= NewReceiver.ackDeadline:
+            NewReceiver.send_cumulative_ack()
+
+        # Event: Timeout
+        if NewSender.is_timer_expired():
+            NewSender.handle_timeout()
+
+    NewSender.inputFile.close()
+    if NewReceiver.outputFile is not None:
+        NewReceiver.close_output_file()
+
+    return {
+        'configuration': configuration,
+        'completed': not isStalled,
+        'simulatedSeconds': simulatedTime,
+        'realSeconds': time.perf_counter() - startTime,
+        'sender': NewSender.get_stats(),
+        'receiver': NewReceiver.get_stats(),
+        'links': {link['name']: link['counters'] for link in ImpairmentProxy.links.values()},
+    }
+
+if __name__ == '__main__':
+    try:
+        windowSizes = get_optional_list_argument('--windows', [256])
+        rtts = get_optional_list_argument('--rtts', [0.1])
+        lossRates = get_optional_list_argument('--losses', [0.0])
+        minRtos = get_optional_list_argument('--min-rtos', [0.005])
+
+        # Settings shared by every simulation
+        baseConfiguration = {
+            'size': get_optional_argument('--size', 100 * 1024 * 1024),
+            'segmentSize': get_optional_argument('--segment-size', 1009),
+            'mode': get_optional_argument('--mode', 'gbn'),
+            'cc': get_optional_argument('--cc', 'reno'),
+            'receiverWindow': get_optional_argument('--receiver-window', 16),
+            'sack': get_optional_argument('--sack', 1) == 1,
+            'ackEvery': get_optional_argument('--ack-every', 2),
+            'ackDelay': get_optional_argument('--ack-delay', 0.002),
+            'rate': get_optional_argument('--rate', 0.0),
+            'queueBytes': get_optional_argument('--queue-bytes', 1024 * 1024),
+            'jitter': get_optional_argument('--jitter', 0.0),
+            'reorder': get_optional_argument('--reorder', 0.0),
+            'duplicate': get_optional_argument('--duplicate', 0.0),
+            'corrupt': get_optional_argument('--corrupt', 0.0),
+            'geGoodToBad': get_optional_argument('--ge-p', 0.0),
+            'geBadToGood': get_optional_argument('--ge-r', 1.0),
+            'geLossGood': get_optional_argument('--ge-loss-good', 0.0),
+            'geLossBad': get_optional_argument('--ge-loss-bad', 1.0),
+            'seed': get_optional_argument('--seed', 1),
+            'isn': get_optional_argument('--isn', 0),
+            'inputFilename': '/dev/zero',
+            'outputFilename': os.devnull,
+            'maxTime': get_optional_argument('--max-time', 3600.0),
+        }
+    except ValueError:
+        print('Error: Invalid arguments. Syntax: Simulator.py [--size bytes] [--windows N,N,...] [--rtts seconds,...] [--losses p,p,...] ...')
+        exit(0)
+
+    if baseConfiguration['cc'] not in CongestionControl.congestionControllers:
+        print(f'Error: Unknown congestion controller {baseConfiguration["cc"]}; choose one of {", ".join(CongestionControl.congestionControllers)}.')
+        exit(0)
+
+    resultsFilename = get_optional_argument('--output', 'SimulatorResults.jsonl')
+    prometheusFilename = get_optional_argument('--prometheus', '')
+
+    with open(resultsFilename, 'w') as rf:
+        for windowSize in windowSizes:
+            for rtt in rtts:
+                for lossRate in lossRates:
+                    for minRto in minRtos:
+                        configuration = dict(baseConfiguration, window=windowSize, rtt=rtt, loss=lossRate, minRto=minRto)
+                        result = run_simulation(configuration)
+                        rf.write(json.dumps(result) + '\n')
+
+                        goodput = result['receiver']['goodputBytesPerSecond'] / 1e6
+                        status = '' if result['completed'] else ' (stalled)'
+                        print(f'window={windowSize} rtt={rtt} loss={lossRate} minRto={minRto}: {goodput:0.2f} MB/s over '
+                              f'{result["simulatedSeconds"]:0.2f} simulated s in {result["realSeconds"]:0.2f} s, '
+                              f'retransmitted {result["sender"]["counters"]["retransmittedPackets"]}, '
+                              f'timeouts {result["sender"]["counters"]["timeouts"]}{status}')
+
+    print(f'Results written to {resultsFilename}')
+
+    # Prometheus text of the last simulation, for both Sender and Receiver
+    if prometheusFilename:
+        with open(prometheusFilename, 'w') as pf:
+            pf.write(NewSender.TransferMetrics.format_prometheus())
+            pf.write(NewReceiver.TransferMetrics.format_prometheus())
+        print(f'Prometheus metrics written to {prometheusFilename}')
+
+    exit(0)
@@ -0,0 +1,72 @@
+# TraceSummarizer.py
+
+# Usage: python3 TraceSummarizer.py traceFilename
+# Example: python3 TraceSummarizer.py SenderTrace.jsonl
+
+# Summarises a trace written by NewSender.py or NewReceiver.py with --trace:
+# duration, packets and bytes in each direction, retransmissions, flags, throughput and connection events.
+
+import json
+import sys
+from collections import Counter
+
+# Read every event of the trace file filename
+def read_trace(filename):
+    events = []
+    with open(filename, 'r') as tf:
+        for line in tf:
+            if line.strip():
+                events.append(json.loads(line))
+
+    return events
+
+# Print a summary of events
+def print_summary(events):
+    duration = max((event['t'] for event in events), default=0)
+    packets = Counter()
+    packetBytes = Counter()
+    retransmits = Counter()
+    flags = Counter()
+    connectionEvents = Counter()
+
+    for event in events:
+        if 'event' in event:
+            connectionEvents[event['event']] += 1
+            continue
+
+        direction = event['dir']
+        packets[direction] += 1
+        packetBytes[direction] += event['len']
+        retransmits[direction] += event['rtx']
+        flags[(direction, event['flags'] or '-')] += 1
+
+    print(f'Duration: {duration:0.6f} s')
+    for direction in ('send', 'rcv'):
+        throughput = packetBytes[direction] / duration / 1e6 if duration > 0 else 0
+        print(f'{direction}: {packets[direction]} packets, {packetBytes[direction]} bytes, '
+              f'{retransmits[direction]} retransmitted, {throughput:0.2f} MB/s')
+        for (flagDirection, flag), count in sorted(flags.items()):
+            if flagDirection == direction:
+                print(f'    flags {flag}: {count}')
+
+    for name, count in sorted(connectionEvents.items()):
+        print(f'Event {name}: {count}')
+
+    return
+
+if __name__ == '__main__':
+    # Get the trace filename from command arguments
+    try:
+        traceFilename = sys.argv[1]
+    except IndexError:
+        print('Error: Invalid arguments. Syntax: TraceSummarizer.py <traceFilename>')
+        exit(0)
+
+    try:
+        print_summary(read_trace(traceFilename))
+    except FileNotFoundError as e:
+        print('Error: %s - %s.' % (e.filename, e.strerror))
+    except (json.JSONDecodeError, KeyError) as e:
+        print(f'Error: {traceFilename} is not a trace file ({e})')
+
+    exit(0)
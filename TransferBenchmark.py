@@ -0,0 +1,301 @@
+# TransferBenchmark.py
+
+# Usage: python3 TransferBenchmark.py [--sizes N,N,...] [--windows N,N,...] [--segments N,N,...] [--losses p,p,...]
+#                                     [--mode gbn|sr] [--repeat N] [--seed N] [--output resultsFilename]
+#                                     [--baseline baselineFilename] [--save-baseline 0|1] [--tolerance fraction]
+#                                     [--impairment "ImpairmentProxy.py options"]
+# Example: python3 TransferBenchmark.py
+# Example: python3 TransferBenchmark.py --sizes 1048576 --windows 64 --segments 1009 --losses 0,0.02 --mode sr
+# Example: python3 TransferBenchmark.py --save-baseline 1
+
+# Runs NewSender.py and NewReceiver.py against each other on loopback, for every combination of
+# file size, Sender window size, segment size and loss rate, and records for each one:
+#   throughput (file size over the receiving time), latency to first byte (from starting Receiver until
+#   the first byte of the file is delivered), CPU time and peak RSS of each program, and retransmissions.
+# Packets are lost on purpose by ImpairmentProxy.py between the two programs, which drops a random fraction of the data
+# and ACK packets. Any other impairments for every configuration (e.g. --impairment "--delay 0.01 --rate 100") are passed on to it.
+#
+# Results are written as JSON to resultsFilename, and compared with the results in baselineFilename:
+# a configuration regressed if its throughput dropped, or its latency to first byte, CPU time or peak RSS grew,
+# by more than the tolerance (a fraction, 0.5 by default). The benchmark exits with status 1 if anything regressed.
+# --save-baseline 1 stores the results as the new baseline instead, along with where they were measured ('measuredOn'):
+#   the git commit of the programs and the host. Comparing with a baseline from another host prints a warning.
+# Loopback timings vary from run to run, so every configuration is run --repeat times (3 by default) and the medians are kept.
+# The stored baseline is only meaningful on the machine it was measured on; store a new one there first.
+
+import filecmp
+import json
+import os
+import platform
+import random
+import shlex
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+programDirectory = os.path.dirname(os.path.abspath(__file__))
+
+# Longest time a single transfer may take before it is considered stuck
+transferTimeout = 300 # 300 seconds
+
+# ------------------------------------  Handle Arguments  ------------------------------------
+
+# Get the value that follows an optional flag in sys.argv, converted to the type of defaultValue
+# If the flag is not in sys.argv, use defaultValue
+def get_optional_argument(flag, defaultValue):
+    if flag in sys.argv[1:-1]:
+        return type(defaultValue)(sys.argv[sys.argv.index(flag) + 1])
+
+    return defaultValue
+
+# Get the comma-separated list of values that follows an optional flag in sys.argv, converted to the type of defaultValues[0]
+def get_optional_list_argument(flag, defaultValues):
+    if flag in sys.argv[1:-1]:
+        return [type(defaultValues[0])(value) for value in sys.argv[sys.argv.index(flag) + 1].split(',')]
+
+    return defaultValues
+
+# ------------------------------------  Run Transfers  ------------------------------------
+
+# Get a UDP port on loopback that nothing is bound to
+def get_free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as freeSocket:
+        freeSocket.bind(('127.0.0.1', 0))
+
+        return freeSocket.getsockname()[1]
+
+# Wait until process exits, and return its exit status, CPU time (user + system, in seconds) and peak RSS (in KiB)
+def wait_for_process(process, deadline):
+    while time.monotonic() < deadline:
+        pid, status, resourceUsage = os.wait4(process.pid, os.WNOHANG)
+        if pid != 0:
+            process.returncode = os.waitstatus_to_exitcode(status)
+
+            return process.returncode, resourceUsage.ru_utime + resourceUsage.ru_stime, resourceUsage.ru_maxrss
+        time.sleep(0.01)
+
+    # The transfer got stuck
+    process.kill()
+    pid, status, resourceUsage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+
+    return None, resourceUsage.ru_utime + resourceUsage.ru_stime, resourceUsage.ru_maxrss
+
+# Read the JSON stats file filename written by one of the programs, or {} if there is none
+def read_stats(filename):
+    try:
+        with open(filename, 'r') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+# Create a file of fileSize random bytes
+# It is written in small chunks, so that the peak RSS of this process (which the programs inherit when they are started) stays small
+def create_input_file(filename, fileSize, seed):
+    randomGenerator = random.Random(seed)
+    with open(filename, 'wb') as f:
+        for start in range(0, fileSize, 1024 * 1024):
+            f.write(randomGenerator.randbytes(min(1024 * 1024, fileSize - start)))
+
+    return
+
+# Transfer a file of fileSize random bytes from Sender to Receiver once, and measure it
+def run_transfer(fileSize, windowSize, segmentSize, lossRate, protocolMode, impairmentOptions, seed):
+    with tempfile.TemporaryDirectory() as directory:
+        create_input_file(os.path.join(directory, 'Input.bin'), fileSize, seed)
+
+        senderPortNumber = get_free_port()
+        receiverPortNumber = senderPortNumber
+
+        # With a loss rate or other impairments, Receiver talks to ImpairmentProxy.py instead of Sender
+        proxy = None
+        if lossRate > 0 or impairmentOptions:
+            receiverPortNumber = get_free_port()
+            proxyCommand = [sys.executable, os.path.join(programDirectory, 'ImpairmentProxy.py'), '-l', str(receiverPortNumber),
+                            '-s', '127.0.0.1', '-p', str(senderPortNumber), *impairmentOptions, '--loss', str(lossRate), '--seed', str(seed)]
+            proxy = subprocess.Popen(proxyCommand, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+        senderCommand = [sys.executable, os.path.join(programDirectory, 'NewSender.py'), '-s', '127.0.0.1', '-p', str(senderPortNumber),
+                         '-t', 'Input.bin', 'Output.bin', '--max-window', str(windowSize), '--segment-size', str(segmentSize),
+                         '--stats', 'SenderStats.json']
+        receiverCommand = [sys.executable, os.path.join(programDirectory, 'NewReceiver.py'), '-s', '127.0.0.1', '-p', str(receiverPortNumber),
+                           '--mode', protocolMode, '--window', str(windowSize), '--segment-size', str(segmentSize),
+                           '--stats', 'ReceiverStats.json']
+
+        # Sender (and the proxy) have to be bound to their ports before Receiver sends SYN
+        startTime = time.monotonic()
+        sender = subprocess.Popen(senderCommand, cwd=directory, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        time.sleep(0.3)
+        receiverStartTimestamp = time.time()
+        receiver = subprocess.Popen(receiverCommand, cwd=directory, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+        deadline = startTime + transferTimeout
+        receiverStatus, receiverCpuTime, receiverPeakRss = wait_for_process(receiver, deadline)
+        senderStatus, senderCpuTime, senderPeakRss = wait_for_process(sender, deadline)
+        elapsedTime = time.monotonic() - startTime
+
+        if proxy is not None:
+            proxy.terminate()
+            proxy.wait()
+
+        senderStats = read_stats(os.path.join(directory, 'SenderStats.json'))
+        receiverStats = read_stats(os.path.join(directory, 'ReceiverStats.json'))
+        outputFilename = os.path.join(directory, 'Output.bin')
+        isCorrect = os.path.exists(outputFilename) and filecmp.cmp(os.path.join(directory, 'Input.bin'), outputFilename, shallow=False)
+
+    receivingTime = receiverStats.get('elapsedSeconds')
+    firstByteTimestamp = receiverStats.get('firstByteTimestamp')
+
+    return {
+        'correct': isCorrect and senderStatus == 0 and receiverStatus == 0,
+        'elapsedSeconds': elapsedTime,
+        'throughputMBps': fileSize / receivingTime / 1e6 if receivingTime else None,
+        'firstByteSeconds': firstByteTimestamp - receiverStartTimestamp if firstByteTimestamp else None,
+        'senderCpuSeconds': senderCpuTime,
+        'receiverCpuSeconds': receiverCpuTime,
+        'senderPeakRssKiB': senderPeakRss,
+        'receiverPeakRssKiB': receiverPeakRss,
+        'retransmittedPackets': senderStats.get('counters', {}).get('retransmittedPackets'),
+    }
+
+# Get the median of each measurement over several runs of the same configuration (None if a run did not measure it)
+def get_median_result(runs):
+    result = {'correct': all(run['correct'] for run in runs), 'runs': len(runs)}
+    for key in runs[0]:
+        if key == 'correct':
+            continue
+        values = [run[key] for run in runs]
+        result[key] = statistics.median(values) if None not in values else None
+
+    return result
+
+# ------------------------------------  Compare With Baseline  ------------------------------------
+
+# Get where the results are measured: the git commit of the programs (with '-dirty' added if they have uncommitted
+#   changes, or '' outside a git checkout), the host name, its CPU and number of CPUs, the OS and the Python version
+def get_measurement_environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=programDirectory, capture_output=True, text=True, check=True).stdout.strip()
+        changes = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=programDirectory, capture_output=True, text=True, check=True).stdout
+    except (OSError, subprocess.CalledProcessError):
+        commit, changes = '', ''
+
+    cpu = platform.processor()
+    try:
+        with open('/proc/cpuinfo', 'r') as f:
+            cpu = next((line.split(':', 1)[1].strip() for line in f if line.startswith('model name')), cpu)
+    except OSError:
+        pass
+
+    return {
+        'commit': commit + ('-dirty' if changes else ''),
+        'host': socket.gethostname(),
+        'cpu': cpu,
+        'cpuCount': os.cpu_count(),
+        'platform': platform.platform(),
+        'python': platform.python_version(),
+        'measuredAt': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+    }
+
+# Measurements compared with the baseline: whether a higher value is better, and the smallest difference that counts
+# Small differences in latency, CPU time and RSS are mostly noise from starting the programs, and are ignored
+comparedMeasurements = {
+    'throughputMBps': (True, 0),
+    'firstByteSeconds': (False, 0.05),
+    'senderCpuSeconds': (False, 0.05),
+    'receiverCpuSeconds': (False, 0.05),
+    'senderPeakRssKiB': (False, 4096),
+    'receiverPeakRssKiB': (False, 4096),
+}
+
+# Get a description of every measurement in results that is worse than in baseline by more than tolerance
+# Only configurations are compared; 'measuredOn' in baseline is not one
+def find_regressions(results, baseline, tolerance):
+    regressions = []
+
+    for configuration, result in results.items():
+        if not result['correct']:
+            regressions.append(f'{configuration}: the transfer failed')
+            continue
+        if configuration not in baseline:
+            continue
+
+        for measurement, (isHigherBetter, minimumDifference) in comparedMeasurements.items():
+            value, baselineValue = result.get(measurement), baseline[configuration].get(measurement)
+            if value is None or not baselineValue or abs(value - baselineValue) < minimumDifference:
+                continue
+
+            change = (value - baselineValue) / baselineValue
+            if (isHigherBetter and change < -tolerance) or (not isHigherBetter and change > tolerance):
+                regressions.append(f'{configuration}: {measurement} {baselineValue:0.4g} -> {value:0.4g} ({change:+0.0%})')
+
+    return regressions
+
+if __name__ == '__main__':
+    try:
+        fileSizes = get_optional_list_argument('--sizes', [1024 * 1024, 16 * 1024 * 1024])
+        windowSizes = get_optional_list_argument('--windows', [16, 256])
+        segmentSizes = get_optional_list_argument('--segments', [1009, 65492])
+        lossRates = get_optional_list_argument('--losses', [0.0, 0.01])
+        protocolMode = get_optional_argument('--mode', 'gbn')
+        numOfRepeats = get_optional_argument('--repeat', 3)
+        seed = get_optional_argument('--seed', 1)
+        tolerance = get_optional_argument('--tolerance', 0.5)
+        saveBaseline = get_optional_argument('--save-baseline', 0) == 1
+        impairmentOptions = shlex.split(get_optional_argument('--impairment', ''))
+    except ValueError:
+        print('Error: Invalid arguments. Syntax: TransferBenchmark.py [--sizes N,N,...] [--windows N,N,...] [--segments N,N,...] [--losses p,p,...] ...')
+        exit(0)
+
+    resultsFilename = get_optional_argument('--output', 'TransferBenchmarkResults.json')
+    baselineFilename = get_optional_argument('--baseline', os.path.join(programDirectory, 'TransferBenchmarkBaseline.json'))
+
+    results = {}
+    for fileSize in fileSizes:
+        for windowSize in windowSizes:
+            for segmentSize in segmentSizes:
+                for lossRate in lossRates:
+                    configuration = f'{protocolMode} size={fileSize} window={windowSize} segment={segmentSize} loss={lossRate}'
+                    runs = [run_transfer(fileSize, windowSize, segmentSize, lossRate, protocolMode, impairmentOptions, seed + i) for i in range(numOfRepeats)]
+                    results[configuration] = get_median_result(runs)
+
+                    result = results[configuration]
+                    throughput = f'{result["throughputMBps"]:0.1f} MB/s' if result['throughputMBps'] else 'failed'
+                    firstByte = f'{result["firstByteSeconds"] * 1000:0.1f} ms' if result['firstByteSeconds'] else '-'
+                    print(f'{configuration}: {throughput}, first byte {firstByte}, '
+                          f'CPU {result["senderCpuSeconds"]:0.2f}/{result["receiverCpuSeconds"]:0.2f} s, '
+                          f'peak RSS {result["senderPeakRssKiB"] // 1024}/{result["receiverPeakRssKiB"] // 1024} MiB, '
+                          f'retransmitted {result["retransmittedPackets"]}')
+
+    with open(resultsFilename, 'w') as f:
+        json.dump(results, f, indent=4)
+    print(f'Results written to {resultsFilename}')
+
+    environment = get_measurement_environment()
+    if saveBaseline:
+        with open(baselineFilename, 'w') as f:
+            json.dump({'measuredOn': environment, **results}, f, indent=4)
+        print(f'Baseline written to {baselineFilename}, measured at commit {environment["commit"] or "unknown"} on {environment["host"]}')
+        exit(0)
+
+    try:
+        with open(baselineFilename, 'r') as f:
+            baseline = json.load(f)
+    except FileNotFoundError:
+        print(f'No baseline in {baselineFilename}; store one with --save-baseline 1')
+        exit(0)
+
+    baselineEnvironment = baseline.get('measuredOn', {})
+    if (baselineEnvironment.get('host'), baselineEnvironment.get('cpu')) != (environment['host'], environment['cpu']):
+        print(f'Warning: the baseline was measured on {baselineEnvironment.get("host", "an unknown host")} '
+              f'({baselineEnvironment.get("cpu", "unknown CPU")}), not on this host; its numbers may not compare')
+
+    regressions = find_regressions(results, baseline, tolerance)
+    for regression in regressions:
+        print(f'Regression: {regression}')
+    print(f'{len(regressions)} regressions against {baselineFilename} (tolerance {tolerance:0.0%})')
+
+    exit(1 if regressions else 0)
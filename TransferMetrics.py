@@ -0,0 +1,249 @@
+# TransferMetrics.py
+
+# Transfer metrics for NewSender.py and NewReceiver.py
+# Both programs count what happens during a transfer here: packets and bytes sent and received,
+# retransmissions, timeouts, duplicate, out-of-order and corrupted packets, RTT samples,
+# how full the Sender window is, goodput (payload bytes acknowledged by Receiver, or delivered to the output file),
+# and blocks of the file verified by Receiver.
+#
+# The metrics are available in two forms:
+#   get_stats() returns them as a dict, which the programs write to their JSON stats file (--stats)
+#   write_prometheus() writes them in the Prometheus text format, e.g. for the textfile collector of a node exporter
+#     (--prometheus). While the transfer runs, write_prometheus_if_due() rewrites the file every prometheusInterval seconds
+
+import bisect
+import os
+import time
+
+# Counters, and how they are described in the Prometheus text format
+counterDescriptions = {
+    'packetsSent': ('packets_sent_total', 'Packets sent, including retransmissions'),
+    'bytesSent': ('bytes_sent_total', 'Bytes sent, including headers and retransmissions'),
+    'packetsReceived': ('packets_received_total', 'Packets received'),
+    'bytesReceived': ('bytes_received_total', 'Bytes received, including headers'),
+    'retransmittedPackets': ('retransmitted_packets_total', 'Packets sent again after a timeout or duplicate ACKs'),
+    'retransmittedBytes': ('retransmitted_bytes_total', 'Bytes sent again after a timeout or duplicate ACKs'),
+    'timeouts': ('timeouts_total', 'Retransmission timer timeouts'),
+    'duplicatePackets': ('duplicate_packets_total', 'Packets (or ACKs) received again for a seq num already handled'),
+    'outOfOrderPackets': ('out_of_order_packets_total', 'Packets received ahead of the next expected seq num'),
+    'corruptedPackets': ('corrupted_packets_total', 'Packets dropped because their checksum did not match'),
+    'goodputBytes': ('goodput_bytes_total', 'Payload bytes acknowledged by Receiver (Sender) or delivered to the output file (Receiver)'),
+    'blocksVerified': ('blocks_verified_total', 'Blocks of the file that matched their BLAKE2b digest from Sender (Receiver)'),
+    'blocksFailed': ('blocks_failed_total', 'Blocks of the file that did not match their BLAKE2b digest from Sender (Receiver)'),
+}
+counters = dict.fromkeys(counterDescriptions, 0)
+
+# RTT histogram: rttBucketCounts[i] counts the samples up to rttBucketBounds[i] seconds (and above the previous bound)
+# The last count is for samples above every bound
+rttBucketBounds = [0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+rttBucketCounts = [0] * (len(rttBucketBounds) + 1)
+rttSum = 0
+rttMin = None
+rttMax = None
+
+# Window occupancy: packets in flight, and the Sender window they may fill, sampled every time the window is filled
+packetsInFlight = 0
+windowSize = 0
+maxPacketsInFlight = 0
+windowOccupancySum = 0
+windowOccupancySamples = 0
+
+# Role ('sender' or 'receiver') of the program, used as a Prometheus label, and when the transfer started
+metricsRole = ''
+metricsStartTime = 0
+
+# When the first goodput byte was counted: seconds since the transfer started, and as a Unix timestamp (None until then)
+firstByteTime = None
+firstByteTimestamp = None
+
+# Prometheus text file, rewritten every prometheusInterval seconds while the transfer runs ('' if not written)
+prometheusFilename = ''
+prometheusInterval = 1 # 1 second
+nextPrometheusWriteTime = 0
+
+# Get the current time in seconds on the monotonic clock
+# Simulator.py replaces this function with its virtual clock
+def get_current_time():
+    return time.monotonic()
+
+# Start counting a transfer as role, from zero. Metrics are also written to the Prometheus text file filename, unless it is ''
+def start_metrics(role, filename='', interval=1):
+    global metricsRole, metricsStartTime, prometheusFilename, prometheusInterval, nextPrometheusWriteTime, firstByteTime, firstByteTimestamp
+    global rttSum, rttMin, rttMax, packetsInFlight, windowSize, maxPacketsInFlight, windowOccupancySum, windowOccupancySamples
+
+    for name in counters:
+        counters[name] = 0
+    rttBucketCounts[:] = [0] * len(rttBucketCounts)
+    rttSum, rttMin, rttMax = 0, None, None
+    packetsInFlight, windowSize, maxPacketsInFlight, windowOccupancySum, windowOccupancySamples = 0, 0, 0, 0, 0
+    firstByteTime, firstByteTimestamp = None, None
+
+    metricsRole = role
+    metricsStartTime = get_current_time()
+    prometheusFilename = filename
+    prometheusInterval = interval
+    nextPrometheusWriteTime = metricsStartTime
+
+    return
+
+# Add amount to the counter called name
+def count(name, amount=1):
+    counters[name] += amount
+
+    return
+
+# Count numOfBytes bytes of goodput, remembering when the first one arrived
+def count_goodput(numOfBytes):
+    global firstByteTime, firstByteTimestamp
+
+    if firstByteTime is None:
+        firstByteTime = get_elapsed_time()
+        firstByteTimestamp = time.time()
+    counters['goodputBytes'] += numOfBytes
+
+    return
+
+# Count a packet of length bytes that was sent; isRetransmit marks packets that were sent before
+def count_sent_packet(length, isRetransmit):
+    counters['packetsSent'] += 1
+    counters['bytesSent'] += length
+    if isRetransmit:
+        counters['retransmittedPackets'] += 1
+        counters['retransmittedBytes'] += length
+
+    return
+
+# Count a packet of length bytes that was received
+def count_received_packet(length):
+    counters['packetsReceived'] += 1
+    counters['bytesReceived'] += length
+
+    return
+
+# Add an RTT sample (in seconds) to the RTT histogram
+def observe_rtt(rtt):
+    global rttSum, rttMin, rttMax
+
+    rttBucketCounts[bisect.bisect_left(rttBucketBounds, rtt)] += 1
+    rttSum += rtt
+    rttMin = rtt if rttMin is None else min(rttMin, rtt)
+    rttMax = rtt if rttMax is None else max(rttMax, rtt)
+
+    return
+
+# Sample how many packets are in flight, out of a Sender window of window packets
+# Right after a loss shrinks the window, more packets than it holds can still be in flight; that counts as a full window
+def observe_window(inFlight, window):
+    global packetsInFlight, windowSize, maxPacketsInFlight, windowOccupancySum, windowOccupancySamples
+
+    packetsInFlight = inFlight
+    windowSize = window
+    maxPacketsInFlight = max(maxPacketsInFlight, inFlight)
+    windowOccupancySum += min(inFlight / window, 1)
+    windowOccupancySamples += 1
+
+    return
+
+# Get the number of seconds since the transfer started
+def get_elapsed_time():
+    global metricsStartTime
+
+    return get_current_time() - metricsStartTime
+
+# Get the goodput so far, in bytes per second
+def get_goodput():
+    elapsedTime = get_elapsed_time()
+
+    return counters['goodputBytes'] / elapsedTime if elapsedTime > 0 else 0
+
+# Get every metric as a dict, e.g. for writing to a JSON stats file
+def get_stats():
+    global firstByteTime, firstByteTimestamp, rttSum, rttMin, rttMax, packetsInFlight, windowSize, maxPacketsInFlight, windowOccupancySum, windowOccupancySamples
+
+    numOfRttSamples = sum(rttBucketCounts)
+    rttHistogram = {str(bound): bucketCount for bound, bucketCount in zip(rttBucketBounds + ['+Inf'], rttBucketCounts)}
+
+    return {
+        'role': metricsRole,
+        'elapsedSeconds': get_elapsed_time(),
+        'goodputBytesPerSecond': get_goodput(),
+        'firstByteSeconds': firstByteTime,
+        'firstByteTimestamp': firstByteTimestamp,
+        'counters': dict(counters),
+        'rtt': {
+            'samples': numOfRttSamples,
+            'minSeconds': rttMin,
+            'meanSeconds': rttSum / numOfRttSamples if numOfRttSamples else None,
+            'maxSeconds': rttMax,
+            'histogram': rttHistogram,
+        },
+        'window': {
+            'packetsInFlight': packetsInFlight,
+            'windowSize': windowSize,
+            'maxPacketsInFlight': maxPacketsInFlight,
+            'meanOccupancy': windowOccupancySum / windowOccupancySamples if windowOccupancySamples else None,
+        },
+    }
+
+# Format every metric in the Prometheus text format
+def format_prometheus():
+    global rttSum, packetsInFlight, windowSize, windowOccupancySum, windowOccupancySamples
+
+    label = f'role="{metricsRole}"'
+    lines = []
+
+    # Add one metric with its HELP and TYPE lines, and its samples as (suffix, extra labels, value)
+    def add_metric(name, metricType, description, samples):
+        lines.append(f'# HELP gbn_{name} {description}')
+        lines.append(f'# TYPE gbn_{name} {metricType}')
+        for suffix, extraLabels, value in samples:
+            lines.append(f'gbn_{name}{suffix}{{{label}{extraLabels}}} {value}')
+
+        return
+
+    for counterName, (name, description) in counterDescriptions.items():
+        add_metric(name, 'counter', description, [('', '', counters[counterName])])
+
+    add_metric('goodput_bytes_per_second', 'gauge', 'Goodput since the transfer started', [('', '', get_goodput())])
+    add_metric('packets_in_flight', 'gauge', 'Packets sent but not yet acknowledged', [('', '', packetsInFlight)])
+    add_metric('window_size_packets', 'gauge', 'Packets the Sender window may hold in flight', [('', '', windowSize)])
+    meanOccupancy = windowOccupancySum / windowOccupancySamples if windowOccupancySamples else 0
+    add_metric('window_occupancy_ratio', 'gauge', 'Mean fraction of the Sender window in flight', [('', '', meanOccupancy)])
+
+    # Histogram buckets are cumulative in the Prometheus text format
+    rttSamples = []
+    cumulativeCount = 0
+    for bound, bucketCount in zip(rttBucketBounds + ['+Inf'], rttBucketCounts):
+        cumulativeCount += bucketCount
+        rttSamples.append(('_bucket', f',le="{bound}"', cumulativeCount))
+    rttSamples.append(('_sum', '', rttSum))
+    rttSamples.append(('_count', '', cumulativeCount))
+    add_metric('rtt_seconds', 'histogram', 'Round-trip time of acknowledged packets that were sent once', rttSamples)
+
+    return '\n'.join(lines) + '\n'
+
+# Write every metric to the Prometheus text file
+# The file is replaced in one step, so that a scraper never reads a half-written file
+def write_prometheus():
+    global prometheusFilename, nextPrometheusWriteTime, prometheusInterval
+
+    if not prometheusFilename:
+        return
+
+    temporaryFilename = prometheusFilename + '.tmp'
+    with open(temporaryFilename, 'w') as pf:
+        pf.write(format_prometheus())
+    os.replace(temporaryFilename, prometheusFilename)
+
+    nextPrometheusWriteTime = get_current_time() + prometheusInterval
+
+    return
+
+# Write the Prometheus text file if prometheusInterval seconds have passed since it was last written
+def write_prometheus_if_due():
+    global prometheusFilename, nextPrometheusWriteTime
+
+    if prometheusFilename and get_current_time() >= nextPrometheusWriteTime:
+        write_prometheus()
+
+    return
@@ -0,0 +1,100 @@
+# WriterBenchmark.py
+
+# Usage: python3 WriterBenchmark.py [fileSizeInBytes ...]
+# Example: python3 WriterBenchmark.py 895309 2147483648
+
+# Measures how many MB/s of received payload Receiver can write to its output file,
+# comparing the old deliver_data (open, append and close the file for every packet)
+# with the output file of NewReceiver.py itself: open_output_file allocates it at the size Sender announced,
+# deliver_data writes every packet through its 1 MiB write buffer, and close_output_file fsyncs it at FIN.
+# The MB/s of NewReceiver.py are the goodput bytes it counted, over the time from opening the file to closing it.
+# Payloads are delivered in order, each payloadBufferSize bytes but the last, as the default segment size gives them.
+
+import os
+import sys
+import tempfile
+import time
+
+import NewReceiver
+import TransferMetrics
+
+payloadBufferSize = 1009 # 1009 bytes
+writeBufferSize = 1024 * 1024 # 1 MiB
+
+# Old way: open the output file in append mode for every packet. Return the number of bytes written
+def write_with_open_per_packet(filename, fileSize):
+    for payload in get_payloads(fileSize):
+        with open(filename, 'ab') as bf:
+            bf.write(payload)
+
+    return fileSize
+
+# Set the globals of NewReceiver.py that its main block and handshake set, for a transfer of fileSize bytes
+#   whose size Sender announced, without block digests, fsyncing the output file at FIN as it does by default
+def setup_receiver(fileSize):
+    receiver = NewReceiver
+
+    receiver.writeBufferSize = writeBufferSize
+    receiver.fsyncOutputFile = 1
+    receiver.fileSize = fileSize
+    receiver.outputOffset = 0
+    receiver.outputPosition = 0
+    receiver.blockHasher = None
+
+    TransferMetrics.start_metrics('receiver')
+
+    return
+
+# Write a file of fileSize bytes with NewReceiver.py: open the output file, deliver every payload in order, and close it
+#   as at FIN. Return the number of bytes NewReceiver.py counted as received
+def write_with_receiver(filename, fileSize):
+    setup_receiver(fileSize)
+    NewReceiver.outputFile = NewReceiver.open_output_file(filename)
+    for payload in get_payloads(fileSize):
+        NewReceiver.deliver_data(payload)
+    NewReceiver.close_output_file()
+
+    return TransferMetrics.counters['goodputBytes']
+
+# Get the payloads of a file of fileSize bytes: full segments, and a shorter last one
+def get_payloads(fileSize):
+    payload = bytes(payloadBufferSize)
+    numOfFullPackets, lastPayloadSize = divmod(fileSize, payloadBufferSize)
+
+    for i in range(numOfFullPackets):
+        yield payload
+    if lastPayloadSize:
+        yield payload[:lastPayloadSize]
+
+    return
+
+# Write a file of fileSize bytes with writeFile into a new temporary file, and return the MB/s of the bytes it wrote
+def measure_megabytes_per_second(writeFile, fileSize):
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, 'OutputBenchmark')
+
+        startTime = time.perf_counter()
+        numOfBytes = writeFile(filename, fileSize)
+        endTime = time.perf_counter()
+
+    return numOfBytes / (endTime - startTime) / 1e6
+
+if __name__ == '__main__':
+    try:
+        # By default, measure an apple.jpg-sized file and a 2 GiB file
+        fileSizes = [int(arg) for arg in sys.argv[1:]] or [895309, 2 * 1024 ** 3]
+    except ValueError:
+        print('Error: Invalid arguments. Syntax: WriterBenchmark.py [fileSizeInBytes ...]')
+        exit(0)
+
+    for fileSize in fileSizes:
+        numOfPackets = -(-fileSize // payloadBufferSize)
+
+        before = measure_megabytes_per_second(write_with_open_per_packet, fileSize)
+        after = measure_megabytes_per_second(write_with_receiver, fileSize)
+
+        print(f'{fileSize} bytes ({numOfPackets} packets):')
+        print(f'    open per packet:  {before:0.1f} MB/s')
+        print(f'    NewReceiver.py:   {after:0.1f} MB/s')
+
+    exit(0)
@@ -0,0 +1,138 @@
+# test_sequence_numbers.py
+
+# Usage: python3 -m unittest test_sequence_numbers (or python3 -m pytest test_sequence_numbers.py)
+
+# Tests that sequence numbers keep working when they wrap around at 2^32: wrapping and unwrapping them in NewSender.py
+# and NewReceiver.py, SACK blocks that span the wrap, the ISNs each side learns in the handshake, and whole transfers
+# simulated with Simulator.py from an ISN just below 2^32.
+
+import os
+import struct
+import tempfile
+import unittest
+
+import NewReceiver
+import NewSender
+import Simulator
+
+seqNumModulus = 2 ** 32
+
+# An ISN that makes the seq nums of a transfer wrap around after its first packets
+isnNearWrap = seqNumModulus - 3
+
+# Get a configuration for Simulator.run_simulation, with the settings of Simulator.py by default
+def make_configuration(**settings):
+    configuration = {
+        'size': 0, 'segmentSize': 1009, 'mode': 'gbn', 'cc': 'reno', 'receiverWindow': 16, 'sack': True,
+        'ackEvery': 2, 'ackDelay': 0.002, 'rate': 0.0, 'queueBytes': 1024 * 1024, 'jitter': 0.0, 'reorder': 0.0,
+        'duplicate': 0.0, 'corrupt': 0.0, 'geGoodToBad': 0.0, 'geBadToGood': 1.0, 'geLossGood': 0.0, 'geLossBad': 1.0,
+        'seed': 1, 'isn': 0, 'inputFilename': '/dev/zero', 'outputFilename': os.devnull,
+        'window': 64, 'rtt': 0.01, 'loss': 0.0, 'minRto': 0.005, 'maxTime': 600.0,
+    }
+    configuration.update(settings)
+
+    return configuration
+
+class WrapSeqNumTest(unittest.TestCase):
+    def setUp(self):
+        NewSender.seqNumModulus = seqNumModulus
+        NewReceiver.seqNumModulus = seqNumModulus
+
+    def test_wrap_seq_num(self):
+        for program in (NewSender, NewReceiver):
+            self.assertEqual(program.wrap_seq_num(seqNumModulus - 1), seqNumModulus - 1)
+            self.assertEqual(program.wrap_seq_num(seqNumModulus), 0)
+            self.assertEqual(program.wrap_seq_num(seqNumModulus + 5), 5)
+            self.assertEqual(program.wrap_seq_num(3 * seqNumModulus + 7), 7)
+
+    def test_unwrap_seq_num_across_the_wrap(self):
+        for program in (NewSender, NewReceiver):
+            # Ahead of the reference, past the wrap
+            self.assertEqual(program.unwrap_seq_num(2, seqNumModulus - 2), seqNumModulus + 2)
+            # Behind the reference, before the wrap
+            self.assertEqual(program.unwrap_seq_num(seqNumModulus - 2, seqNumModulus + 2), seqNumModulus - 2)
+            # After the seq nums have wrapped more than once
+            self.assertEqual(program.unwrap_seq_num(10, 3 * seqNumModulus - 10), 3 * seqNumModulus + 10)
+            # Without a wrap
+            self.assertEqual(program.unwrap_seq_num(100, 90), 100)
+            self.assertEqual(program.unwrap_seq_num(90, 100), 90)
+
+    def test_unwrap_inverts_wrap(self):
+        for program in (NewSender, NewReceiver):
+            for seqNum in range(isnNearWrap - 10, isnNearWrap + 10):
+                for referenceSeqNum in (seqNum - 1000, seqNum, seqNum + 1000):
+                    self.assertEqual(program.unwrap_seq_num(program.wrap_seq_num(seqNum), referenceSeqNum), seqNum)
+
+class SackBlocksTest(unittest.TestCase):
+    def test_sack_blocks_across_the_wrap(self):
+        NewReceiver.seqNumModulus = NewSender.seqNumModulus = seqNumModulus
+        NewReceiver.headerBufferSize = NewSender.headerBufferSize = 15
+        NewReceiver.pktStruct = NewSender.pktStruct = struct.Struct('!BBBIII')
+        NewReceiver.sackBlockStruct = NewSender.sackBlockStruct = struct.Struct('!II')
+        NewReceiver.maxSackBlocks = 4
+        NewReceiver.ackBuffer = bytearray(NewReceiver.headerBufferSize + NewReceiver.maxSackBlocks * NewReceiver.sackBlockStruct.size)
+        NewReceiver.emptyPayloadChecksum = NewReceiver.generate_checksum(b'')
+        NewReceiver.synBit, NewReceiver.ackBit, NewReceiver.finBit = 0, 1, 0
+        NewReceiver.sackEnabled = True
+
+        # Receiver waits for the packet just before the wrap, and holds packets on both sides of it
+        NewReceiver.receiverSeqNum, NewReceiver.receiverAckNum = 100, seqNumModulus - 3
+        NewReceiver.reorderBuffer = dict.fromkeys([seqNumModulus - 1, seqNumModulus, seqNumModulus + 1, seqNumModulus + 5], 0)
+        ackPacket = bytes(NewReceiver.make_ack_pkt())
+
+        NewSender.senderSeqNum, NewSender.senderAckNum = seqNumModulus + 10, 100
+        NewSender.sendBase = seqNumModulus - 2
+        receivedSynBit, receivedAckBit, receivedFinBit, seqNum, ackNum, checksum, payload = NewSender.decompose_pkt(ackPacket)
+
+        self.assertFalse(NewSender.is_corrupted(payload, checksum))
+        self.assertEqual(ackNum, seqNumModulus - 3)
+        self.assertEqual(NewSender.decode_sack_blocks(payload), [(seqNumModulus - 1, seqNumModulus + 2), (seqNumModulus + 5, seqNumModulus + 6)])
+
+class SimulatedTransferTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.inputFilename = os.path.join(self.directory.name, 'Input.bin')
+        self.outputFilename = os.path.join(self.directory.name, 'Output.bin')
+        with open(self.inputFilename, 'wb') as f:
+            f.write(os.urandom(300 * 1009 + 123))
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_handshake_sets_ack_nums_to_isn_plus_one(self):
+        configuration = make_configuration(isn=isnNearWrap, size=os.path.getsize(self.inputFilename),
+                                           inputFilename=self.inputFilename, outputFilename=self.outputFilename)
+        Simulator.setup_links(configuration)
+        Simulator.setup_sender(configuration)
+        Simulator.setup_receiver(configuration)
+        Simulator.simulate_handshake()
+        NewSender.inputFile.close()
+
+        # Both sides use the same ISN, and have each sent one phantom byte for their SYN
+        self.assertEqual(NewSender.senderAckNum, isnNearWrap + 1)
+        self.assertEqual(NewReceiver.receiverAckNum, isnNearWrap + 1)
+        self.assertEqual(NewSender.senderSeqNum, isnNearWrap + 1)
+        self.assertEqual(NewReceiver.receiverSeqNum, isnNearWrap + 1)
+
+    def check_transfer(self, **settings):
+        configuration = make_configuration(isn=isnNearWrap, size=os.path.getsize(self.inputFilename),
+                                           inputFilename=self.inputFilename, outputFilename=self.outputFilename, **settings)
+        result = Simulator.run_simulation(configuration)
+
+        self.assertTrue(result['completed'])
+        # Every seq num of the transfer is past the wrap, apart from the first ones
+        self.assertGreater(NewSender.senderSeqNum, seqNumModulus)
+        with open(self.inputFilename, 'rb') as inputFile, open(self.outputFilename, 'rb') as outputFile:
+            self.assertEqual(outputFile.read(), inputFile.read())
+
+    def test_gbn_transfer_across_the_wrap(self):
+        self.check_transfer(mode='gbn', sack=False)
+
+    def test_gbn_sack_transfer_across_the_wrap_with_loss(self):
+        self.check_transfer(mode='gbn', sack=True, loss=0.05, reorder=0.05)
+
+    def test_sr_transfer_across_the_wrap_with_loss(self):
+        self.check_transfer(mode='sr', loss=0.05, reorder=0.05, duplicate=0.02)
+
+if __name__ == '__main__':
+    unittest.main()